@@ -0,0 +1,115 @@
+"""Admission control for the password hashing routes.
+
+Every login or registration POST costs a full bcrypt computation. Without a
+limit a burst of them queues up behind the hashing pool until the whole
+process stops answering. AdmissionController caps how many of these requests
+run at once, lets a few more wait briefly, and sheds the rest with a 503 so
+other routes keep their latency.
+
+Each app has its own controller in app.extensions["admission"]; `admission`
+is the current app's, and @limit puts a view behind it.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request
+from werkzeug.local import LocalProxy
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; retry_after is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Limit concurrent requests on a path, with a short deadline-bound wait queue."""
+
+    def __init__(self, app=None):
+        self.max_concurrent = os.cpu_count() or 1
+        self.max_queue = self.max_concurrent * 2
+        self.queue_timeout = 0.5
+        self.retry_after = 1
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._counts = {"admitted": 0, "queued": 0, "shed": 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read limits from app.config."""
+
+        self.max_concurrent = app.config.setdefault("ADMISSION_MAX_CONCURRENT", self.max_concurrent)
+        self.max_queue = app.config.setdefault("ADMISSION_MAX_QUEUE", self.max_concurrent * 2)
+        self.queue_timeout = app.config.setdefault("ADMISSION_QUEUE_TIMEOUT", self.queue_timeout)
+        self.retry_after = app.config.setdefault("ADMISSION_RETRY_AFTER", self.retry_after)
+
+        app.extensions["admission"] = self
+
+    def _shed(self):
+        self._counts["shed"] += 1
+        raise Overloaded(self.retry_after)
+
+    @contextmanager
+    def admit(self):
+        """Hold a slot for the duration of the block, or raise Overloaded."""
+
+        with self._cond:
+            if self._active >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self._shed()
+
+                self._waiting += 1
+                self._counts["queued"] += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed()
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._active += 1
+            self._counts["admitted"] += 1
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify()
+
+    def stats(self):
+        """Return the admitted/queued/shed counters and current load."""
+
+        with self._cond:
+            return dict(self._counts, active=self._active, waiting=self._waiting)
+
+
+# the current app's controller
+admission = LocalProxy(lambda: current_app.extensions["admission"])
+
+
+def limit(view):
+    """Decorate a view so its POST requests go through the app's admission control."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != "POST":
+            return view(*args, **kwargs)
+
+        with admission.admit():
+            return view(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,269 @@
+"""JSON API for feedback.
+
+    GET    /api/users/<username>/feedback?after=<id>&limit=<n>   one page, with an ETag
+    POST   /api/users/<username>/feedback                        create one item, or a list of them
+    GET    /api/feedback/<id>                                    one item, with an ETag
+    PATCH  /api/feedback/<id>                                    update title and/or content
+    DELETE /api/feedback/<id>                                    delete one item
+    POST   /api/feedback/delete  {"ids": [...]}                  delete several items
+
+Requests are authenticated by the same session as the HTML views, and the
+same rule applies: only the owner may see or change their feedback. Writes
+must send JSON, which a cross-site form can't, so they need no CSRF token.
+
+ETags come from the ids and row versions of what a response holds, so an
+unchanged page costs one narrow query and a 304, with no titles or content
+loaded or sent. PATCH and DELETE honour If-Match, answering 412 when the
+item changed since the client read it.
+"""
+
+import hashlib
+
+from flask import Blueprint, current_app, jsonify, request, session, abort
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from sqlalchemy.orm.exc import StaleDataError
+
+from models import db, User, Feedback
+from cache import user_page_cache
+from forms import AddFeedbackForm, EditFeedbackForm
+
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+
+# 404 too, or the app's own 404 page would win: handlers by code come before handlers by class
+@api.errorhandler(404)
+@api.errorhandler(HTTPException)
+def json_error(e):
+    # abort(response) already carries a full JSON response
+    if e.response is not None:
+        return e.response
+    return jsonify(error=e.description), e.code
+
+
+def _serialize(feedback):
+    return {"id": feedback.id, "title": feedback.title, "content": feedback.content,
+            "username": feedback.username, "version": feedback.version_id}
+
+
+def _etag(versions):
+    """Return a strong ETag for a list of (id, version) pairs."""
+
+    return hashlib.sha1(repr(list(versions)).encode()).hexdigest()
+
+
+def _logged_in():
+    """Return the session's username, or answer 401."""
+
+    username = session.get("user_id")
+    if username is None:
+        abort(401, "Log in first.")
+    return username
+
+
+def _check_owner(username):
+    if _logged_in() != username:
+        abort(403, "That feedback belongs to another user.")
+
+
+def _get_owned(id):
+    """Return feedback item id if the session user owns it, or answer 404/403."""
+
+    feedback = Feedback.query.get(id)
+    if feedback is None:
+        abort(404, f"Feedback item {id} does not exist.")
+    _check_owner(feedback.username)
+    return feedback
+
+
+def _json_body():
+    if not request.is_json:
+        abort(415, "Send a JSON body.")
+    return request.get_json()
+
+
+def _validate(form_class, data):
+    """Validate a dict with the HTML form's rules; answer 400 with its errors if they fail."""
+
+    if not isinstance(data, dict):
+        abort(400, "Expected a JSON object.")
+    # anything but a string counts as missing
+    fields = MultiDict({key: value for key, value in data.items() if isinstance(value, str)})
+    form = form_class(formdata=fields, meta={"csrf": False})
+    if not form.validate():
+        response = jsonify(error="Invalid feedback.", fields=form.errors)
+        response.status_code = 400
+        abort(response)
+    return {"title": form.title.data, "content": form.content.data}
+
+
+def _check_if_match(feedback):
+    if request.if_match and not request.if_match.contains(_etag([(feedback.id, feedback.version_id)])):
+        abort(412, f"Feedback item {feedback.id} has changed.")
+
+
+def _flush_unless_stale(id):
+    """Flush, answering 412 if another request changed item id since it was loaded."""
+
+    try:
+        db.session.flush()
+    except StaleDataError:
+        db.session.rollback()
+        abort(412, f"Feedback item {id} has changed.")
+
+
+@api.route("/users/<username>/feedback")
+def list_feedback(username):
+    """Return a page of a user's feedback, or 304 if it is unchanged."""
+
+    _check_owner(username)
+
+    limit = request.args.get("limit", current_app.config["FEEDBACK_PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, current_app.config["FEEDBACK_PAGE_MAX"]))
+    after = request.args.get("after", 0, type=int)
+
+    # only ids and versions until the ETag check; titles and content may be large
+    versions = (db.session.query(Feedback.id, Feedback.version_id)
+                .filter(Feedback.username == username, Feedback.id > after)
+                .order_by(Feedback.id)
+                .limit(limit + 1)
+                .all())
+    has_next = len(versions) > limit
+    versions = [tuple(row) for row in versions[:limit]]
+
+    etag = _etag(versions)
+    if request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    items = (Feedback.query.filter(Feedback.id.in_([id for id, _ in versions]))
+             .order_by(Feedback.id).all()) if versions else []
+
+    response = jsonify(items=[_serialize(feedback) for feedback in items],
+                       next_after=versions[-1][0] if has_next else None)
+    response.set_etag(etag)
+    return response
+
+
+@api.route("/users/<username>/feedback", methods=["POST"])
+def create_feedback(username):
+    """Create one feedback item from an object, or several from a list, in one INSERT."""
+
+    _check_owner(username)
+    # a session can outlive its user; their feedback would break the foreign key
+    if User.query.get(username) is None:
+        abort(404, f"User {username} does not exist.")
+
+    body = _json_body()
+    many = isinstance(body, list)
+    items = body if many else [body]
+
+    if not 0 < len(items) <= current_app.config["API_BATCH_MAX"]:
+        abort(400, f"Send between 1 and {current_app.config['API_BATCH_MAX']} items.")
+
+    rows = [dict(_validate(AddFeedbackForm, item), username=username, version_id=1) for item in items]
+
+    if db.engine.dialect.full_returning:
+        created = db.session.execute(Feedback.__table__.insert().values(rows)
+                                     .returning(*Feedback.__table__.c)).all()
+    else:
+        created = [Feedback(**row) for row in rows]
+        db.session.add_all(created)
+        db.session.flush()
+
+    created = [_serialize(feedback) for feedback in created]
+    db.session.commit()
+    user_page_cache.invalidate(username)
+
+    return jsonify(items=created) if many else jsonify(created[0]), 201
+
+
+@api.route("/feedback/<int:id>")
+def get_feedback(id):
+    """Return one feedback item, or 304 if it is unchanged."""
+
+    feedback = _get_owned(id)
+
+    etag = _etag([(feedback.id, feedback.version_id)])
+    if request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    response = jsonify(_serialize(feedback))
+    response.set_etag(etag)
+    return response
+
+
+@api.route("/feedback/<int:id>", methods=["PATCH"])
+def update_feedback(id):
+    """Update the title and/or content of a feedback item."""
+
+    feedback = _get_owned(id)
+    _check_if_match(feedback)
+
+    body = _json_body()
+    if not isinstance(body, dict):
+        abort(400, "Expected a JSON object.")
+    changes = _validate(EditFeedbackForm, {"title": feedback.title, "content": feedback.content, **body})
+
+    feedback.title = changes["title"]
+    feedback.content = changes["content"]
+    _flush_unless_stale(id)
+
+    response = jsonify(_serialize(feedback))
+    response.set_etag(_etag([(feedback.id, feedback.version_id)]))
+    username = feedback.username
+
+    db.session.commit()
+    user_page_cache.invalidate(username)
+    return response
+
+
+@api.route("/feedback/<int:id>", methods=["DELETE"])
+def delete_feedback(id):
+    """Delete a feedback item."""
+
+    feedback = _get_owned(id)
+    _check_if_match(feedback)
+
+    username = feedback.username
+    db.session.delete(feedback)
+    _flush_unless_stale(id)
+    db.session.commit()
+    user_page_cache.invalidate(username)
+
+    return "", 204
+
+
+@api.route("/feedback/delete", methods=["POST"])
+def delete_feedback_batch():
+    """
+    Delete several feedback items in one statement. Nothing is deleted if
+    any of them belongs to another user; ids that don't exist are reported.
+    """
+
+    username = _logged_in()
+
+    body = _json_body()
+    ids = body.get("ids") if isinstance(body, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+        abort(400, 'Send {"ids": [...]}.')
+    if not 0 < len(ids) <= current_app.config["API_BATCH_MAX"]:
+        abort(400, f"Send between 1 and {current_app.config['API_BATCH_MAX']} ids.")
+
+    owners = dict(db.session.query(Feedback.id, Feedback.username).filter(Feedback.id.in_(ids)))
+    if any(owner != username for owner in owners.values()):
+        abort(403, "Some of that feedback belongs to another user.")
+
+    if owners:
+        Feedback.query.filter(Feedback.id.in_(list(owners))).delete(synchronize_session=False)
+        db.session.commit()
+        user_page_cache.invalidate(username)
+
+    return jsonify(deleted=sorted(owners), not_found=sorted(set(ids) - set(owners)))
+
+
+def init_app(app):
+    """Register the API on app."""
+
+    app.config.setdefault("API_BATCH_MAX", 100)
+    app.register_blueprint(api)
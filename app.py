@@ -1,257 +1,102 @@
-from flask import Flask, render_template, flash, redirect, render_template, session, request
-from flask_debugtoolbar import DebugToolbarExtension
-from models import db, connect_db, User, Feedback
-
-from forms import AddUserForm, LoginUserForm, AddFeedbackForm, EditFeedbackForm
-
-app = Flask(__name__)
-app.config["SECRET_KEY"] = "oh-so-secret"
-app.config["SQLALCHEMY_DATABASE_URI"] = "postgresql:///hashing_db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = False
-
-debug = DebugToolbarExtension(app)
-
-connect_db(app)
-
-# app name
-@app.errorhandler(404)
-def not_found(e):
-    return render_template("404.html")
-
-@app.route("/")
-def show_index():
-    """Redirect to /register."""
-    
-    if session.get("user_id"):
-        user = User.query.get_or_404(session["user_id"])
-        
-        # if user is logged in, redirect to user page
-        return redirect(f'/users/{user}')
-    
-    return redirect("/register")
-
-@app.route("/register", methods=["GET", "POST"])
-def handle_register():
-    """Handle GET and POST requests to /register."""
-    
-    form = AddUserForm()
-
-    if form.validate_on_submit():
-        username = form.username.data
-        password = form.password.data
-        email = form.email.data
-        first_name = form.first_name.data
-        last_name = form.last_name.data
-
-        user = User.register(username=username, password=password, email=email, first_name=first_name, last_name=last_name)
-        db.session.add(user)
-        db.session.commit()
-
-        session["user_id"] = user.username
-        return redirect(f"/users/{user.username}")
-    
-    else:
-        return render_template("register.html", form=form)
-    
-@app.route("/login", methods=["GET", "POST"])
-def handle_login():
-    """Handle GET and POST requests to /login."""
-    
-    form = LoginUserForm()
-
-    if form.validate_on_submit():
-        username = form.username.data
-        password = form.password.data
-
-        user = User.authenticate(username=username, password=password)
-
-        if user:
-            session["user_id"] = user.username
-            return redirect(f"/users/{username}")
-        
-        else:
-            flash("Wrong username or password.", "error")
-            form.username.errors = ["Bad name/password"]
-        
-    return render_template("login.html", form=form)
-
-    
-@app.route("/users/<username>")
-def show_user_details(username):
-    """Return the text “You made it!”"""
-    
-    # Show user details if session id matches user url
-    if session.get("user_id") == username:
-        user = User.query.get(username)
-        return render_template("user.html", user=user)
-    
-    # else redirect them to their own user details if they are a different user
-    elif session.get("user_id"):
-        user = session["user_id"]
-        return redirect(f"/users/{user}")
-    
-    # else redirect to home if they are not logged in
-    else:
-        return redirect("/")
-
-@app.route("/users/<username>/delete", methods=["GET", "POST"])
-def delete_user(username):
-    """
-    Remove user, remove all feedback, and clear user info from session.
-    Redirect to /.
-    """
-    
-    if request.method == 'POST' and session.get("user_id") == username:
-            
-        # find the user
-        user = User.query.get_or_404(username)
-
-        # delete from db
-        db.session.delete(user)
-        db.session.commit()
-        
-        # clear session
-        session.pop("user_id")
-
-        # return to redirect
-        return redirect("/")
-
-    else:
-        flash("Cannot delete other users.", "error")
-        return redirect(f"/users/{session['user_id']}")
-    
-    
-# ----------------------------------------------------------------
-# Feedback views
-# ----------------------------------------------------------------
-@app.route("/users/<username>/feedback/add", methods=["GET", "POST"])
-def handle_feedback_add(username):
-    """
-    Handle GET and POST requests for adding feedback.
-    Display a form to add feedback Make sure that only the user who is logged in can see this form
-    """
-    
-    # Show feedback form if session id matches user url
-    if session.get("user_id") == username:
-            
-        form = AddFeedbackForm()
-        
-        # find the user
-        user = User.query.get_or_404(username)
-        
-        if form.validate_on_submit():
-            title = form.title.data
-            content = form.content.data
-            
-            # create instance of Feedback object
-            feedback = Feedback(title=title, content=content, username=username)
-            
-            # add feedback to database
-            db.session.add(feedback)
-            db.session.commit()
-            
-            # return user back to username page
-            return redirect(f"/users/{username}")
-        
-        else:
-            return render_template("/feedback/add.html", form=form, user=user)
-
-    # else redirect them to their own user feedback form if they are a different user
-    elif session.get("user_id"):
-        user = session["user_id"]
-        return redirect(f"/users/{user}/feedback/add")
-    
-    # else redirect to home if they are not logged in
-    return redirect("/")
-            
-@app.route("/feedback/<int:id>/update", methods=["GET", "POST"])
-def handle_feedback_update(id):
-    """
-    Handle GET and POST requests for adding feedback.
-    Display a form to edit feedback — 
-    Update a specific piece of feedback and redirect to /users/
-    **Make sure that only the user who has written that feedback can see this form.
-    """
-    if session.get('user_id') is None:
-        return redirect('/')
-    
-    # request feedback item
-    try:
-        feedback = Feedback.query.filter_by(id=id).one()
-    except:
-        # if feedback item does not exist
-        flash(f"Feedback item {id} does not exist", "error")
-        return redirect('/')
-    
-    # request the user who wrote the feedback
-    user = User.query.get_or_404(feedback.username)
-            
-    # if the current user matches the feedback item's username
-    if session.get("user_id") == feedback.username:
-        form = EditFeedbackForm(obj=feedback)
-    
-        if form.validate_on_submit():
-            feedback.title = form.title.data
-            feedback.content = form.content.data
-            
-            # update feedback to database
-            db.session.commit()
-            
-            # return user back to username page
-            flash("changes saved!", "success")
-            return redirect(f"/users/{user}")
-        
-        else:
-            return render_template("/feedback/edit.html", form=form, user=user, feedback=feedback)
-        
-    # else if current user does not match feedback item's username, redirect to user's page
-    elif session.get("user_id"):
-        flash(f"Feedback item {id} belongs to another user. Please select a feedback item from the list below.", "error")
-        return redirect(f"/users/{session['user_id']}")
-    
-    # else if not logged in, return to home
-    return redirect("/")
-
-@app.route("/feedback/<int:id>/delete", methods=["GET", "POST"])
-def delete_feedback(id):
-    """
-    Delete a specific piece of feedback and redirect to /users/ — 
-    Make sure that only the user who has written that feedback can delete it
-    """
-    
-    # request feedback item
-    try:
-        feedback = Feedback.query.filter_by(id=id).one()
-    except:
-        # if feedback item does not exist
-        flash(f"Feedback item {id} does not exist", "error")
-        return redirect('/')
-    
-    # request the user who wrote the feedback
-    user = User.query.get_or_404(feedback.username)
-    
-    if session.get("user_id") == feedback.username:
-        
-        db.session.delete(feedback)
-        db.session.commit()
-        
-        flash(f'Feedback item {id} deleted.', "success")
-        return redirect(f'/users/{user}')
-    
-    elif session.get("user_id"):
-        flash(f'Feedback item {id} belongs to another user. Please select a feedback item below.', "error")
-        return redirect(f'/users/{user.username}')
-
-    else:
-        return redirect('/')
-    
-@app.route("/logout")
-def handle_logout():
-    """Log the user and remove them from the session."""
-    
-    if session.get("user_id"):
-        session.pop("user_id")
-    
-    return redirect("/")
\ No newline at end of file
+"""Create the Flask app.
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///hashing_db"})
+
+create_app does no I/O: database engines are created on first use, and the
+debug toolbar is only imported when it is enabled. So it is cheap for CLI
+commands and tests, and safe to run in a pre-forking server's master
+process, e.g. `gunicorn --preload "app:create_app()"`. Workers then start
+from the loaded app, and drop any connections inherited from the master
+(see models.py).
+
+`from app import app`, `flask run` and "app:app" still work; they get an
+app with the default config, built the first time it is asked for.
+
+Each call builds a separate app: admission control, the login throttle,
+the fragment caches, server sessions and request timing are created per
+app and kept in app.extensions, and the module-level names (`admission`,
+`user_page_cache`, ...) are proxies to the current app's. The database
+engines are per app as well, though outside an app context `db` falls back
+to the app created last. The bcrypt pool (hashing.hasher) is one per
+process; the app created last sets its pool size and cost.
+"""
+
+import threading
+
+from flask import Flask
+from models import connect_db
+from hashing import hasher
+from admission import AdmissionController
+from throttle import LoginThrottle
+from cache import FragmentCache
+from sessions import ServerSessionInterface
+from instrumentation import RequestTiming
+import metrics
+import importer
+import exporter
+import api
+import routing
+import templating
+from assets import assets
+from views import views
+
+
+def create_app(config=None):
+    """Return a new app, with config (a dict) applied over the defaults."""
+
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "oh-so-secret"
+    app.config["SQLALCHEMY_DATABASE_URI"] = "postgresql:///hashing_db"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = False
+
+    # feedback items per page on the user page, and the most a client may ask for
+    app.config["FEEDBACK_PAGE_SIZE"] = 20
+    app.config["FEEDBACK_PAGE_MAX"] = 100
+    # rows fetched per round trip when a whole history is streamed (?all=1)
+    app.config["FEEDBACK_STREAM_BATCH"] = 1000
+
+    # matches ranked per search, and the users (e.g. support staff) who may search everyone's feedback
+    app.config["SEARCH_MAX_MATCHES"] = 1000
+    app.config["SUPPORT_USERS"] = []
+
+    app.config.from_mapping(config or {})
+
+    # the toolbar is for development; don't even import it otherwise
+    if app.config.setdefault("DEBUG_TB_ENABLED", app.debug):
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    hasher.init_app(app)
+    AdmissionController(app)
+    LoginThrottle(app)
+    FragmentCache(app)
+    ServerSessionInterface(app)
+    RequestTiming(app)
+    metrics.init_app(app)
+    importer.init_app(app)
+    exporter.init_app(app)
+    api.init_app(app)
+    routing.init_app(app)
+    templating.init_app(app)
+    assets.init_app(app)
+
+    app.register_blueprint(views)
+
+    return app
+
+
+_default_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # the module-level app is only built when something asks for it
+    if name == "app":
+        with _default_app_lock:
+            if "app" not in globals():
+                globals()["app"] = create_app()
+        return globals()["app"]
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,360 @@
+"""Self-hosted, fingerprinted static assets.
+
+    flask vendor-assets     # once, with network access; commit static/vendor
+    flask build-assets      # at deploy time
+
+vendor-assets downloads the third-party CSS and JS listed in VENDOR, and
+the fonts their CSS refers to, into static/vendor. build-assets copies
+everything under static into static/dist. Each copy's name includes a hash
+of its content, e.g. css/style.3b6f0e1a9c2d.css. CSS url()s are rewritten
+to the hashed names, PNGs are recompressed, and text files also get .gz
+copies (and .br copies when the brotli package is installed). A
+manifest.json maps each source name to its built name.
+
+build-assets stops if a file listed in VENDOR is missing, so a build never
+ships pages that link files it does not have.
+
+Templates link assets with asset_url("css/style.css"). This returns the
+hashed URL when the asset has been built. Otherwise it falls back to the
+CDN for vendored files (while ASSETS_CDN_FALLBACK is on, the default until
+static/vendor is committed), and to the plain static file for everything
+else.
+Built files are served with an immutable, year-long Cache-Control. A
+client that accepts br or gzip gets the precompressed copy.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import struct
+import urllib.parse
+import urllib.request
+import zlib
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+CDN = "https://cdnjs.cloudflare.com/ajax/libs"
+
+# static name: where it came from
+VENDOR = {
+    "vendor/bootstrap/css/bootstrap.min.css": f"{CDN}/twitter-bootstrap/4.6.0/css/bootstrap.min.css",
+    "vendor/bootstrap/js/bootstrap.min.js": f"{CDN}/twitter-bootstrap/4.6.0/js/bootstrap.min.js",
+    "vendor/font-awesome/css/all.min.css": f"{CDN}/font-awesome/5.15.4/css/all.min.css",
+    "vendor/jquery/jquery.slim.min.js": f"{CDN}/jquery/3.5.1/jquery.slim.min.js",
+    "vendor/popper.js/umd/popper.min.js": f"{CDN}/popper.js/1.16.1/umd/popper.min.js",
+}
+
+# files worth sending compressed; images and woff/woff2 fonts are compressed already
+COMPRESSIBLE = {".css", ".js", ".json", ".map", ".svg", ".txt", ".eot", ".ttf"}
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def css_references(css):
+    """Yield (ref, path) for each relative url() in css, path without its ?query or #fragment."""
+
+    for match in CSS_URL.finditer(css):
+        ref = match.group(2).strip()
+        if ref.startswith(("data:", "/", "#")) or "://" in ref:
+            continue
+        yield ref, re.split(r"[?#]", ref, 1)[0]
+
+
+def hashed_name(name, content):
+    root, ext = posixpath.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# chunks that change how an image looks; text, EXIF, timestamps and Apple's iDOT are dropped
+PNG_KEEP = {b"IHDR", b"PLTE", b"tRNS", b"cHRM", b"gAMA", b"iCCP", b"sBIT", b"sRGB", b"bKGD", b"pHYs"}
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def _png_chunks(data):
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        yield kind, data[pos + 8:pos + 8 + length]
+        pos += length + 12
+
+
+def _png_chunk(kind, body):
+    return struct.pack(">I4s", len(body), kind) + body + struct.pack(">I", zlib.crc32(kind + body))
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _unfilter(raw, stride, bpp):
+    """Return the rows of a non-interlaced image's decompressed IDAT data, unfiltered."""
+
+    rows = []
+    prior = bytearray(stride)
+    for start in range(0, len(raw), stride + 1):
+        kind, row = raw[start], bytearray(raw[start + 1:start + 1 + stride])
+        for i in range(stride):
+            left = row[i - bpp] if i >= bpp else 0
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + prior[i]) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + ((left + prior[i]) >> 1)) & 0xFF
+            elif kind == 4:
+                row[i] = (row[i] + _paeth(left, prior[i], prior[i - bpp] if i >= bpp else 0)) & 0xFF
+        rows.append(row)
+        prior = row
+    return rows
+
+
+def _filter(rows, bpp):
+    """Return rows filtered with, per row, the filter leaving the smallest values (the usual heuristic)."""
+
+    out = bytearray()
+    prior = bytes(len(rows[0]))
+    for row in rows:
+        left = bytes(bpp) + row[:-bpp]
+        upper_left = bytes(bpp) + prior[:-bpp]
+        candidates = [
+            row,
+            bytes((x - a) & 0xFF for x, a in zip(row, left)),
+            bytes((x - b) & 0xFF for x, b in zip(row, prior)),
+            bytes((x - ((a + b) >> 1)) & 0xFF for x, a, b in zip(row, left, prior)),
+            bytes((x - _paeth(a, b, c)) & 0xFF for x, a, b, c in zip(row, left, prior, upper_left)),
+        ]
+        kind = min(range(5), key=lambda k: sum(v if v < 128 else 256 - v for v in candidates[k]))
+        out.append(kind)
+        out += candidates[kind]
+        prior = row
+    return bytes(out)
+
+
+def optimize_png(data):
+    """Return data, a PNG, losslessly made smaller where possible: the pixels are unchanged."""
+
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+
+    chunks = list(_png_chunks(data))
+    if any(kind in (b"acTL", b"fcTL", b"fdAT") for kind, _ in chunks):
+        return data  # animated; leave it alone
+
+    header = chunks[0][1]
+    width, height, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", header)
+    raw = zlib.decompress(b"".join(body for kind, body in chunks if kind == b"IDAT"))
+
+    candidates = [raw]
+    if not interlace:
+        bits = PNG_CHANNELS[color] * depth
+        stride, bpp = (width * bits + 7) // 8, max(1, bits // 8)
+        rows = _unfilter(raw, stride, bpp)
+        candidates.append(b"".join(b"\0" + row for row in rows))
+        candidates.append(_filter(rows, bpp))
+    idat = min((zlib.compress(candidate, 9) for candidate in candidates), key=len)
+
+    optimized = PNG_SIGNATURE + b"".join(
+        _png_chunk(kind, body) for kind, body in chunks if kind in PNG_KEEP)
+    optimized += _png_chunk(b"IDAT", idat) + _png_chunk(b"IEND", b"")
+    return optimized if len(optimized) < len(data) else data
+
+
+def build(static_folder, output="dist"):
+    """Write fingerprinted (and compressed) copies of static_folder's files into output; return the manifest."""
+
+    destination = os.path.join(static_folder, output)
+    shutil.rmtree(destination, ignore_errors=True)
+
+    names = []
+    for directory, _, files in os.walk(static_folder):
+        for file in files:
+            names.append(os.path.relpath(os.path.join(directory, file), static_folder).replace(os.sep, "/"))
+    names = sorted(name for name in names if not name.startswith(f"{output}/"))
+
+    # CSS last, so the files it refers to already have their hashed names
+    manifest = {}
+    for name in sorted(names, key=lambda name: name.endswith(".css")):
+        with open(os.path.join(static_folder, name), "rb") as f:
+            content = f.read()
+
+        if name.endswith(".png"):
+            content = optimize_png(content)
+        elif name.endswith(".css"):
+            content = _rewrite_css(name, content.decode(), manifest).encode()
+
+        manifest[name] = hashed_name(name, content)
+        _write(os.path.join(destination, manifest[name]), content)
+
+    with open(os.path.join(destination, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def _rewrite_css(name, css, manifest):
+    """Point css's url()s at the hashed names; a built file stays in its source's directory."""
+
+    base = posixpath.dirname(name)
+
+    def hashed(match):
+        for ref, path in css_references(match.group(0)):
+            target = posixpath.normpath(posixpath.join(base, path))
+            if target in manifest:
+                return f"url({posixpath.relpath(manifest[target], base or '.')}{ref[len(path):]})"
+        return match.group(0)
+
+    return CSS_URL.sub(hashed, css)
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+    if os.path.splitext(path)[1] not in COMPRESSIBLE:
+        return
+    compressed = {".gz": gzip.compress(content, 9, mtime=0)}
+    if brotli is not None:
+        compressed[".br"] = brotli.compress(content)
+    for suffix, data in compressed.items():
+        if len(data) < len(content):
+            with open(path + suffix, "wb") as f:
+                f.write(data)
+
+
+def vendor(static_folder, force=False):
+    """Download VENDOR, and the files their CSS refers to, into static_folder; return the names fetched."""
+
+    fetched = []
+
+    def fetch(name, url):
+        path = os.path.join(static_folder, name)
+        if os.path.exists(path) and not force:
+            return
+        with urllib.request.urlopen(url, timeout=30) as response:
+            content = response.read()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        fetched.append(name)
+
+        if name.endswith(".css"):
+            for _, ref in css_references(content.decode()):
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(name), ref))
+                if target.startswith("vendor/"):
+                    fetch(target, urllib.parse.urljoin(url, ref))
+
+    for name, url in VENDOR.items():
+        fetch(name, url)
+    return fetched
+
+
+class Assets:
+    """Serves built assets, and gives templates asset_url()."""
+
+    def __init__(self, app=None):
+        self._manifests = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ASSETS_OUTPUT", "dist")
+        app.config.setdefault("ASSETS_MAX_AGE", 365 * 24 * 60 * 60)
+        # link unbuilt vendored files on the CDN; static/vendor isn't committed yet, so
+        # without this a fresh checkout would link files it doesn't have
+        app.config.setdefault("ASSETS_CDN_FALLBACK", True)
+
+        if app.static_folder:
+            # more specific than /static/<path:filename>, so it wins for built files
+            app.add_url_rule(f"{app.static_url_path}/{app.config['ASSETS_OUTPUT']}/<path:filename>",
+                             "assets", self.serve)
+        app.jinja_env.globals["asset_url"] = self.url
+        app.cli.add_command(vendor_assets_command)
+        app.cli.add_command(build_assets_command)
+
+    def manifest(self):
+        """Return the app's manifest, read once per process; {} before build-assets has run."""
+
+        path = os.path.join(current_app.static_folder, current_app.config["ASSETS_OUTPUT"], "manifest.json")
+        if path not in self._manifests:
+            try:
+                with open(path) as f:
+                    self._manifests[path] = json.load(f)
+            except FileNotFoundError:
+                self._manifests[path] = {}
+        return self._manifests[path]
+
+    def url(self, name):
+        """Return the URL for the static file name, like url_for("static", filename=name)."""
+
+        built = self.manifest().get(name)
+        if built is not None:
+            return url_for("static", filename=f"{current_app.config['ASSETS_OUTPUT']}/{built}")
+        if name in VENDOR and current_app.config["ASSETS_CDN_FALLBACK"]:
+            return VENDOR[name]
+        return url_for("static", filename=name)
+
+    def serve(self, filename):
+        directory = os.path.join(current_app.static_folder, current_app.config["ASSETS_OUTPUT"])
+        max_age = current_app.config["ASSETS_MAX_AGE"]
+
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            path = safe_join(directory, filename + suffix)
+            if request.accept_encodings[encoding] and path and os.path.isfile(path):
+                mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                response = send_from_directory(directory, filename + suffix, mimetype=mimetype,
+                                               download_name=posixpath.basename(filename), max_age=max_age)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(directory, filename, max_age=max_age)
+
+        # the name changes whenever the content does
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add("Accept-Encoding")
+        return response
+
+
+assets = Assets()
+
+
+@click.command("vendor-assets")
+@click.option("--force", is_flag=True, help="Download files that are already there again.")
+@with_appcontext
+def vendor_assets_command(force):
+    """Download third-party CSS, JS and fonts into static/vendor."""
+
+    for name in vendor(current_app.static_folder, force):
+        click.echo(f"fetched {name}")
+
+
+@click.command("build-assets")
+@with_appcontext
+def build_assets_command():
+    """Write fingerprinted, compressed copies of the static files."""
+
+    missing = [name for name in VENDOR if not os.path.isfile(os.path.join(current_app.static_folder, name))]
+    if missing:
+        raise click.ClickException(f"missing {', '.join(missing)}; run `flask vendor-assets` first")
+
+    manifest = build(current_app.static_folder, current_app.config["ASSETS_OUTPUT"])
+    click.echo(f"built {len(manifest)} assets into {current_app.config['ASSETS_OUTPUT']}/")
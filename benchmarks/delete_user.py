@@ -0,0 +1,88 @@
+"""Compare deleting a user with many feedback rows, ORM cascade vs ON DELETE CASCADE.
+
+    python -m benchmarks.delete_user --rows 10000 --database-url postgresql:///hashing_db_bench
+
+The "orm" strategy does what cascade="all,delete" used to do: load every
+feedback row and delete each one before the user. The "database" strategy is
+what delete_user does now: one DELETE on users, with the foreign key removing
+the feedback.
+"""
+
+import argparse
+import time
+
+from sqlalchemy import event
+
+from app import app
+from models import db, reset_db, User, Feedback
+
+
+def make_user(username, rows):
+    """Insert a user with `rows` feedback items."""
+
+    db.session.add(User(username=username, password="x", email=f"{username}@bench.test",
+                        first_name="bench", last_name="user"))
+    db.session.commit()
+
+    db.session.execute(Feedback.__table__.insert(), [
+        {"title": f"title {i}", "content": f"content {i}", "username": username}
+        for i in range(rows)])
+    db.session.commit()
+
+
+def delete_orm(username):
+    user = User.query.get(username)
+    for feedback in user.feedback.all():
+        db.session.delete(feedback)
+    db.session.delete(user)
+    db.session.commit()
+
+
+def delete_database(username):
+    User.query.filter_by(username=username).delete()
+    db.session.commit()
+
+
+def run(strategy, delete, rows):
+    """Time one strategy and count the statements it sends."""
+
+    username = f"bench_{strategy}"
+    make_user(username, rows)
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        # psycopg2 runs an executemany as one statement per parameter set
+        statements.extend([statement] * (len(parameters) if executemany else 1))
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    start = time.perf_counter()
+    try:
+        delete(username)
+    finally:
+        elapsed = time.perf_counter() - start
+        event.remove(db.engine, "before_cursor_execute", count)
+
+    remaining = Feedback.query.filter_by(username=username).count()
+    print(f"{strategy:>8}: {elapsed * 1000:9.1f} ms  {len(statements):6d} statements  "
+          f"{remaining} feedback rows left")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--database-url", default="postgresql:///hashing_db_bench")
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.database_url
+
+    with app.app_context():
+        reset_db()
+
+        print(f"deleting a user with {args.rows} feedback rows")
+        run("orm", delete_orm, args.rows)
+        run("database", delete_database, args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Load test the login, user page and feedback flows.
+
+    python -m benchmarks.load --mix browse --requests 5000 --concurrency 8 \
+        --database-url postgresql:///hashing_db_bench --output results/browse.json
+
+Requests go through the real app via Flask's test client, one client per
+worker thread, so everything from routing to bcrypt and the database is
+exercised without a network hop. The database is rebuilt from the
+migrations and filled with --users users and --feedback items each.
+
+A mix sets the relative weight of each operation:
+
+    login   POST /login with the right password
+    view    GET /users/<username>
+    page    GET /users/<username>?after=<id>, a later page of feedback
+    add     POST /users/<username>/feedback/add
+    edit    POST /feedback/<id>/update
+    delete  POST /feedback/<id>/delete
+
+Results (req/s and p50/p95/p99 latency per operation) are printed and, with
+--output, saved as JSON. Pass --compare with an earlier result file to print
+the change per operation.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from app import app
+from models import db, reset_db, User, Feedback
+from hashing import hasher
+
+
+MIXES = {
+    "login": {"login": 70, "view": 25, "add": 5},
+    "browse": {"view": 70, "page": 25, "login": 3, "add": 2},
+    "write": {"add": 40, "edit": 30, "delete": 20, "view": 10},
+}
+
+PASSWORD = "bench-secret"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def populate(users, feedback_per_user):
+    """Create users with one shared password hash, and their feedback, in bulk."""
+
+    reset_db()
+
+    pw_hash = hasher.generate_password_hash(PASSWORD)
+    db.session.execute(User.__table__.insert(), [
+        {"username": f"bench{i}", "password": pw_hash, "email": f"bench{i}@bench.test",
+         "first_name": "bench", "last_name": str(i)}
+        for i in range(users)])
+    db.session.execute(Feedback.__table__.insert(), [
+        {"title": f"title {j}", "content": f"content {j} " * 10, "username": f"bench{i}"}
+        for i in range(users) for j in range(feedback_per_user)])
+    db.session.commit()
+
+    owned = defaultdict(list)
+    for feedback_id, username in db.session.query(Feedback.id, Feedback.username):
+        owned[username].append(feedback_id)
+    return owned
+
+
+# the status code each operation returns when it succeeds
+EXPECTED_STATUS = {"login": 302, "view": 200, "page": 200, "add": 302, "edit": 302, "delete": 302}
+
+
+class Worker(threading.Thread):
+    """Send requests for a set of users until the shared budget runs out."""
+
+    def __init__(self, usernames, owned, operations, weights, budget, seed):
+        super().__init__()
+        self.usernames = usernames
+        self.owned = owned
+        self.operations = operations
+        self.weights = weights
+        self.budget = budget
+        self.random = random.Random(seed)
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def run(self):
+        with app.app_context(), app.test_client() as client:
+            while self.budget.take():
+                username = self.random.choice(self.usernames)
+                operation = self.random.choices(self.operations, self.weights)[0]
+
+                with client.session_transaction() as session:
+                    session["user_id"] = username
+
+                start = time.perf_counter()
+                resp = getattr(self, f"do_{operation}")(client, username)
+                elapsed = time.perf_counter() - start
+
+                self.timings[operation].append(elapsed)
+                self.statuses[operation][resp.status_code] += 1
+
+    def do_login(self, client, username):
+        return client.post("/login", data={"username": username, "password": PASSWORD})
+
+    def do_view(self, client, username):
+        return client.get(f"/users/{username}")
+
+    def do_page(self, client, username):
+        ids = self.owned[username]
+        after = ids[len(ids) // 2] if ids else 0
+        return client.get(f"/users/{username}?after={after}")
+
+    def do_add(self, client, username):
+        return client.post(f"/users/{username}/feedback/add",
+                           data={"title": "bench add", "content": "added by the benchmark"})
+
+    def do_edit(self, client, username):
+        ids = self.owned[username]
+        if not ids:
+            return self.do_add(client, username)
+        return client.post(f"/feedback/{self.random.choice(ids)}/update",
+                           data={"title": "bench edit", "content": "edited by the benchmark"})
+
+    def do_delete(self, client, username):
+        ids = self.owned[username]
+        if not ids:
+            return self.do_add(client, username)
+        return client.post(f"/feedback/{ids.pop(self.random.randrange(len(ids)))}/delete")
+
+
+class Budget:
+    """A shared count of requests left to send."""
+
+    def __init__(self, total):
+        self.left = total
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+def summarize(workers, elapsed):
+    """Merge worker timings into per-operation stats."""
+
+    timings = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    for worker in workers:
+        for operation, values in worker.timings.items():
+            timings[operation].extend(values)
+        for operation, counts in worker.statuses.items():
+            for status, count in counts.items():
+                statuses[operation][status] += count
+
+    def stats(values, statuses):
+        values = sorted(values)
+        return {
+            "requests": len(values),
+            # anything other than the expected status, e.g. 503s shed by admission control
+            "errors": sum(count for (operation, status), count in statuses.items()
+                          if status != EXPECTED_STATUS[operation]),
+            "statuses": {str(status): count for (_, status), count in sorted(statuses.items())},
+            "req_per_s": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+
+    routes = {
+        operation: stats(values, {(operation, status): count for status, count in statuses[operation].items()})
+        for operation, values in sorted(timings.items())}
+    overall = stats(
+        [value for values in timings.values() for value in values],
+        {(operation, status): count for operation, counts in statuses.items() for status, count in counts.items()})
+    return routes, overall
+
+
+def print_results(results, baseline=None):
+    header = f"{'operation':<10}{'requests':>9}{'errors':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    print(header + ("   p95 vs baseline" if baseline else ""))
+
+    rows = dict(results["routes"], total=results["overall"])
+    before_rows = dict(baseline["routes"], total=baseline["overall"]) if baseline else {}
+
+    for operation, stats in rows.items():
+        line = (f"{operation:<10}{stats['requests']:>9}{stats['errors']:>7}{stats['req_per_s']:>9}"
+                f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+
+        before = before_rows.get(operation)
+        if before and before["p95_ms"]:
+            line += f"   {(stats['p95_ms'] / before['p95_ms'] - 1) * 100:+.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mix", choices=sorted(MIXES), default="browse")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--feedback", type=int, default=50, help="feedback items per user")
+    parser.add_argument("--rounds", type=int, help="bcrypt cost; defaults to the app's")
+    parser.add_argument("--database-url", default="sqlite:///bench.db")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.database_url
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.extensions["login_throttle"].enabled = False
+    if args.rounds:
+        hasher.rounds = args.rounds
+
+    with app.app_context():
+        owned = populate(max(args.users, args.concurrency), args.feedback)
+        app.extensions["user_page_cache"].clear()
+
+    usernames = sorted(owned) or [f"bench{i}" for i in range(max(args.users, args.concurrency))]
+    operations, weights = zip(*MIXES[args.mix].items())
+    budget = Budget(args.requests)
+
+    # each worker gets its own users, so edits and deletes never collide
+    workers = [Worker(usernames[i::args.concurrency], owned, operations, weights, budget, args.seed + i)
+               for i in range(args.concurrency)]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    routes, overall = summarize(workers, elapsed)
+    results = {
+        "mix": args.mix,
+        "database": args.database_url.split("://")[0],
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "users": len(usernames),
+        "feedback_per_user": args.feedback,
+        "bcrypt_rounds": hasher.rounds,
+        "elapsed_s": round(elapsed, 3),
+        "routes": routes,
+        "overall": overall,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
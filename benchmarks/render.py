@@ -0,0 +1,131 @@
+"""Compare page render times with and without the template caches.
+
+    python -m benchmarks.render --runs 10 --requests 200 --output results/render.json
+
+Each route is timed two ways:
+
+    cold    the first request to a newly created app, which has to load and
+            compile its templates, as a freshly started worker does
+    warm    the median over --requests later requests to the same app
+
+"before" renders with neither cache; "after" loads templates from a warmed
+TEMPLATE_BYTECODE_DIR and caches the navbar in layout_cache. Requests go
+through Flask's test client against a small --database-url database.
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+from app import create_app
+from models import db, reset_db, User, Feedback
+
+
+USERNAME = "bench"
+
+# name: (url, logged in)
+ROUTES = {
+    "register": ("/register", False),
+    "login": ("/login", False),
+    "user": (f"/users/{USERNAME}", True),
+    "add": (f"/users/{USERNAME}/feedback/add", True),
+    "search": (f"/users/{USERNAME}/feedback/search?q=title", True),
+}
+
+
+def populate(app, feedback):
+    with app.app_context():
+        reset_db()
+        db.session.add(User(username=USERNAME, password="x", email="bench@bench.test",
+                            first_name="bench", last_name="user"))
+        db.session.add_all([Feedback(title=f"title {i}", content=f"content {i}", username=USERNAME)
+                            for i in range(feedback)])
+        db.session.commit()
+
+
+def client_for(app, logged_in):
+    client = app.test_client()
+    if logged_in:
+        with client.session_transaction() as session:
+            session["user_id"] = USERNAME
+    return client
+
+
+def timed_get(client, url):
+    start = time.perf_counter()
+    client.get(url)
+    return (time.perf_counter() - start) * 1000
+
+
+def measure(config, runs, requests):
+    """Return {route: {"cold_ms": ..., "warm_ms": ...}} for apps built with config."""
+
+    cold = {route: [] for route in ROUTES}
+    for _ in range(runs):
+        for route, (url, logged_in) in ROUTES.items():
+            # a new app has a new Jinja environment, with nothing compiled yet
+            app = create_app(config)
+            cold[route].append(timed_get(client_for(app, logged_in), url))
+
+    app = create_app(config)
+    warm = {}
+    for route, (url, logged_in) in ROUTES.items():
+        client = client_for(app, logged_in)
+        client.get(url)
+        warm[route] = [timed_get(client, url) for _ in range(requests)]
+
+    return {route: {"cold_ms": round(statistics.median(cold[route]), 2),
+                    "warm_ms": round(statistics.median(warm[route]), 3)}
+            for route in ROUTES}
+
+
+def change(after, before):
+    return f"{(after / before - 1) * 100:+.1f}%" if before else ""
+
+
+def print_results(results):
+    print(f"{'route':<10}{'cold before':>12}{'after':>8}{'':>8}{'warm before':>13}{'after':>8}{'':>8}")
+    for route in ROUTES:
+        before, after = results["before"][route], results["after"][route]
+        print(f"{route:<10}{before['cold_ms']:>12}{after['cold_ms']:>8}"
+              f"{change(after['cold_ms'], before['cold_ms']):>8}"
+              f"{before['warm_ms']:>13}{after['warm_ms']:>8}"
+              f"{change(after['warm_ms'], before['warm_ms']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per route")
+    parser.add_argument("--requests", type=int, default=200, help="warm requests per route")
+    parser.add_argument("--feedback", type=int, default=20, help="feedback items on the user page")
+    parser.add_argument("--database-url", default="sqlite:///bench.db")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    base = {"SQLALCHEMY_DATABASE_URI": args.database_url, "TIMING_LOG_SAMPLE_RATE": 0}
+
+    populate(create_app(base), args.feedback)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cached = dict(base, TEMPLATE_BYTECODE_DIR=directory, LAYOUT_CACHE_ENABLED=True)
+        create_app(cached).test_cli_runner().invoke(args=["warm-templates"])
+
+        results = {
+            "runs": args.runs,
+            "requests": args.requests,
+            "database": args.database_url.split("://")[0],
+            "before": measure(dict(base, LAYOUT_CACHE_ENABLED=False), args.runs, args.requests),
+            "after": measure(cached, args.runs, args.requests),
+        }
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
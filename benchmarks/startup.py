@@ -0,0 +1,117 @@
+"""Measure how long a fresh process takes to import, build and serve the app.
+
+    python -m benchmarks.startup --runs 20 --output results/startup.json
+    python -m benchmarks.startup --compare results/startup.json
+
+Each run starts a new interpreter, as a new worker would, and times:
+
+    process        the whole run, from exec to exit
+    import         `from app import create_app`
+    create_app     building the app, with the default config
+    first_request  the first GET /login, which also compiles its templates
+
+None of these touch the database. Results (median and min per stage, in ms)
+are printed and, with --output, saved as JSON. Pass --compare with an
+earlier result file to print the change per stage.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+STAGES = ("process", "import", "create_app", "first_request")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure():
+    """Time the stages in this process; run by each child."""
+
+    start = time.perf_counter()
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    status = app.test_client().get("/login").status_code
+    served = time.perf_counter()
+
+    return {
+        "import": (imported - start) * 1000,
+        "create_app": (created - imported) * 1000,
+        "first_request": (served - created) * 1000,
+        "status": status,
+        "modules": len(sys.modules),
+    }
+
+
+def run_once():
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child"],
+                            cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    timings = json.loads(output.splitlines()[-1])
+    timings["process"] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def print_results(results, baseline=None):
+    print(f"{'stage':<15}{'median ms':>10}{'min ms':>9}" + ("   median vs baseline" if baseline else ""))
+
+    for stage in STAGES:
+        stats = results["stages"][stage]
+        line = f"{stage:<15}{stats['median_ms']:>10}{stats['min_ms']:>9}"
+
+        before = baseline["stages"].get(stage) if baseline else None
+        if before and before["median_ms"]:
+            line += f"   {(stats['median_ms'] / before['median_ms'] - 1) * 100:+.1f}%"
+        print(line)
+
+    print(f"{results['modules']} modules loaded")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure()))
+        return
+
+    runs = [run_once() for _ in range(args.runs)]
+    if any(run["status"] != 200 for run in runs):
+        sys.exit("GET /login did not return 200")
+
+    results = {
+        "runs": args.runs,
+        "python": sys.version.split()[0],
+        "modules": runs[-1]["modules"],
+        "stages": {
+            stage: {
+                "median_ms": round(statistics.median(run[stage] for run in runs), 1),
+                "min_ms": round(min(run[stage] for run in runs), 1),
+            }
+            for stage in STAGES},
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
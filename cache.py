@@ -0,0 +1,113 @@
+"""In-process cache of rendered HTML fragments.
+
+The user page only changes when its owner adds, edits or deletes feedback or
+deletes their account, so there is no need to query and render it on every
+view. FragmentCache keeps rendered fragments grouped by owner (a username),
+expires them after a TTL, evicts the least recently used owners past
+maxsize, and lets the write paths drop everything cached for an owner.
+
+Each process has its own cache; writes that bypass the views, such as seed
+scripts or other instances, show up once the TTL runs out. Each app has its
+own caches too, in app.extensions under the lower-cased prefix of their
+settings; `user_page_cache` and `layout_cache` are the current app's.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+
+class FragmentCache:
+    """Size-bounded LRU cache of rendered fragments with a TTL."""
+
+    def __init__(self, app=None, maxsize=1024, ttl=60, max_variants=16):
+        self.enabled = True
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # fragments kept per owner, e.g. pages of one user's feedback
+        self.max_variants = max_variants
+
+        self._owners = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, prefix="USER_PAGE_CACHE"):
+        """Read settings from app.config, e.g. USER_PAGE_CACHE_TTL, and register as e.g. "user_page_cache"."""
+
+        self.enabled = app.config.setdefault(f"{prefix}_ENABLED", self.enabled)
+        self.maxsize = app.config.setdefault(f"{prefix}_SIZE", self.maxsize)
+        self.ttl = app.config.setdefault(f"{prefix}_TTL", self.ttl)
+
+        app.extensions[prefix.lower()] = self
+
+    def get(self, owner, key):
+        """Return the cached fragment for (owner, key), or None."""
+
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._owners.get(owner)
+
+            if entry is not None and entry[0] < time.monotonic():
+                del self._owners[owner]
+                entry = None
+
+            fragment = entry[1].get(key) if entry is not None else None
+            if fragment is None:
+                self._counts["misses"] += 1
+                return None
+
+            self._owners.move_to_end(owner)
+            self._counts["hits"] += 1
+            return fragment
+
+    def set(self, owner, key, fragment):
+        """Cache fragment under (owner, key)."""
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            entry = self._owners.get(owner)
+            if entry is None or entry[0] < time.monotonic():
+                # the TTL runs from the first fragment cached for an owner
+                entry = self._owners[owner] = (time.monotonic() + self.ttl, {})
+
+            variants = entry[1]
+            if key not in variants and len(variants) >= self.max_variants:
+                variants.pop(next(iter(variants)))
+            variants[key] = fragment
+
+            self._owners.move_to_end(owner)
+            while len(self._owners) > self.maxsize:
+                self._owners.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def invalidate(self, owner):
+        """Drop every fragment cached for owner."""
+
+        with self._lock:
+            if self._owners.pop(owner, None) is not None:
+                self._counts["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._owners.clear()
+
+    def stats(self):
+        """Return hit/miss/invalidation/eviction counters and the current size."""
+
+        with self._lock:
+            return dict(self._counts, size=len(self._owners))
+
+
+# the current app's caches; see create_app and templating.init_app
+user_page_cache = LocalProxy(lambda: current_app.extensions["user_page_cache"])
+layout_cache = LocalProxy(lambda: current_app.extensions["layout_cache"])
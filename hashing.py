@@ -0,0 +1,212 @@
+"""Bounded worker pool for bcrypt hashing.
+
+bcrypt is slow on purpose, so hashing inline ties up the request worker for
+the whole computation. HashingExecutor runs the work on a pool of threads
+(bcrypt releases the GIL while it hashes) or processes, caps how many jobs
+may be waiting for a worker, and keeps timing stats for each operation.
+
+The bcrypt cost can be fixed with BCRYPT_LOG_ROUNDS or calibrated at startup
+against a latency budget with BCRYPT_TARGET_MS.
+"""
+
+import itertools
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import bcrypt
+
+
+class HashingQueueFull(Exception):
+    """Raised when the hashing pool has no room for another job."""
+
+
+def _generate_password_hash(password, rounds):
+    """Hash password with a fresh salt at the given cost."""
+
+    hashed = bcrypt.hashpw(password.encode("utf8"), bcrypt.gensalt(rounds))
+    return hashed.decode("utf8")
+
+
+def _check_password_hash(pw_hash, password):
+    """Return True if password matches pw_hash."""
+
+    return bcrypt.checkpw(password.encode("utf8"), pw_hash.encode("utf8"))
+
+
+def rounds_of(pw_hash):
+    """Return the cost factor stored in a bcrypt hash, e.g. 12 for $2b$12$..."""
+
+    return int(pw_hash.split("$")[2])
+
+
+def calibrate_rounds(budget_ms, min_rounds=10, max_rounds=16, samples=3):
+    """
+    Return the highest cost whose median hash time on this host fits in
+    budget_ms, and never less than min_rounds.
+    """
+
+    rounds = min_rounds
+    for candidate in range(min_rounds, max_rounds + 1):
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            _generate_password_hash("calibration", candidate)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        if statistics.median(timings) > budget_ms:
+            break
+        rounds = candidate
+
+    return rounds
+
+
+class HashingExecutor:
+    """Run bcrypt hashing and verification on a bounded worker pool."""
+
+    def __init__(self, app=None):
+        self.kind = "thread"
+        self.workers = os.cpu_count() or 1
+        self.queue_size = self.workers * 4
+        self.queue_timeout = 5.0
+        self.rounds = 12
+
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._stats = {}
+        # called as listener(name, seconds) in the caller's thread after each job
+        self.listeners = []
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read pool settings from app.config."""
+
+        self.kind = app.config.setdefault("HASHING_POOL", self.kind)
+        self.workers = app.config.setdefault("HASHING_WORKERS", self.workers)
+        self.queue_size = app.config.setdefault("HASHING_QUEUE_SIZE", self.workers * 4)
+        self.queue_timeout = app.config.setdefault("HASHING_QUEUE_TIMEOUT", self.queue_timeout)
+        self.rounds = app.config.setdefault("BCRYPT_LOG_ROUNDS", self.rounds)
+
+        # pick the cost from a latency budget instead of a fixed number
+        budget_ms = app.config.setdefault("BCRYPT_TARGET_MS", None)
+        if budget_ms:
+            self.rounds = calibrate_rounds(
+                budget_ms,
+                min_rounds=app.config.setdefault("BCRYPT_MIN_ROUNDS", 10),
+                max_rounds=app.config.setdefault("BCRYPT_MAX_ROUNDS", 16))
+            app.config["BCRYPT_LOG_ROUNDS"] = self.rounds
+            app.logger.info("bcrypt cost calibrated to %d for a %d ms budget", self.rounds, budget_ms)
+
+        app.extensions["hashing"] = self
+
+    def _get_pool(self):
+        """Create the pool on first use, so forked workers each get their own."""
+
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    if self.kind == "process":
+                        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._pool = ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix="hashing")
+                    # running jobs plus the ones allowed to wait for a worker
+                    self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        return self._pool
+
+    def _record(self, name, elapsed=None):
+        """Update the stats for one call of name; elapsed=None means rejected."""
+
+        with self._lock:
+            stats = self._stats.setdefault(
+                name, {"calls": 0, "rejected": 0, "failed": 0, "total_ms": 0.0, "max_ms": 0.0})
+            if elapsed is None:
+                stats["rejected"] += 1
+            else:
+                ms = elapsed * 1000
+                stats["calls"] += 1
+                stats["total_ms"] += ms
+                stats["max_ms"] = max(stats["max_ms"], ms)
+
+    def submit(self, name, fn, *args):
+        """
+        Run fn(*args) on the pool and wait for its result.
+        Raise HashingQueueFull if no slot frees up within queue_timeout.
+        """
+
+        pool = self._get_pool()
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._record(name)
+            raise HashingQueueFull(f"hashing queue full ({self.queue_size} waiting)")
+
+        start = time.perf_counter()
+        try:
+            return pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+            elapsed = time.perf_counter() - start
+            self._record(name, elapsed)
+            for listener in self.listeners:
+                listener(name, elapsed)
+
+    def generate_password_hash(self, password):
+        """Return a bcrypt hash of password as a str."""
+
+        return self.submit("generate", _generate_password_hash, password, self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        """Return True if password matches pw_hash."""
+
+        matched = self.submit("check", _check_password_hash, pw_hash, password)
+
+        if not matched:
+            with self._lock:
+                self._stats["check"]["failed"] += 1
+        return matched
+
+    def needs_rehash(self, pw_hash):
+        """Return True if pw_hash was made at a lower cost than the current one."""
+
+        return rounds_of(pw_hash) < self.rounds
+
+    def stats(self):
+        """Return a snapshot of per-operation timing stats."""
+
+        with self._lock:
+            snapshot = {name: dict(stats) for name, stats in self._stats.items()}
+
+        for stats in snapshot.values():
+            stats["avg_ms"] = stats["total_ms"] / stats["calls"] if stats["calls"] else 0.0
+        return snapshot
+
+    def shutdown(self):
+        """Stop the pool; it is recreated on the next submit."""
+
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def hash_many(passwords, rounds, workers=None, chunksize=64, pool=None):
+    """
+    Hash a batch of passwords across worker processes, for bulk jobs such as
+    seeding or importing users. Return the hashes in the order of passwords.
+    Pass a ProcessPoolExecutor as pool to reuse it across batches.
+    """
+
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return hash_many(passwords, rounds, chunksize=chunksize, pool=pool)
+
+    return list(pool.map(_generate_password_hash, passwords,
+                         itertools.repeat(rounds), chunksize=chunksize))
+
+
+hasher = HashingExecutor()
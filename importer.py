@@ -0,0 +1,140 @@
+"""Bulk import of user accounts from CSV or NDJSON.
+
+    flask import-users customers.csv
+    flask import-users --format ndjson --batch-size 2000 - < customers.ndjson
+
+Each record needs username, password, email, first_name and last_name. The
+input is read as a stream and handled one batch at a time, so memory stays
+flat however large the file is. For each batch, usernames that already exist
+are dropped before any hashing, so a failed import can simply be run again.
+The passwords left are hashed across a process pool at the app's bcrypt
+cost. The users then go in with one multi-row INSERT ... ON CONFLICT DO
+NOTHING, which also skips usernames that appeared since the check.
+"""
+
+import csv
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask.cli import with_appcontext
+
+from models import db, User
+from hashing import hasher, hash_many
+
+
+FIELDS = ("username", "password", "email", "first_name", "last_name")
+
+# longest value each column takes
+MAX_LENGTHS = {"username": 20, "email": 50, "first_name": 30, "last_name": 30}
+
+
+def read_records(file, format):
+    """
+    Yield one dict per record of a CSV (with a header row) or NDJSON file.
+    An NDJSON line that isn't JSON is yielded as None, which is_valid rejects.
+    """
+
+    if format == "csv":
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+def is_valid(record):
+    """Return True if record is a dict with every field, each within its column's length."""
+
+    return isinstance(record, dict) and all(isinstance(record.get(field), str) and record[field] for field in FIELDS) and all(
+        len(record[field]) <= length for field, length in MAX_LENGTHS.items())
+
+
+def _insert_ignoring_conflicts(rows):
+    """Insert rows, skipping usernames that exist; return how many went in."""
+
+    # imported here, so the app only loads the dialect it runs on
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(User.__table__).values(rows).on_conflict_do_nothing(
+        index_elements=["username"])
+    return db.session.execute(stmt).rowcount
+
+
+def import_users(records, batch_size=1000, rounds=None, workers=None, progress=None):
+    """
+    Create users from an iterable of record dicts, in batches of batch_size.
+    Call progress(counts) after each batch and return the final counts:
+    read, inserted, existing (username taken) and invalid.
+    """
+
+    rounds = rounds or hasher.rounds
+    counts = {"read": 0, "inserted": 0, "existing": 0, "invalid": 0}
+    records = iter(records)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                return counts
+            counts["read"] += len(batch)
+
+            valid = [record for record in batch if is_valid(record)]
+            counts["invalid"] += len(batch) - len(valid)
+
+            # keep the first record for each username, and skip the ones already taken
+            new = {record["username"]: record for record in reversed(valid)}
+            existing = {username for username, in db.session.query(User.username)
+                        .filter(User.username.in_(list(new)))}
+            new = [record for username, record in new.items() if username not in existing]
+
+            hashes = hash_many([record["password"] for record in new], rounds, pool=pool)
+            rows = [dict({field: record[field] for field in FIELDS}, password=pw_hash)
+                    for record, pw_hash in zip(new, hashes)]
+
+            inserted = _insert_ignoring_conflicts(rows) if rows else 0
+            db.session.commit()
+
+            counts["inserted"] += inserted
+            counts["existing"] += len(valid) - inserted
+            if progress is not None:
+                progress(dict(counts))
+
+
+@click.command("import-users")
+@click.argument("file", type=click.File("r", encoding="utf8"))
+@click.option("--format", "format", type=click.Choice(["csv", "ndjson"]),
+              help="Input format; guessed from the file name by default.")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--rounds", type=int, help="bcrypt cost; defaults to BCRYPT_LOG_ROUNDS.")
+@click.option("--workers", type=int, help="Hashing processes; defaults to one per CPU.")
+@with_appcontext
+def import_users_command(file, format, batch_size, rounds, workers):
+    """Import users from a CSV or NDJSON file, or - for stdin."""
+
+    if format is None:
+        format = "ndjson" if file.name.endswith((".ndjson", ".jsonl")) else "csv"
+
+    start = time.perf_counter()
+
+    def report(counts):
+        rate = counts["read"] / (time.perf_counter() - start)
+        click.echo(f"{counts['read']} read, {counts['inserted']} inserted, "
+                   f"{counts['existing']} existing, {counts['invalid']} invalid "
+                   f"({rate:,.0f} records/s)")
+
+    import_users(read_records(file, format), batch_size, rounds, workers, report)
+    click.echo(f"done in {time.perf_counter() - start:.1f}s")
+
+
+def init_app(app):
+    """Add the import-users command to app's CLI."""
+
+    app.cli.add_command(import_users_command)
@@ -0,0 +1,175 @@
+"""Lightweight per-request timing, cheap enough to leave on in production.
+
+RequestTiming counts SQL queries and the time spent in the database, in
+bcrypt, and rendering Jinja templates for each request. The totals go out in
+a Server-Timing response header (visible in browser dev tools) and, for a
+sample of requests plus every slow one, as a structured JSON log line on the
+"timing" logger.
+
+A streamed response's body runs after its headers are sent, so its
+Server-Timing only covers the view. Its log line is written once the body
+has been sent, with the queries and rendering of the body included.
+Templates rendered inside another template count once, with the outer one.
+
+Each app has its own RequestTiming in app.extensions["timing"];
+`request_timing` is the current app's.
+"""
+
+import json
+import logging
+import random
+import time
+
+from flask import current_app, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.local import LocalProxy
+
+from hashing import hasher
+
+
+logger = logging.getLogger("timing")
+
+# kept in the WSGI environ rather than g: a streamed body runs after the
+# request's app context (and its g) is gone, under a new one
+_ENVIRON_KEY = "hashing.timing"
+
+
+def _current():
+    """Return the timing record of the current request, or None outside one."""
+
+    if has_request_context():
+        return request.environ.get(_ENVIRON_KEY)
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = _current()
+    if timing is not None:
+        timing["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = _current()
+    if timing is not None and "query_start" in timing:
+        timing["db"] += time.perf_counter() - timing.pop("query_start")
+        timing["queries"] += 1
+
+
+def _hashed(name, elapsed):
+    timing = _current()
+    if timing is not None:
+        timing["hash"] += elapsed
+        timing["hashes"] += 1
+
+
+def _before_render(sender, template, context, **extra):
+    timing = _current()
+    if timing is not None:
+        timing["render_starts"].append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    timing = _current()
+    if timing is not None and timing["render_starts"]:
+        start = timing["render_starts"].pop()
+        # a nested template's time is already part of the outer one's
+        if not timing["render_starts"]:
+            timing["render"] += time.perf_counter() - start
+
+
+class RequestTiming:
+    """Collect DB, bcrypt and template timings per request."""
+
+    def __init__(self, app=None):
+        self.server_timing = True
+        self.sample_rate = 0.01
+        self.slow_ms = 1000
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Hook the engine, hashing and template events, and read settings from app.config."""
+
+        self.server_timing = app.config.setdefault("SERVER_TIMING_ENABLED", self.server_timing)
+        self.sample_rate = app.config.setdefault("TIMING_LOG_SAMPLE_RATE", self.sample_rate)
+        self.slow_ms = app.config.setdefault("TIMING_LOG_SLOW_MS", self.slow_ms)
+
+        # listening on the Engine class covers every engine, including ones created later
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        if _hashed not in hasher.listeners:
+            hasher.listeners.append(_hashed)
+
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_rendered, app)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+        app.extensions["timing"] = self
+
+    def _start(self):
+        request.environ[_ENVIRON_KEY] = {
+            "start": time.perf_counter(),
+            "db": 0.0, "queries": 0,
+            "hash": 0.0, "hashes": 0,
+            "render": 0.0, "render_starts": [],
+        }
+
+    def _finish(self, response):
+        timing = request.environ.get(_ENVIRON_KEY)
+        if timing is None:
+            return response
+
+        if self.server_timing:
+            totals = self._totals(timing)
+            response.headers["Server-Timing"] = ", ".join([
+                f'db;dur={totals["db_ms"]:.1f};desc="{timing["queries"]} queries"',
+                f'bcrypt;dur={totals["hash_ms"]:.1f};desc="{timing["hashes"]} hashes"',
+                f'render;dur={totals["render_ms"]:.1f}',
+                f'total;dur={totals["total_ms"]:.1f}',
+            ])
+
+        details = {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+        }
+        if response.is_streamed:
+            # the body is produced after this; log once it has all been sent
+            response.call_on_close(lambda: self._log(timing, details))
+        else:
+            del request.environ[_ENVIRON_KEY]
+            self._log(timing, details)
+
+        return response
+
+    def _totals(self, timing):
+        return {
+            "total_ms": (time.perf_counter() - timing["start"]) * 1000,
+            "db_ms": timing["db"] * 1000,
+            "hash_ms": timing["hash"] * 1000,
+            "render_ms": timing["render"] * 1000,
+        }
+
+    def _log(self, timing, details):
+        totals = self._totals(timing)
+
+        if totals["total_ms"] >= self.slow_ms or random.random() < self.sample_rate:
+            logger.info(json.dumps({
+                **details,
+                "total_ms": round(totals["total_ms"], 1),
+                "db_ms": round(totals["db_ms"], 1),
+                "queries": timing["queries"],
+                "bcrypt_ms": round(totals["hash_ms"], 1),
+                "hashes": timing["hashes"],
+                "render_ms": round(totals["render_ms"], 1),
+            }))
+
+
+# the current app's timing settings
+request_timing = LocalProxy(lambda: current_app.extensions["timing"])
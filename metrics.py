@@ -0,0 +1,394 @@
+"""Prometheus-style metrics with lock-light recording.
+
+Every metric keeps one array of values per thread. Recording only touches
+the calling thread's array, so request threads never contend on a lock; a
+lock is taken once per thread and label set to register a new array, and
+when the registry is rendered to sum them up. When a thread ends, its array
+is added into a retired total and dropped. So counters never go backwards,
+and memory and render time follow the threads alive, not every thread
+there ever was.
+
+The registry renders in the Prometheus text exposition format; the app
+serves it on /metrics when METRICS_ENABLED is set. Besides its own request,
+bcrypt and pool metrics, it reads the admission controller's and fragment
+caches' counters from the app serving the request.
+"""
+
+import threading
+import time
+import weakref
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+from hashing import hasher
+
+
+# default latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Thread:
+    """Held only by a thread's local storage, so it goes away when the thread ends."""
+
+
+class _Shards:
+    """One list of `size` numbers per live thread, plus the sums of finished threads', summed on demand."""
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._live = {}
+        self._retired = [0] * size
+        # reentrant: a finished thread may be retired by whichever thread drops it last
+        self._lock = threading.RLock()
+
+    def mine(self):
+        """Return the calling thread's list, creating it on first use."""
+
+        values = getattr(self._local, "values", None)
+        if values is None:
+            values = self._local.values = [0] * self.size
+            owner = self._local.owner = _Thread()
+            with self._lock:
+                self._live[id(values)] = values
+            weakref.finalize(owner, self._retire, values)
+        return values
+
+    def _retire(self, values):
+        with self._lock:
+            del self._live[id(values)]
+            self._retired = [a + b for a, b in zip(self._retired, values)]
+
+    def total(self):
+        with self._lock:
+            shards = [self._retired, *self._live.values()]
+        return [sum(column) for column in zip(*shards)]
+
+
+class _Metric:
+    kind = None
+    size = 1
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _shards(self, labelvalues):
+        shards = self._children.get(labelvalues)
+        if shards is None:
+            with self._lock:
+                shards = self._children.setdefault(labelvalues, _Shards(self.size))
+        return shards
+
+    def labels(self, *labelvalues):
+        """Return the child metric for these label values."""
+
+        return _Child(self, self._shards(tuple(str(value) for value in labelvalues)))
+
+    def samples(self):
+        """Yield (suffix, labelvalues, extra labels, value) for rendering."""
+
+        with self._lock:
+            children = list(self._children.items())
+        for labelvalues, shards in children:
+            yield "", labelvalues, (), shards.total()[0]
+
+
+class _Child:
+    def __init__(self, metric, shards):
+        self._metric = metric
+        self._shards = shards
+
+    def inc(self, amount=1):
+        self._shards.mine()[0] += amount
+
+    def dec(self, amount=1):
+        self._shards.mine()[0] -= amount
+
+    def observe(self, value):
+        values = self._shards.mine()
+        for i, bound in enumerate(self._metric.buckets):
+            if value <= bound:
+                values[i] += 1
+                break
+        else:
+            values[-3] += 1
+        values[-2] += value
+        values[-1] += 1
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; inc and dec may come from different threads."""
+
+    kind = "gauge"
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # one slot per bucket, one for +Inf, then sum and count
+        self.size = len(self.buckets) + 3
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for labelvalues, shards in children:
+            values = shards.total()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield "_bucket", labelvalues, (("le", le),), cumulative
+            yield "_sum", labelvalues, (), values[-2]
+            yield "_count", labelvalues, (), values[-1]
+
+
+class FunctionMetric(_Metric):
+    """A counter or gauge whose samples are read from a function when rendered."""
+
+    def __init__(self, name, documentation, kind, fn, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        # fn returns {labelvalues tuple: value}
+        self.fn = fn
+
+    def samples(self):
+        for labelvalues, value in self.fn().items():
+            yield "", labelvalues, (), value
+
+
+class Registry:
+    """A set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def function(self, name, documentation, kind, fn, labelnames=()):
+        return self.register(FunctionMetric(name, documentation, kind, fn, labelnames))
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labelvalues, extra, value in metric.samples():
+                labels = _format_labels(metric.labelnames, labelvalues, extra)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("route", "method"))
+requests_total = registry.counter(
+    "http_requests_total", "Requests by route and status.", ("route", "method", "status"))
+requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "Requests currently being handled.")
+hash_duration = registry.histogram(
+    "bcrypt_duration_seconds", "Time spent on bcrypt jobs, including queueing.", ("operation",))
+pool_checkout_wait = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a database connection.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+pool_timeouts = registry.counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up waiting for a connection.", ("pool",))
+
+# the live TimedQueuePools of this process
+_pools = weakref.WeakSet()
+
+
+def _hash_counts(key):
+    stats = hasher.stats().get("check", {})
+    return {(): stats.get(key, 0)}
+
+
+registry.function(
+    "bcrypt_verifications_total", "Password verifications.", "counter",
+    lambda: _hash_counts("calls"))
+registry.function(
+    "bcrypt_verification_failures_total", "Password verifications that did not match.", "counter",
+    lambda: _hash_counts("failed"))
+
+
+def _pool_stats(method):
+    stats = {}
+    for pool in list(_pools):
+        key = (pool.logging_name or "default",)
+        stats[key] = stats.get(key, 0) + method(pool)
+    return stats
+
+
+registry.function(
+    "db_pool_size", "Connections a pool keeps open.", "gauge",
+    lambda: _pool_stats(QueuePool.size), ("pool",))
+registry.function(
+    "db_pool_checked_out", "Connections in use.", "gauge",
+    lambda: _pool_stats(QueuePool.checkedout), ("pool",))
+registry.function(
+    "db_pool_checked_in", "Idle connections in a pool.", "gauge",
+    lambda: _pool_stats(QueuePool.checkedin), ("pool",))
+# negative until the pool is full; above zero it is borrowing from max_overflow
+registry.function(
+    "db_pool_overflow", "Connections open beyond the pool size.", "gauge",
+    lambda: _pool_stats(QueuePool.overflow), ("pool",))
+
+
+def _admission_stats(key):
+    # the admission controller and the caches are the current app's; see app.py
+    if not has_app_context() or "admission" not in current_app.extensions:
+        return {}
+    return {(): current_app.extensions["admission"].stats()[key]}
+
+
+def _cache_stats(key):
+    if not has_app_context():
+        return {}
+    return {(name,): current_app.extensions[f"{name}_cache"].stats()[key]
+            for name in ("user_page", "layout") if f"{name}_cache" in current_app.extensions}
+
+
+registry.function(
+    "admission_admitted_total", "Hashing requests admitted.", "counter",
+    lambda: _admission_stats("admitted"))
+registry.function(
+    "admission_queued_total", "Hashing requests that waited for a slot, admitted or not.", "counter",
+    lambda: _admission_stats("queued"))
+registry.function(
+    "admission_shed_total", "Hashing requests turned away with a 503.", "counter",
+    lambda: _admission_stats("shed"))
+registry.function(
+    "admission_active", "Hashing requests holding a slot.", "gauge",
+    lambda: _admission_stats("active"))
+registry.function(
+    "admission_waiting", "Hashing requests waiting for a slot.", "gauge",
+    lambda: _admission_stats("waiting"))
+
+registry.function(
+    "fragment_cache_hits_total", "Fragments served from a cache.", "counter",
+    lambda: _cache_stats("hits"), ("cache",))
+registry.function(
+    "fragment_cache_misses_total", "Fragment lookups that found nothing and had to render.", "counter",
+    lambda: _cache_stats("misses"), ("cache",))
+registry.function(
+    "fragment_cache_evictions_total", "Owners evicted to keep a cache under its size.", "counter",
+    lambda: _cache_stats("evictions"), ("cache",))
+registry.function(
+    "fragment_cache_invalidations_total", "Owners whose fragments a write dropped.", "counter",
+    lambda: _cache_stats("invalidations"), ("cache",))
+registry.function(
+    "fragment_cache_owners", "Owners with fragments in a cache.", "gauge",
+    lambda: _cache_stats("size"), ("cache",))
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits for a connection, and its saturation."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        _pools.add(self)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            pool_timeouts.labels(self.logging_name or "default").inc()
+            raise
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - start)
+
+
+def _start_request():
+    g._metrics_start = time.perf_counter()
+    requests_in_flight.inc()
+
+
+def _record_status(response):
+    g._metrics_status = response.status_code
+    return response
+
+
+def _finish_request(exc):
+    start = g.pop("_metrics_start", None)
+    if start is None:
+        return
+
+    requests_in_flight.dec()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    request_duration.labels(route, request.method).observe(time.perf_counter() - start)
+    requests_total.labels(route, request.method, g.pop("_metrics_status", 500)).inc()
+
+
+def _hashed(name, elapsed):
+    hash_duration.labels(name).observe(elapsed)
+
+
+def init_app(app):
+    """Record request metrics for app."""
+
+    app.config.setdefault("METRICS_ENABLED", False)
+
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_request)
+
+    if _hashed not in hasher.listeners:
+        hasher.listeners.append(_hashed)
@@ -0,0 +1,46 @@
+"""Initial schema: users and feedback.
+
+Databases created with db.create_all() before migrations existed already
+have these tables; mark them as migrated with `flask db stamp 0001`.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('username', sa.String(length=20), nullable=False),
+        sa.Column('password', sa.String(), nullable=False),
+        sa.Column('email', sa.String(length=50), nullable=False),
+        sa.Column('first_name', sa.String(length=30), nullable=False),
+        sa.Column('last_name', sa.String(length=30), nullable=False),
+        sa.PrimaryKeyConstraint('username'),
+        sa.UniqueConstraint('username'),
+    )
+    op.create_table(
+        'feedback',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('title', sa.String(length=100), nullable=False),
+        sa.Column('content', sa.String(), nullable=False),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(['username'], ['users.username'], name='feedback_username_fkey'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('feedback')
+    op.drop_table('users')
@@ -0,0 +1,46 @@
+"""Delete a user's feedback with ON DELETE CASCADE.
+
+On PostgreSQL the new constraint is added NOT VALID and committed, then
+validated in a transaction of its own, so the feedback table is not locked
+against writes while existing rows are checked.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def _replace_fk(ondelete):
+    if op.get_bind().dialect.name == 'postgresql':
+        on_delete = f'ON DELETE {ondelete}' if ondelete else ''
+        op.execute('ALTER TABLE feedback DROP CONSTRAINT feedback_username_fkey')
+        op.execute(
+            'ALTER TABLE feedback ADD CONSTRAINT feedback_username_fkey '
+            f'FOREIGN KEY (username) REFERENCES users (username) {on_delete} NOT VALID')
+        # commit the DROP/ADD and its ACCESS EXCLUSIVE lock first; validating
+        # only takes a SHARE UPDATE EXCLUSIVE lock, which lets writes through
+        with op.get_context().autocommit_block():
+            op.execute('ALTER TABLE feedback VALIDATE CONSTRAINT feedback_username_fkey')
+    else:
+        with op.batch_alter_table('feedback') as batch_op:
+            batch_op.drop_constraint('feedback_username_fkey', type_='foreignkey')
+            batch_op.create_foreign_key(
+                'feedback_username_fkey', 'users', ['username'], ['username'], ondelete=ondelete)
+
+
+def upgrade():
+    _replace_fk('CASCADE')
+
+
+def downgrade():
+    _replace_fk(None)
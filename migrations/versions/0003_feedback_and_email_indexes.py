@@ -0,0 +1,36 @@
+"""Index feedback by (username, id) and users by email.
+
+The composite index serves the feedback.username foreign key, per-user
+lookups and cascade deletes, and the keyset-paginated listing on the user
+page (WHERE username = ? AND id > ? ORDER BY id). On PostgreSQL both indexes
+are built CONCURRENTLY so the tables stay writable.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_feedback_username_id', 'feedback', ['username', 'id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_users_email', 'users', ['email'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_email', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_feedback_username_id', table_name='feedback', postgresql_concurrently=True)
@@ -0,0 +1,74 @@
+"""Full-text search over feedback title and content.
+
+On PostgreSQL feedback gets a stored generated tsvector column, `search`,
+with the title weighted above the content, and a GIN index on it built
+CONCURRENTLY. The database keeps the column up to date on every write.
+Adding the column rewrites the table, so on a large table run this in a
+quiet period.
+
+On SQLite an external-content FTS5 table, feedback_fts, indexes the same
+text, stemmed like PostgreSQL's english configuration, and is kept in sync
+by triggers.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 10:40:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute(
+            "ALTER TABLE feedback ADD COLUMN search tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', title), 'A') || "
+            "setweight(to_tsvector('english', content), 'B')) STORED")
+        with op.get_context().autocommit_block():
+            op.create_index('ix_feedback_search', 'feedback', ['search'],
+                            postgresql_using='gin', postgresql_concurrently=True)
+
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE feedback_fts USING fts5("
+            "title, content, content='feedback', content_rowid='id', tokenize='porter unicode61')")
+        op.execute(
+            "CREATE TRIGGER feedback_fts_insert AFTER INSERT ON feedback BEGIN "
+            "INSERT INTO feedback_fts (rowid, title, content) VALUES (new.id, new.title, new.content); "
+            "END")
+        op.execute(
+            "CREATE TRIGGER feedback_fts_delete AFTER DELETE ON feedback BEGIN "
+            "INSERT INTO feedback_fts (feedback_fts, rowid, title, content) "
+            "VALUES ('delete', old.id, old.title, old.content); "
+            "END")
+        op.execute(
+            "CREATE TRIGGER feedback_fts_update AFTER UPDATE ON feedback BEGIN "
+            "INSERT INTO feedback_fts (feedback_fts, rowid, title, content) "
+            "VALUES ('delete', old.id, old.title, old.content); "
+            "INSERT INTO feedback_fts (rowid, title, content) VALUES (new.id, new.title, new.content); "
+            "END")
+        op.execute("INSERT INTO feedback_fts (feedback_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index('ix_feedback_search', table_name='feedback', postgresql_concurrently=True)
+        op.drop_column('feedback', 'search')
+
+    elif dialect == 'sqlite':
+        for trigger in ('feedback_fts_insert', 'feedback_fts_delete', 'feedback_fts_update'):
+            op.execute(f"DROP TRIGGER {trigger}")
+        op.execute("DROP TABLE feedback_fts")
@@ -0,0 +1,31 @@
+"""Add a row version to feedback.
+
+The ORM bumps feedback.version_id on every update and checks it, so
+concurrent edits can't silently overwrite each other, and the JSON API
+builds ETags from it. With a constant default, adding the column on
+PostgreSQL doesn't rewrite the table.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 11:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('feedback', sa.Column('version_id', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    # a plain DROP COLUMN (SQLite 3.35+) rather than a batch table copy, which would drop
+    # the full-text search triggers on feedback
+    op.drop_column('feedback', 'version_id')
@@ -0,0 +1,35 @@
+"""Add the sessions table for server-side sessions.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 12:15:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'sessions',
+        sa.Column('id', sa.String(length=64), nullable=False),
+        sa.Column('username', sa.String(length=20), nullable=True),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.Column('expires', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_sessions_username', 'sessions', ['username'])
+    op.create_index('ix_sessions_expires', 'sessions', ['expires'])
+
+
+def downgrade():
+    op.drop_index('ix_sessions_expires', table_name='sessions')
+    op.drop_index('ix_sessions_username', table_name='sessions')
+    op.drop_table('sessions')
@@ -1,18 +1,131 @@
-from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+import os
+import sys
+import weakref
+from collections import namedtuple
+
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.pool import NullPool
+
+from hashing import hasher
+from metrics import TimedQueuePool
+from routing import RoutingSession
+
+
+# every engine this process created, so a forked child can drop the parent's connections
+_engines = weakref.WeakSet()
+
+
+def _dispose_engines():
+    # close=False leaves the parent's connections open for the parent and just forgets them
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_engines)
+
+
+def _enforce_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys unless each connection turns them on;
+    # deleting a user relies on the ON DELETE CASCADE to remove their feedback
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+class SQLAlchemy(_SQLAlchemy):
+    """Flask-SQLAlchemy with this app's engine defaults."""
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+
+        if sa_url.get_backend_name() == "postgresql":
+            if app.config["DB_PGBOUNCER"]:
+                # pgbouncer in transaction mode does the pooling; holding connections here
+                # would pin its server connections to idle workers
+                options.setdefault("poolclass", NullPool)
+            else:
+                # time connection checkouts for the pool wait and saturation metrics
+                options.setdefault("poolclass", TimedQueuePool)
+                options.setdefault("pool_size", app.config["DB_POOL_SIZE"])
+                options.setdefault("max_overflow", app.config["DB_MAX_OVERFLOW"])
+                options.setdefault("pool_timeout", app.config["DB_POOL_TIMEOUT"])
+                options.setdefault("pool_recycle", app.config["DB_POOL_RECYCLE"])
+                # check connections on checkout, so a failover costs a reconnect, not an error
+                options.setdefault("pool_pre_ping", app.config["DB_POOL_PRE_PING"])
+                # names the pool in metrics
+                options.setdefault("pool_logging_name", sa_url.database)
+
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        _engines.add(engine)
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", _enforce_foreign_keys)
+        return engine
+
+    def create_session(self, options):
+        # reads may go to a replica bind; see routing.py
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 
 # Create instance of SQLAlchemy
 db = SQLAlchemy()
 
-# Create instance of Bcrypt
-bcrypt = Bcrypt()
+
+# one page of a user's feedback; prev_before/next_after are the ids to link to
+FeedbackPage = namedtuple("FeedbackPage", ["items", "prev_before", "next_after"])
+
+# one page of search results; prev_page/next_page are the page numbers to link to
+SearchPage = namedtuple("SearchPage", ["items", "prev_page", "next_page"])
 
 
 def connect_db(app):
     """Connect to database."""
 
+    # connections each process keeps, and how many more it may open under load
+    app.config.setdefault("DB_POOL_SIZE", 5)
+    app.config.setdefault("DB_MAX_OVERFLOW", 10)
+    # seconds to wait for a connection before giving up
+    app.config.setdefault("DB_POOL_TIMEOUT", 30)
+    # seconds after which a connection is replaced, below any server or proxy idle timeout
+    app.config.setdefault("DB_POOL_RECYCLE", 1800)
+    app.config.setdefault("DB_POOL_PRE_PING", True)
+    # set when connecting through pgbouncer in transaction mode
+    app.config.setdefault("DB_PGBOUNCER", False)
+
     db.app = app
     db.init_app(app)
+
+    # Alembic takes longer to import than the rest of the app, and only migrations use it.
+    # `flask db` is a CLI plugin, imported before the CLI loads the app; reset_db registers it itself
+    if "flask_migrate" in sys.modules:
+        init_migrations(app)
+
+
+def init_migrations(app):
+    """Register Flask-Migrate on app; the schema lives in migrations/."""
+
+    from flask_migrate import Migrate
+
+    if "migrate" not in app.extensions:
+        Migrate(app, db)
+
+
+def reset_db():
+    """Drop every table and rebuild the schema from the migrations."""
+
+    from flask_migrate import upgrade, downgrade
+
+    init_migrations(current_app)
+    if db.inspect(db.engine).has_table("alembic_version"):
+        downgrade(revision="base")
+
+    # tables left over from before migrations existed
+    db.drop_all()
+    upgrade()
     
     
 class User(db.Model):
@@ -25,13 +138,16 @@ class User(db.Model):
     # password - a not-nullable column that is text
     password = db.Column(db.String, nullable=False)
     # email - a not-nullable column that is unique and no longer than 50 characters.
-    email = db.Column(db.String(50), nullable=False)
+    email = db.Column(db.String(50), nullable=False, index=True)
     # first_name - a not-nullable column that is no longer than 30 characters.
     first_name = db.Column(db.String(30), nullable=False)
     # last_name - a not-nullable column that is no longer than 30 characters.
     last_name = db.Column(db.String(30), nullable=False)
     
-    feedback = db.relationship('Feedback', backref='user', cascade="all,delete")
+    # dynamic, so user.feedback is a query and pages can be loaded without the whole list;
+    # passive_deletes leaves removing feedback to the ON DELETE CASCADE foreign key
+    feedback = db.relationship('Feedback', backref='user', cascade="all,delete", lazy="dynamic",
+                               passive_deletes=True)
     
     
     @classmethod
@@ -39,9 +155,8 @@ class User(db.Model):
     
         """Register user w/ hashed password & return user."""
         
-        hashed = bcrypt.generate_password_hash(password)
-        # turn hashed bytestring into string
-        hashed_utf8 = hashed.decode('utf8')
+        # hash on the shared pool rather than the request worker
+        hashed_utf8 = hasher.generate_password_hash(password)
         
         user = cls(username=username, password=hashed_utf8, email=email, first_name=first_name, last_name=last_name)
         
@@ -62,16 +177,72 @@ class User(db.Model):
         user = User.query.filter_by(username=username).first()
         
         # Check that bcrypt returns true in this conditional
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and hasher.check_password_hash(user.password, password):
+            
+            # upgrade hashes stored at an older, cheaper cost while we know the password
+            if hasher.needs_rehash(user.password):
+                user.password = hasher.generate_password_hash(password)
+                db.session.commit()
+            
             return user
         else:
             return False
         
+    @classmethod
+    def with_feedback_page(cls, username, after=None, before=None, limit=20):
+        """
+        Load a user and a page of at most limit of their feedback items in a
+        single query. Items are ordered by id, which is used as a keyset: items
+        after `after`, or items before `before`. Return (user, FeedbackPage),
+        with user None if there is no such user.
+        """
+        
+        # outer join, so a user without (more) feedback still comes back as one row
+        join_on = Feedback.username == cls.username
+        if before is not None:
+            # walk backwards from `before`, then put the page back in order
+            join_on &= Feedback.id < before
+            order = Feedback.id.desc()
+        else:
+            if after is not None:
+                join_on &= Feedback.id > after
+            order = Feedback.id
+        
+        rows = (db.session.query(cls, Feedback)
+                .outerjoin(Feedback, join_on)
+                .filter(cls.username == username)
+                .order_by(order)
+                .limit(limit + 1)
+                .all())
+        
+        if not rows:
+            return None, FeedbackPage([], None, None)
+        
+        user = rows[0][0]
+        items = [feedback for _, feedback in rows if feedback is not None]
+        
+        if before is not None:
+            has_prev, has_next = len(items) > limit, True
+            items = items[:limit][::-1]
+        else:
+            has_prev, has_next = after is not None, len(items) > limit
+            items = items[:limit]
+        
+        if not items:
+            return user, FeedbackPage(items, None, None)
+        
+        return user, FeedbackPage(
+            items,
+            items[0].id if has_prev else None,
+            items[-1].id if has_next else None)
+        
 
 class Feedback(db.Model):
     """Feedback."""
     
     __tablename__ = "feedback"
+    # serves the foreign key, cascade deletes and keyset pagination by user
+    __table_args__ = (db.Index("ix_feedback_username_id", "username", "id"),)
     
     # id - a unique primary key that is an auto incrementing integer
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -81,4 +252,76 @@ class Feedback(db.Model):
     content = db.Column(db.String, nullable=False)
     # username - a foreign key that references the username column in the users table
     # username = db.relationship('User', backref='feedback')
-    username = db.Column(db.String, db.ForeignKey("users.username"), nullable=False)
\ No newline at end of file
+    username = db.Column(db.String, db.ForeignKey("users.username", ondelete="CASCADE"), nullable=False)
+    # version_id - bumped on every update; an update of a stale row raises StaleDataError
+    version_id = db.Column(db.Integer, nullable=False, server_default="1")
+    
+    __mapper_args__ = {"version_id_col": version_id}
+    
+    @classmethod
+    def search(cls, terms, username=None, page=1, limit=20, max_matches=1000):
+        """
+        Full-text search of feedback titles and content, best matches first,
+        optionally only username's. Return a SearchPage of at most limit items.
+        Only the max_matches best matches can be paged through. Every match is
+        still ranked to find them, so a very common term costs one rank per
+        matching row, but the sort keeps just max_matches rows (a top-N sort
+        on PostgreSQL) and the pages are cut from those.
+        """
+        
+        if not terms.split():
+            return SearchPage([], None, None)
+        
+        if db.engine.dialect.name == "postgresql":
+            # feedback.search is the tsvector column kept up to date by the database
+            document = db.literal_column("feedback.search")
+            tsquery = db.func.websearch_to_tsquery("english", terms)
+            rank = db.func.ts_rank(document, tsquery)
+            matches = (db.session.query(cls.id.label("id"), rank.label("rank"))
+                       .filter(document.op("@@")(tsquery)))
+            higher_is_better = True
+        else:
+            # SQLite: the feedback_fts index; quote each word so FTS5 syntax in input is literal
+            fts = db.table("feedback_fts", db.column("rowid"))
+            match = " ".join('"{}"'.format(word.replace('"', '""')) for word in terms.split())
+            # title weighted over content, like the A and B weights on PostgreSQL
+            rank = db.func.bm25(db.literal_column("feedback_fts"), 2.5, 1.0)
+            matches = (db.session.query(fts.c.rowid.label("id"), rank.label("rank"))
+                       .join(cls, cls.id == fts.c.rowid)
+                       .filter(db.literal_column("feedback_fts").op("MATCH")(match)))
+            higher_is_better = False
+        
+        if username is not None:
+            matches = matches.filter(cls.username == username)
+        
+        # the best max_matches, not whichever max_matches the scan finds first
+        best_first = rank.desc() if higher_is_better else rank.asc()
+        candidates = matches.order_by(best_first, cls.id).limit(max_matches).subquery()
+        best_first = candidates.c.rank.desc() if higher_is_better else candidates.c.rank.asc()
+        
+        items = (cls.query
+                 .join(candidates, candidates.c.id == cls.id)
+                 .order_by(best_first, cls.id)
+                 .offset((page - 1) * limit)
+                 .limit(limit + 1)
+                 .all())
+        
+        return SearchPage(
+            items[:limit],
+            page - 1 if page > 1 else None,
+            page + 1 if len(items) > limit else None)
+
+
+class StoredSession(db.Model):
+    """Server-side session data; see sessions.py."""
+    
+    __tablename__ = "sessions"
+    
+    # id - the random session id held in the cookie
+    id = db.Column(db.String(64), primary_key=True)
+    # username - the logged-in user, so all their sessions can be revoked at once
+    username = db.Column(db.String(20), index=True)
+    # data - the session dict, serialized
+    data = db.Column(db.Text, nullable=False)
+    # expires - when the session ends, in seconds since the epoch
+    expires = db.Column(db.Float, nullable=False, index=True)
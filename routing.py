@@ -0,0 +1,97 @@
+"""Route reads to read replicas and writes to the primary database.
+
+Replicas are Flask-SQLAlchemy binds whose key starts with "replica":
+
+    SQLALCHEMY_BINDS = {
+        "replica_a": "postgresql://replica-a/hashing_db",
+        "replica_b": "postgresql://replica-b/hashing_db",
+    }
+
+RoutingSession sends a statement to a replica when all of these hold:
+
+- the request is a GET or HEAD, or its view is marked with @replica_reads;
+- the statement is a read: flushes, INSERTs, UPDATEs and DELETEs always go
+  to the primary, and once a session has written, the rest of its reads do
+  too;
+- the client hasn't written recently. After a request that writes, its
+  session is pinned to the primary for REPLICA_STICKY_SECONDS, so users
+  see their own changes despite replication lag.
+
+Each session picks one replica at random and keeps it, so a request reads
+from a single snapshot source. Without replica binds, or outside a request,
+everything goes to the primary.
+"""
+
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy.sql.dml import UpdateBase
+
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# the session key holding the time until which a client reads from the primary
+STICKY_KEY = "_primary_until"
+
+
+def replica_reads(view):
+    """Let a view that writes rarely, like login, read from a replica whatever its method."""
+
+    view.replica_reads = True
+    return view
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends reads to a replica when the request allows it."""
+
+    def __init__(self, db, autocommit=False, autoflush=True, **options):
+        super().__init__(db, autocommit=autocommit, autoflush=autoflush, **options)
+        self._db = db
+        self._replica = None
+        self._wrote = False
+
+    def _replica_engine(self):
+        if self._replica is None:
+            keys = sorted(key for key in (self.app.config["SQLALCHEMY_BINDS"] or {})
+                          if key.startswith("replica"))
+            if not keys:
+                return None
+            self._replica = self._db.get_engine(self.app, bind=random.choice(keys))
+        return self._replica
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self._wrote = True
+            if has_request_context():
+                g._db_wrote = True
+
+        elif not self._wrote and has_request_context() and g.get("_db_use_replica"):
+            replica = self._replica_engine()
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper, clause)
+
+
+def _route_request():
+    view = current_app.view_functions.get(request.endpoint)
+    read_only = request.method in READ_METHODS or getattr(view, "replica_reads", False)
+    g._db_use_replica = read_only and session.get(STICKY_KEY, 0) < time.time()
+
+
+def _stick_after_write(response):
+    # an emptied session, e.g. after deleting an account, isn't kept alive just for this
+    if g.get("_db_wrote") and session and current_app.config["REPLICA_STICKY_SECONDS"]:
+        session[STICKY_KEY] = time.time() + current_app.config["REPLICA_STICKY_SECONDS"]
+    return response
+
+
+def init_app(app):
+    """Decide per request whether reads may go to a replica."""
+
+    app.config.setdefault("REPLICA_STICKY_SECONDS", 5)
+
+    app.before_request(_route_request)
+    app.after_request(_stick_after_write)
@@ -1,35 +1,196 @@
+"""Fill the database with demo data, and optionally a large synthetic dataset.
+
+    python seed.py
+    python seed.py --users 1000000 --feedback 20000000 --seed 1 \
+        --database-url postgresql:///hashing_db_bench
+
+The database is rebuilt from the migrations, then the demo users tony and
+nessa (password "secret") are created with two feedback items.
+
+--users and --feedback add synthetic users named user<n>, who log in with
+password<n % --passwords>. Only --passwords distinct passwords are hashed,
+in parallel worker processes at cost --rounds; bcrypt is meant to be slow,
+so hashing millions of them would take hours.
+
+Feedback owners follow a Zipf distribution (--skew), so a few users own most
+of the rows. Rows are written in chunks with COPY on PostgreSQL and bulk
+INSERTs elsewhere, with the secondary indexes dropped during the load and
+rebuilt after it. The same --seed always generates the same rows.
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import random
+import time
+
 from app import app
-from models import db, User, Feedback
+from models import db, reset_db, User, Feedback
+from hashing import hash_many
 
-db.drop_all()
-db.create_all()
 
-user = User.register(
-    username = "tony",
-    password = "secret",
-    email = "tony@test.com",
-    first_name = "tony1",
-    last_name = "touch"
+WORDS = (
+    "app", "page", "login", "slow", "fast", "great", "broken", "love", "hate", "button",
+    "error", "feature", "please", "add", "fix", "search", "profile", "password", "email",
+    "mobile", "design", "works", "again", "today", "really", "update", "crash", "feedback",
+    "thanks", "support", "account", "loading", "dark", "mode", "settings", "help", "new",
 )
+FIRST_NAMES = ("ana", "ben", "chen", "dara", "eli", "fatima", "gus", "hana", "ivan", "jo",
+               "kofi", "lena", "mo", "nina", "omar", "pia", "raj", "sara", "tom", "yuki")
+LAST_NAMES = ("adams", "baker", "cruz", "diaz", "evans", "fox", "garcia", "hill", "ito",
+              "jones", "kim", "lopez", "moore", "nguyen", "okafor", "patel", "reed", "smith")
 
-user = User.register(
-    username = "nessa",
-    password = "secret",
-    email = "nessa@test.com",
-    first_name = "nessa",
-    last_name = "touch"
-)
+USER_COLUMNS = ("username", "password", "email", "first_name", "last_name")
+FEEDBACK_COLUMNS = ("title", "content", "username")
 
-fb1 = Feedback(
-    title = "testtitle1",
-    content = "testcontent1",
-    username = "tony"
-)
 
-fb2 = Feedback(
-    title = "testtitle2",
-    content = "testcontent2",
-    username = "tony"
-)
+def seed_demo():
+    """Create the two demo users and tony's feedback."""
+
+    User.register(username="tony", password="secret", email="tony@test.com",
+                  first_name="tony1", last_name="touch")
+    User.register(username="nessa", password="secret", email="nessa@test.com",
+                  first_name="nessa", last_name="touch")
+
+    db.session.add_all([
+        Feedback(title="testtitle1", content="testcontent1", username="tony"),
+        Feedback(title="testtitle2", content="testcontent2", username="tony"),
+    ])
+    db.session.commit()
+
+
+def user_rows(count, hashes, rng):
+    for n in range(count):
+        yield (f"user{n}", hashes[n % len(hashes)], f"user{n}@example.com",
+               rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+
+
+def feedback_rows(count, users, skew, chunk_size, rng):
+    # rank r owns a share proportional to 1 / r**skew; shuffle so rank isn't user number
+    owners = [f"user{n}" for n in range(users)]
+    rng.shuffle(owners)
+    cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, users + 1)))
+
+    while count > 0:
+        batch = min(chunk_size, count)
+        count -= batch
+        for username in rng.choices(owners, cum_weights=cum_weights, k=batch):
+            title = " ".join(rng.choices(WORDS, k=rng.randint(2, 8)))
+            content = " ".join(rng.choices(WORDS, k=rng.randint(5, 60)))
+            yield (title, content, username)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_chunks(table, columns, rows, chunk_size):
+    """COPY rows into table in chunks, committing each; yield the rows written."""
+
+    raw = db.engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        for chunk in chunked(rows, chunk_size):
+            buf = io.StringIO()
+            csv.writer(buf).writerows(chunk)
+            buf.seek(0)
+            cursor.copy_expert(sql, buf)
+            raw.commit()
+            yield len(chunk)
+    finally:
+        raw.close()
+
+
+def insert_chunks(table, columns, rows, chunk_size):
+    """INSERT rows into table in chunks, committing each; yield the rows written."""
+
+    for chunk in chunked(rows, chunk_size):
+        db.session.execute(table.insert(), [dict(zip(columns, row)) for row in chunk])
+        db.session.commit()
+        yield len(chunk)
+
+
+def load(table, columns, rows, total, chunk_size):
+    """Write rows with the fastest method for the database, printing progress."""
+
+    write = copy_chunks if db.engine.dialect.name == "postgresql" else insert_chunks
+
+    start = time.perf_counter()
+    done = 0
+    for written in write(table, columns, rows, chunk_size):
+        done += written
+        elapsed = time.perf_counter() - start
+        print(f"\r{table.name}: {done}/{total} rows, {done / elapsed:,.0f} rows/s", end="", flush=True)
+    print()
+
+
+def seed_synthetic(args):
+    """Generate args.users users and args.feedback feedback items."""
+
+    start = time.perf_counter()
+    passwords = [f"password{n}" for n in range(min(args.passwords, args.users))]
+    hashes = hash_many(passwords, args.rounds, workers=args.workers)
+    print(f"hashed {len(hashes)} passwords at cost {args.rounds} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    # maintaining indexes row by row is much slower than building them once
+    indexes = [index for table in (User.__table__, Feedback.__table__) for index in table.indexes]
+    for index in indexes:
+        index.drop(db.engine)
+    postgres = db.engine.dialect.name == "postgresql"
+    if postgres:
+        # the search index comes from the migrations rather than the models
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX ix_feedback_search")
+
+    load(User.__table__, USER_COLUMNS,
+         user_rows(args.users, hashes, random.Random(f"{args.seed}-users")),
+         args.users, args.chunk_size)
+    if args.users:
+        load(Feedback.__table__, FEEDBACK_COLUMNS,
+             feedback_rows(args.feedback, args.users, args.skew, args.chunk_size,
+                           random.Random(f"{args.seed}-feedback")),
+             args.feedback, args.chunk_size)
+
+    start = time.perf_counter()
+    for index in indexes:
+        index.create(db.engine)
+    if postgres:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("CREATE INDEX ix_feedback_search ON feedback USING gin (search)")
+            conn.exec_driver_sql("ANALYZE users, feedback")
+    print(f"rebuilt indexes in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=0, help="synthetic users to create")
+    parser.add_argument("--feedback", type=int, default=0, help="synthetic feedback items in total")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of feedback per user")
+    parser.add_argument("--passwords", type=int, default=1000, help="distinct passwords to hash")
+    parser.add_argument("--rounds", type=int, default=4, help="bcrypt cost of synthetic passwords")
+    parser.add_argument("--workers", type=int, help="hashing processes; defaults to one per CPU")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", help="defaults to the app's database")
+    args = parser.parse_args()
+
+    if args.database_url:
+        app.config["SQLALCHEMY_DATABASE_URI"] = args.database_url
+
+    with app.app_context():
+        reset_db()
+        seed_demo()
+        if args.users or args.feedback:
+            seed_synthetic(args)
+
 
-db.session.commit()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""Server-side sessions with a process-local cache.
+
+Flask's default session is a signed cookie: it can't be revoked, so a
+deleted user's cookie stays valid until it expires. ServerSessionInterface
+keeps session data in a store instead, and the cookie only holds a random
+session id.
+
+To keep a store round trip off most requests, each process caches sessions
+in an LRU for SESSION_LOCAL_TTL seconds before checking the store again, so
+a revocation made by another process takes effect within that time.
+Sessions slide: every request pushes the expiry out to
+PERMANENT_SESSION_LIFETIME. Those refreshes are written at most once per
+SESSION_REFRESH_INTERVAL per session, and in batches. Session data is only
+written when a request changes it.
+
+Stores:
+
+    MemorySessionStore  in-process only; for tests and single-process servers
+    SqlSessionStore     the sessions table in the app's database
+    RedisSessionStore   any client with the redis-py API
+
+SESSION_BACKEND picks one of "memory", "sql" or "redis" (with
+SESSION_REDIS_URL); when it is unset the app keeps Flask's cookie sessions.
+Each app has its own interface in app.extensions["server_sessions"];
+`server_sessions` is the current app's.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import bindparam
+from werkzeug.datastructures import CallbackDict
+from werkzeug.local import LocalProxy
+
+from models import db, StoredSession
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data, tracking whether a request changed it and who it was opened for."""
+
+    def __init__(self, initial=None, sid=None, expires=None, username=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.username = username
+        self.new = sid is None
+        self.modified = False
+
+
+class MemorySessionStore:
+    """Sessions in a dict, for one process."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        """Return (data, expires) for sid, or None if it is missing or expired."""
+
+        with self._lock:
+            entry = self._sessions.get(sid)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0], entry[1]
+
+    def save(self, sid, data, expires, username):
+        with self._lock:
+            self._sessions[sid] = (data, expires, username)
+
+    def touch(self, expiries):
+        """Set new expiry times, given as {sid: expires}."""
+
+        with self._lock:
+            for sid, expires in expiries.items():
+                if sid in self._sessions:
+                    data, _, username = self._sessions[sid]
+                    self._sessions[sid] = (data, expires, username)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def delete_user(self, username):
+        """Delete every session of username."""
+
+        with self._lock:
+            for sid in [sid for sid, entry in self._sessions.items() if entry[2] == username]:
+                del self._sessions[sid]
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for sid in [sid for sid, entry in self._sessions.items() if entry[1] < now]:
+                del self._sessions[sid]
+
+
+class SqlSessionStore:
+    """Sessions in the sessions table, written outside the request's own transaction."""
+
+    table = StoredSession.__table__
+
+    def load(self, sid):
+        with db.engine.connect() as conn:
+            row = conn.execute(self.table.select().where(self.table.c.id == sid)).first()
+        if row is None or row.expires < time.time():
+            return None
+        return row.data, row.expires
+
+    def save(self, sid, data, expires, username):
+        values = {"data": data, "expires": expires, "username": username}
+        with db.engine.begin() as conn:
+            updated = conn.execute(self.table.update().where(self.table.c.id == sid).values(values))
+            if not updated.rowcount:
+                conn.execute(self.table.insert().values(dict(values, id=sid)))
+
+    def touch(self, expiries):
+        stmt = (self.table.update().where(self.table.c.id == bindparam("sid"))
+                .values(expires=bindparam("new_expires")))
+        with db.engine.begin() as conn:
+            conn.execute(stmt, [{"sid": sid, "new_expires": expires} for sid, expires in expiries.items()])
+
+    def delete(self, sid):
+        with db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.id == sid))
+
+    def delete_user(self, username):
+        with db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.username == username))
+
+    def purge_expired(self):
+        with db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.expires < time.time()))
+
+
+class RedisSessionStore:
+    """Sessions shared through Redis, which expires them itself."""
+
+    def __init__(self, client, prefix="session:"):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, sid):
+        data, expires = self.client.hmget(self.prefix + sid, "data", "expires")
+        if data is None:
+            return None
+        return data.decode() if isinstance(data, bytes) else data, float(expires)
+
+    def save(self, sid, data, expires, username):
+        pipe = self.client.pipeline()
+        pipe.hset(self.prefix + sid, mapping={"data": data, "expires": expires})
+        pipe.expireat(self.prefix + sid, int(expires) + 1)
+        if username is not None:
+            # the ids of each user's sessions, for delete_user
+            pipe.sadd(f"{self.prefix}user:{username}", sid)
+            pipe.expireat(f"{self.prefix}user:{username}", int(expires) + 1)
+        pipe.execute()
+
+    def touch(self, expiries):
+        pipe = self.client.pipeline()
+        for sid, expires in expiries.items():
+            pipe.hset(self.prefix + sid, "expires", expires)
+            pipe.expireat(self.prefix + sid, int(expires) + 1)
+        pipe.execute()
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def delete_user(self, username):
+        key = f"{self.prefix}user:{username}"
+        sids = self.client.smembers(key)
+        self.client.delete(key, *[self.prefix + (sid.decode() if isinstance(sid, bytes) else sid)
+                                  for sid in sids])
+
+    def purge_expired(self):
+        pass
+
+
+class ServerSessionInterface(SessionInterface):
+    """Store sessions server-side, behind a process-local LRU cache."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, app=None, store=None):
+        self.store = store or MemorySessionStore()
+        self.cache_size = 10000
+        self.local_ttl = 5.0
+        self.refresh_interval = 60.0
+        self.flush_interval = 5.0
+        self.flush_size = 100
+        self.purge_interval = 3600.0
+        # the session key that holds the logged-in username, for revoke_user
+        self.user_key = "user_id"
+
+        # sid -> (serialized data, expires, username, checked against the store at)
+        self._cache = OrderedDict()
+        # sid -> new expiry, waiting to be written
+        self._pending = {}
+        self._last_flush = self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read settings from app.config, and take over app's sessions if SESSION_BACKEND is set."""
+
+        backend = app.config.setdefault("SESSION_BACKEND", None)
+        redis_url = app.config.setdefault("SESSION_REDIS_URL", None)
+        self.cache_size = app.config.setdefault("SESSION_CACHE_SIZE", self.cache_size)
+        self.local_ttl = app.config.setdefault("SESSION_LOCAL_TTL", self.local_ttl)
+        self.refresh_interval = app.config.setdefault("SESSION_REFRESH_INTERVAL", self.refresh_interval)
+        self.flush_interval = app.config.setdefault("SESSION_FLUSH_INTERVAL", self.flush_interval)
+        self.flush_size = app.config.setdefault("SESSION_FLUSH_SIZE", self.flush_size)
+
+        if backend == "sql":
+            self.store = SqlSessionStore()
+        elif backend == "redis":
+            # redis is only needed when sessions live there
+            import redis
+            self.store = RedisSessionStore(redis.Redis.from_url(redis_url))
+        elif backend == "memory":
+            self.store = MemorySessionStore()
+
+        if backend:
+            app.session_interface = self
+        app.extensions["server_sessions"] = self
+
+    def _cache_get(self, sid):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is not None:
+                self._cache.move_to_end(sid)
+            return entry
+
+    def _cache_put(self, sid, data, expires, username):
+        with self._lock:
+            self._cache[sid] = (data, expires, username, time.monotonic())
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+            self._pending.pop(sid, None)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return ServerSession()
+
+        entry = self._cache_get(sid)
+        if entry is not None and (time.monotonic() - entry[3] > self.local_ttl or entry[1] < time.time()):
+            entry = None
+
+        if entry is None:
+            stored = self.store.load(sid)
+            if stored is None:
+                self._cache_drop(sid)
+                return ServerSession()
+            data, expires = stored
+            username = self.serializer.loads(data).get(self.user_key)
+            self._cache_put(sid, data, expires, username)
+            entry = (data, expires, username)
+
+        return ServerSession(self.serializer.loads(entry[0]), sid=sid, expires=entry[1], username=entry[2])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid is not None and session.modified:
+                # emptied, e.g. on logout
+                self.store.delete(session.sid)
+                self._cache_drop(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        expires = time.time() + app.permanent_session_lifetime.total_seconds()
+
+        if session.modified or session.new:
+            # only changed sessions are written, and those at once, so other processes see them
+            sid = session.sid
+            username = session.get(self.user_key)
+            if sid is None or username != session.username:
+                # a new id whenever the user changes (login, logout), so an id
+                # planted in a browser before login is worthless after it
+                if sid is not None:
+                    self.store.delete(sid)
+                    self._cache_drop(sid)
+                sid = secrets.token_urlsafe(32)
+            data = self.serializer.dumps(dict(session))
+            self.store.save(sid, data, expires, username)
+            self._cache_put(sid, data, expires, username)
+            self._pending.pop(sid, None)
+
+            response.set_cookie(
+                name, sid, expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+        elif expires - session.expires >= self.refresh_interval:
+            # a sliding expiry, refreshed at most once per refresh_interval and written in batches
+            with self._lock:
+                self._pending[session.sid] = expires
+                entry = self._cache.get(session.sid)
+                if entry is not None:
+                    self._cache[session.sid] = (entry[0], expires, entry[2], entry[3])
+
+        self.flush()
+
+    def flush(self, force=False):
+        """Write pending expiry refreshes if there are enough of them or they are old enough."""
+
+        now = time.monotonic()
+        with self._lock:
+            due = force or len(self._pending) >= self.flush_size or (
+                self._pending and now - self._last_flush >= self.flush_interval)
+            if not due:
+                return
+            pending, self._pending = self._pending, {}
+            self._last_flush = now
+            purge = now - self._last_purge >= self.purge_interval
+            if purge:
+                self._last_purge = now
+
+        if pending:
+            self.store.touch(pending)
+        if purge:
+            self.store.purge_expired()
+
+    def revoke_user(self, username):
+        """End every session of username, in this process at once and elsewhere within local_ttl."""
+
+        self.store.delete_user(username)
+        with self._lock:
+            for sid in [sid for sid, entry in self._cache.items() if entry[2] == username]:
+                del self._cache[sid]
+                self._pending.pop(sid, None)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._pending.clear()
+
+
+# the current app's sessions
+server_sessions = LocalProxy(lambda: current_app.extensions["server_sessions"])
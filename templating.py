@@ -0,0 +1,122 @@
+"""Template compilation and layout caching.
+
+Jinja parses and compiles each template the first time a process renders
+it, so every restarted worker pays for that again on its first requests.
+With TEMPLATE_BYTECODE_DIR set, compiled templates are kept in that
+directory and loaded from there instead; run `flask warm-templates` at
+deploy time so even the first worker finds them. Jinja checks the source
+checksum, so a changed template is simply compiled again.
+
+The layout's navbar only depends on who is logged in, so base.html renders
+it inside a cache tag:
+
+    {% cache "navbar", session.get("user_id") %}...{% endcache %}
+
+which renders the body once per (name, owner) and keeps it in the app's
+layout_cache.
+
+stream_template is render_template for pages too large to build in memory:
+it renders as the response is sent, a few kilobytes at a time.
+"""
+
+import os
+
+import click
+from flask import current_app, before_render_template, template_rendered
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.environment import TemplateStream
+from jinja2.ext import Extension
+
+from cache import FragmentCache
+
+
+# template output pieces (each a tag, a variable or a run of text) joined into one chunk
+STREAM_BUFFER = 100
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache name, owner %} tag, backed by the environment's fragment_cache."""
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(self.call_method("_cached", args), [], [], body).set_lineno(lineno)
+
+    def _cached(self, name, owner, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        fragment = cache.get(owner, name)
+        if fragment is None:
+            fragment = caller()
+            cache.set(owner, name, fragment)
+        return fragment
+
+
+def stream_template(template_name, **context):
+    """Yield the named template rendered with context, in chunks; wrap it in stream_with_context."""
+
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+
+    # the same signals as render_template; template_rendered once the last chunk is out
+    before_render_template.send(app, template=template, context=context)
+
+    def generate():
+        yield from template.generate(context)
+        template_rendered.send(app, template=template, context=context)
+
+    stream = TemplateStream(generate())
+    stream.enable_buffering(STREAM_BUFFER)
+    return stream
+
+
+@click.command("warm-templates")
+@with_appcontext
+def warm_templates_command():
+    """Compile every template into TEMPLATE_BYTECODE_DIR."""
+
+    directory = current_app.config["TEMPLATE_BYTECODE_DIR"]
+    if not directory:
+        raise click.UsageError("Set TEMPLATE_BYTECODE_DIR first.")
+
+    env = current_app.jinja_env
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+
+    click.echo(f"compiled {len(names)} templates into {directory}")
+
+
+def init_app(app):
+    """Set up the bytecode cache, the cache tag and `flask warm-templates` for app."""
+
+    directory = app.config.setdefault("TEMPLATE_BYTECODE_DIR", None)
+    # fragments of the shared layout, such as the navbar, by logged-in username (None when logged out)
+    layout_cache = FragmentCache(maxsize=10000, ttl=300, max_variants=4)
+    layout_cache.init_app(app, prefix="LAYOUT_CACHE")
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = layout_cache
+
+    app.cli.add_command(warm_templates_command)
@@ -0,0 +1,79 @@
+import threading
+from unittest import TestCase
+
+from admission import AdmissionController, Overloaded
+
+
+class AdmissionControllerTestCase(TestCase):
+    """Tests for the hashing path concurrency limiter."""
+
+    def setUp(self):
+        """Allow one request at a time and one more waiting."""
+
+        self.controller = AdmissionController()
+        self.controller.max_concurrent = 1
+        self.controller.max_queue = 1
+        self.controller.queue_timeout = 0.05
+        self.controller.retry_after = 3
+
+    def test_admit(self):
+        """Test that a request under the limit is admitted."""
+
+        with self.controller.admit():
+            self.assertEqual(self.controller.stats()["active"], 1)
+
+        stats = self.controller.stats()
+        self.assertEqual(stats["admitted"], 1)
+        self.assertEqual(stats["active"], 0)
+
+    def test_queue_deadline_sheds(self):
+        """Test that a queued request is shed once its deadline passes."""
+
+        with self.controller.admit():
+            with self.assertRaises(Overloaded) as cm:
+                with self.controller.admit():
+                    pass
+
+        self.assertEqual(cm.exception.retry_after, 3)
+        stats = self.controller.stats()
+        self.assertEqual(stats["queued"], 1)
+        self.assertEqual(stats["shed"], 1)
+        self.assertEqual(stats["waiting"], 0)
+
+    def test_full_queue_sheds_immediately(self):
+        """Test that requests beyond the wait queue are shed without queueing."""
+
+        self.controller.max_queue = 0
+
+        with self.controller.admit():
+            with self.assertRaises(Overloaded):
+                with self.controller.admit():
+                    pass
+
+        self.assertEqual(self.controller.stats()["queued"], 0)
+
+    def test_queued_request_admitted_when_slot_frees(self):
+        """Test that a waiting request runs once the active one finishes."""
+
+        self.controller.queue_timeout = 5
+        entered = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with self.controller.admit():
+                entered.set()
+                release.wait()
+
+        worker = threading.Thread(target=hold)
+        worker.start()
+        entered.wait()
+
+        threading.Timer(0.05, release.set).start()
+        with self.controller.admit():
+            pass
+        worker.join()
+
+        stats = self.controller.stats()
+        self.assertEqual(stats["admitted"], 2)
+        self.assertEqual(stats["queued"], 1)
+        self.assertEqual(stats["shed"], 0)
@@ -1,33 +1,149 @@
+import csv
+import gzip
+import itertools
+import json
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
 from unittest import TestCase
+from unittest.mock import patch
+from flask import g, request
+from flask_migrate import downgrade, upgrade
 
-from app import app
-from models import db, User, Feedback
+from sqlalchemy import create_engine, event, orm, select, insert, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import NullPool
 
-# Use test database and don't clutter tests with SQL
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///hashing_db_test'
-app.config['SQLALCHEMY_ECHO'] = False
+from app import create_app
+from models import db, reset_db, User, Feedback, StoredSession
+from hashing import hasher, rounds_of
+from importer import import_users, read_records
+import exporter
+from sessions import SqlSessionStore
+from routing import STICKY_KEY
+from metrics import TimedQueuePool
 
-# Make Flask errors be real errors, rather than HTML pages with error info
-app.config['TESTING'] = True
+# Run the suite in parallel with pytest-xdist (pytest -n auto); each worker gets a database of its own
+WORKER = os.environ.get("PYTEST_XDIST_WORKER")
+TEST_DB = f"hashing_db_test_{WORKER}" if WORKER else "hashing_db_test"
 
-# This is a bit of hack, but don't use Flask DebugToolbar
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 
-# Don't req CSRF for testing
-app.config['WTF_CSRF_ENABLED'] = False
+def create_database(name):
+    """Create database name on the local server, unless it exists."""
 
-db.drop_all()
-db.create_all()
+    engine = create_engine("postgresql:///postgres", isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as conn:
+            if not conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), name=name).first():
+                conn.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        engine.dispose()
 
-class UserViewsTestCase(TestCase):
+
+create_database(TEST_DB)
+
+app = create_app({
+    # Use test database and don't clutter tests with SQL
+    'SQLALCHEMY_DATABASE_URI': f'postgresql:///{TEST_DB}',
+    'SQLALCHEMY_ECHO': False,
+
+    # The cheapest bcrypt cost; tests check that passwords are hashed, not that hashing is slow
+    'BCRYPT_LOG_ROUNDS': 4,
+
+    # Make Flask errors be real errors, rather than HTML pages with error info
+    'TESTING': True,
+
+    # Don't req CSRF for testing
+    'WTF_CSRF_ENABLED': False,
+})
+
+# the app's own extensions, for tests that reach in outside a request
+admission = app.extensions["admission"]
+login_throttle = app.extensions["login_throttle"]
+user_page_cache = app.extensions["user_page_cache"]
+layout_cache = app.extensions["layout_cache"]
+request_timing = app.extensions["timing"]
+server_sessions = app.extensions["server_sessions"]
+
+# Build the schema from the migrations, the same way production gets it
+with app.app_context():
+    reset_db()
+
+
+@contextmanager
+def capture_queries():
+    """Collect the SQL statements sent while the block runs."""
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        # DbTestCase's savepoints aren't the app's queries
+        if "SAVEPOINT" not in statement:
+            statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", capture)
+
+
+class DbTestCase(TestCase):
+    """
+    A test case whose database changes are rolled back when it ends.
+
+    The test runs in one transaction on one connection, and db.session works
+    in a SAVEPOINT that starts again whenever the app commits or rolls back,
+    so views commit as usual but nothing outlives the test. That keeps each
+    test from paying to clear out the last one.
+    """
+
+    def setUp(self):
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        # sessions take over the connection's savepoint: commit releases it, rollback undoes it
+        self.savepoint = self.connection.begin_nested()
+
+        sessions = db.create_session({"bind": self.connection, "binds": {}})
+        event.listen(sessions, "after_transaction_end", self.restart_savepoint)
+
+        # one session per thread, not per app context: the test and the requests it makes
+        # must share it, or one would end the savepoint the other is using
+        self.scoped_session = db.session
+        db.session = orm.scoped_session(sessions)
+        self.addCleanup(self.end_transaction)
+
+    def add_users(self, *usernames):
+        """Add users with a placeholder password hash, for tests that don't log in."""
+
+        for username in usernames:
+            db.session.add(User(username=username, password="not-a-hash", email=f"{username}@test.com",
+                                first_name="first", last_name="last"))
+        db.session.commit()
+
+    def restart_savepoint(self, session, transaction):
+        if not self.savepoint.is_active:
+            self.savepoint = self.connection.begin_nested()
+
+    def end_transaction(self):
+        db.session.remove()
+        db.session = self.scoped_session
+        self.transaction.rollback()
+        self.connection.close()
+
+
+class UserViewsTestCase(DbTestCase):
     """Tests for views for User."""
     
     def setUp(self):
         """Add sample user."""
 
-        Feedback.query.delete()
-        User.query.delete()
-        db.session.commit()
+        super().setUp()
+
+        login_throttle.reset()
+        user_page_cache.clear()
 
         user = User.register(
             username = "test_u1",
@@ -54,6 +170,7 @@ class UserViewsTestCase(TestCase):
             html = resp.get_data(as_text=True)
             
             self.assertIn("Oops", html)
+            self.assertEqual(resp.status_code, 404)
         
     def test_302_redirect_for_non_logged_in_users(self):
         """Test that non-logged-in users are taken to register page."""
@@ -167,6 +284,78 @@ class UserViewsTestCase(TestCase):
             self.assertEqual(resp[0].status_code, 200)
             self.assertIn(self.username, html)
             
+    def test_login_upgrades_outdated_hash(self):
+        """Test that logging in rehashes a password stored at a lower cost."""
+
+        user = User.register(
+            username = "test_u4",
+            password = "test_secret",
+            email = "test_u4@test.com",
+            first_name = "test_f4",
+            last_name = "test_l4"
+        )
+        db.session.commit()
+
+        # the cost goes up after the password was stored
+        rounds = hasher.rounds + 1
+        hasher.rounds = rounds
+        try:
+            with app.test_client() as client:
+                resp = client.post(
+                    "/login", data={
+                        "username" : "test_u4",
+                        "password" : "test_secret",
+                    })
+        finally:
+            hasher.rounds = rounds - 1
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(rounds_of(User.query.get("test_u4").password), rounds)
+            
+    def test_login_shed_when_overloaded(self):
+        """Test that login POSTs get a 503 with Retry-After once admission is saturated."""
+
+        max_concurrent, max_queue = admission.max_concurrent, admission.max_queue
+        admission.max_concurrent = 0
+        admission.max_queue = 0
+        try:
+            with app.test_client() as client:
+                resp = client.post(
+                    "/login", data={
+                        "username" : self.username,
+                        "password" : "test_secret",
+                    })
+
+                self.assertEqual(resp.status_code, 503)
+                self.assertEqual(resp.headers["Retry-After"], str(admission.retry_after))
+
+                # other routes are unaffected
+                resp = client.get("/login")
+                self.assertEqual(resp.status_code, 200)
+        finally:
+            admission.max_concurrent = max_concurrent
+            admission.max_queue = max_queue
+            
+    def test_login_throttled(self):
+        """Test that repeated logins for one user get a 429 before any hashing."""
+
+        with app.test_client() as client:
+            for _ in range(login_throttle.user_burst):
+                client.post("/login", data={"username" : self.username, "password" : "wrong"})
+
+            checks = hasher.stats()["check"]["calls"]
+            resp = client.post(
+                "/login", data={
+                    "username" : self.username,
+                    "password" : "test_secret",
+                })
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 429)
+            self.assertIn("Retry-After", resp.headers)
+            self.assertIn("Too many login attempts", html)
+            self.assertEqual(hasher.stats()["check"]["calls"], checks)
+            
     def test_user_page_non_logged_in_session_redirect(self):
         """Test if a non-logged in user attempts to view another user's page, then redirects to /."""
         
@@ -252,15 +441,442 @@ class UserViewsTestCase(TestCase):
             self.assertIn("Password", html)
 
 
-class FeedbackViewsTestCase(TestCase):
+    def test_user_deletion_cascades_to_feedback(self):
+        """Test that deleting a user removes their feedback in a single DELETE."""
+        
+        db.session.add_all([Feedback(title=f"t{i}", content="c", username=self.username) for i in range(5)])
+        db.session.commit()
+        
+        with app.test_client() as client:
+            
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = self.username
+            
+            with capture_queries() as statements:
+                resp = client.post(f'/users/{self.username}/delete')
+            
+            self.assertEqual(resp.status_code, 302)
+            deletes = [st for st in statements if st.startswith("DELETE")]
+            self.assertEqual(len(deletes), 1)
+            self.assertTrue(deletes[0].startswith("DELETE FROM users"))
+            self.assertEqual(Feedback.query.filter_by(username=self.username).count(), 0)
+
+
+class RequestTimingTestCase(DbTestCase):
+    """Tests for per-request timing instrumentation."""
+
+    def setUp(self):
+        super().setUp()
+
+        login_throttle.reset()
+        user_page_cache.clear()
+
+        User.register(
+            username = "test_u1",
+            password = "test_secret",
+            email = "test_u1@test.com",
+            first_name = "test_f",
+            last_name = "test_l"
+        )
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def server_timing(self, resp):
+        """Parse the Server-Timing header into {name: (duration, description)}."""
+
+        metrics = {}
+        for metric in resp.headers["Server-Timing"].split(", "):
+            name, *params = metric.split(";")
+            params = dict(param.split("=", 1) for param in params)
+            metrics[name] = (float(params["dur"]), params.get("desc", "").strip('"'))
+        return metrics
+
+    def test_server_timing_counts_queries_and_render(self):
+        """Test that the header reports queries and template rendering."""
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = "test_u1"
+
+            metrics = self.server_timing(client.get('/users/test_u1'))
+
+            self.assertEqual(metrics["db"][1], "1 queries")
+            self.assertGreater(metrics["render"][0], 0)
+            self.assertEqual(metrics["bcrypt"][1], "0 hashes")
+            self.assertGreaterEqual(metrics["total"][0], metrics["render"][0])
+
+    def test_server_timing_reports_bcrypt(self):
+        """Test that hashing time on login is reported separately."""
+
+        with app.test_client() as client:
+            resp = client.post("/login", data={"username": "test_u1", "password": "test_secret"})
+            metrics = self.server_timing(resp)
+
+            self.assertEqual(metrics["bcrypt"][1], "1 hashes")
+            self.assertGreater(metrics["bcrypt"][0], 0)
+
+    def test_sampled_log(self):
+        """Test that sampled requests are logged as JSON."""
+
+        sample_rate = request_timing.sample_rate
+        request_timing.sample_rate = 1.0
+        try:
+            with app.test_client() as client, self.assertLogs("timing", "INFO") as logs:
+                client.get('/login')
+        finally:
+            request_timing.sample_rate = sample_rate
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["endpoint"], "views.handle_login")
+        self.assertEqual(record["status"], 200)
+        self.assertIn("db_ms", record)
+
+    def test_streamed_response_logged_after_body(self):
+        """Test that a streamed page is logged once sent, with the body's query and rendering."""
+
+        db.session.add_all([Feedback(title=f"t{i}", content="c", username="test_u1") for i in range(20)])
+        db.session.commit()
+
+        sample_rate = request_timing.sample_rate
+        request_timing.sample_rate = 1.0
+        self.addCleanup(setattr, request_timing, "sample_rate", sample_rate)
+
+        with app.test_client() as client, self.assertLogs("timing", "INFO") as logs:
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = "test_u1"
+
+            resp = client.get('/users/test_u1?all=1')
+            self.assertIn("t19", resp.get_data(as_text=True))
+            self.assertEqual(logs.records, [])
+            resp.close()
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["endpoint"], "views.show_user_details")
+        # the user, then the feedback the body streamed
+        self.assertEqual(record["queries"], 2)
+        self.assertGreater(record["render_ms"], 0)
+
+    def test_nested_render_counted_once(self):
+        """Test that a template rendered inside another adds nothing to the render time."""
+
+        from instrumentation import _before_render, _rendered
+
+        # a clock that moves on a second per read
+        with app.test_request_context(), patch("instrumentation.time.perf_counter",
+                                                side_effect=itertools.count()):
+            request_timing._start()
+            _before_render(app, template=None, context={})
+            _before_render(app, template=None, context={})
+            _rendered(app, template=None, context={})
+            _rendered(app, template=None, context={})
+
+            # the outer template, read at 1 and 3
+            self.assertEqual(request.environ["hashing.timing"]["render"], 2)
+
+
+class MetricsTestCase(TestCase):
+    """Tests for the /metrics endpoint."""
+
+    def tearDown(self):
+        app.config["METRICS_ENABLED"] = False
+
+    def test_metrics_disabled_by_default(self):
+        """Test that /metrics is not served unless enabled."""
+
+        with app.test_client() as client:
+            resp = client.get('/metrics')
+
+            self.assertIn("Oops", resp.get_data(as_text=True))
+            self.assertEqual(resp.status_code, 404)
+
+    def test_metrics_report_routes(self):
+        """Test that route latency, bcrypt and pool metrics are exported."""
+
+        app.config["METRICS_ENABLED"] = True
+
+        with app.test_client() as client:
+            client.get('/login')
+            client.post("/login", data={"username" : "nobody", "password" : "wrong"})
+            resp = client.get('/metrics')
+            text = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('http_request_duration_seconds_count{route="/login",method="GET"}', text)
+            self.assertIn('http_requests_total{route="/login",method="POST",status="200"}', text)
+            self.assertIn("http_requests_in_flight 1", text)
+            self.assertIn("bcrypt_verifications_total", text)
+            self.assertIn("db_pool_checkout_wait_seconds_count", text)
+            self.assertIn(f'db_pool_size{{pool="{TEST_DB}"}} 5', text)
+            self.assertIn(f'db_pool_checked_out{{pool="{TEST_DB}"}}', text)
+
+    def sample(self, client, line):
+        """Return the value of the /metrics sample named line, e.g. 'admission_shed_total'."""
+
+        text = client.get('/metrics').get_data(as_text=True)
+        values = [sample.rsplit(" ", 1)[1] for sample in text.splitlines() if sample.startswith(line + " ")]
+        self.assertEqual(len(values), 1, f"{line} not in /metrics")
+        return float(values[0])
+
+    def test_metrics_report_shedding_and_cache_hits(self):
+        """Test that admission and fragment cache counters are exported."""
+
+        app.config["METRICS_ENABLED"] = True
+        max_concurrent, max_queue = admission.max_concurrent, admission.max_queue
+        self.addCleanup(setattr, admission, "max_concurrent", max_concurrent)
+        self.addCleanup(setattr, admission, "max_queue", max_queue)
+
+        with app.test_client() as client:
+            shed = self.sample(client, "admission_shed_total")
+            hits = self.sample(client, 'fragment_cache_hits_total{cache="user_page"}')
+            misses = self.sample(client, 'fragment_cache_misses_total{cache="user_page"}')
+
+            admission.max_concurrent = admission.max_queue = 0
+            self.assertEqual(client.post("/login", data={"username": "nobody", "password": "x"}).status_code, 503)
+            admission.max_concurrent, admission.max_queue = max_concurrent, max_queue
+
+            user_page_cache.get("metrics_owner", "key")
+            user_page_cache.set("metrics_owner", "key", "fragment")
+            user_page_cache.get("metrics_owner", "key")
+            user_page_cache.invalidate("metrics_owner")
+
+            self.assertEqual(self.sample(client, "admission_shed_total"), shed + 1)
+            self.assertEqual(self.sample(client, 'fragment_cache_hits_total{cache="user_page"}'), hits + 1)
+            self.assertEqual(self.sample(client, 'fragment_cache_misses_total{cache="user_page"}'), misses + 1)
+            self.assertGreaterEqual(self.sample(client, "admission_admitted_total"), 0)
+            self.sample(client, 'fragment_cache_owners{cache="layout"}')
+
+
+class PoolConfigTestCase(TestCase):
+    """Tests for connection pool settings and fork safety."""
+
+    def tearDown(self):
+        app.config["DB_PGBOUNCER"] = False
+
+    def engine_options(self):
+        return db.apply_driver_hacks(app, make_url(app.config["SQLALCHEMY_DATABASE_URI"]), {})[1]
+
+    def test_pool_settings(self):
+        """Test that the DB_POOL_* settings reach the engine."""
+
+        options = self.engine_options()
+
+        self.assertIs(options["poolclass"], TimedQueuePool)
+        self.assertEqual(options["pool_size"], app.config["DB_POOL_SIZE"])
+        self.assertEqual(options["max_overflow"], app.config["DB_MAX_OVERFLOW"])
+        self.assertEqual(options["pool_recycle"], app.config["DB_POOL_RECYCLE"])
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_pgbouncer_disables_pooling(self):
+        """Test that behind pgbouncer connections aren't kept by the app."""
+
+        app.config["DB_PGBOUNCER"] = True
+        options = self.engine_options()
+
+        self.assertIs(options["poolclass"], NullPool)
+        self.assertNotIn("pool_size", options)
+
+    def test_fork_drops_inherited_connections(self):
+        """Test that a forked child opens its own connections and leaves the parent's alone."""
+
+        with app.app_context():
+            parent_pid = db.session.execute("SELECT pg_backend_pid()").scalar()
+            db.session.commit()
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # the child: report its backend pid, then leave without running any cleanup
+            try:
+                os.close(read)
+                with app.app_context():
+                    child_pid = db.session.execute("SELECT pg_backend_pid()").scalar()
+                    db.session.commit()
+                os.write(write, str(child_pid).encode())
+            finally:
+                os._exit(0)
+
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            child_pid = int(pipe.read())
+        os.waitpid(pid, 0)
+
+        with app.app_context():
+            # the parent's pooled connection still works after the child exits
+            self.assertEqual(db.session.execute("SELECT pg_backend_pid()").scalar(), parent_pid)
+            db.session.commit()
+        self.assertNotEqual(child_pid, parent_pid)
+
+
+class SqliteTestCase(TestCase):
+    """Tests for SQLite, the stand-in for PostgreSQL in benchmarks and local runs."""
+
+    def test_user_delete_cascades_to_feedback(self):
+        """Test that foreign keys are enforced, so deleting a user deletes their feedback."""
+
+        engine = db.create_engine(make_url("sqlite://"), {})
+        self.addCleanup(engine.dispose)
+        db.metadata.create_all(engine, tables=[User.__table__, Feedback.__table__])
+
+        with orm.Session(engine) as session:
+            session.add(User(username="test_u1", password="not-a-hash", email="test_u1@test.com",
+                             first_name="first", last_name="last"))
+            session.add_all([Feedback(title=f"title {i}", content="content", username="test_u1")
+                             for i in range(3)])
+            session.commit()
+
+            session.query(User).filter_by(username="test_u1").delete()
+            session.commit()
+
+            self.assertEqual(session.query(Feedback).count(), 0)
+
+
+class AppFactoryTestCase(TestCase):
+    """Tests for create_app, each in a fresh interpreter so the suite's app is left alone."""
+
+    def run_python(self, code):
+        """Run code in a new interpreter and return the JSON it prints."""
+
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return json.loads(result.stdout)
+
+    def test_create_app_does_no_io(self):
+        """Test that building the app and serving a form neither connects nor loads the toolbar or Alembic."""
+
+        status, engines, toolbar, alembic = self.run_python(
+            "import json, sys\n"
+            "from app import create_app\n"
+            "app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///no_such_database'})\n"
+            "status = app.test_client().get('/login').status_code\n"
+            "print(json.dumps([status, list(app.extensions['sqlalchemy'].connectors),"
+            " 'flask_debugtoolbar' in sys.modules, 'alembic' in sys.modules]))")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(engines, [])
+        self.assertFalse(toolbar)
+        self.assertFalse(alembic)
+
+    def test_debug_toolbar_when_enabled(self):
+        """Test that the toolbar is still there when asked for."""
+
+        self.assertTrue(self.run_python(
+            "import json\n"
+            "from app import create_app\n"
+            "print(json.dumps('debugtoolbar' in create_app({'DEBUG_TB_ENABLED': True}).blueprints))"))
+
+    def test_apps_keep_their_own_settings(self):
+        """Test that a second app gets its own extensions, and each app's requests use its own."""
+
+        self.assertEqual(self.run_python(
+            "import json\n"
+            "from app import create_app\n"
+            "from admission import admission\n"
+            "from cache import user_page_cache, layout_cache\n"
+            "first = create_app({'ADMISSION_MAX_CONCURRENT': 1, 'USER_PAGE_CACHE_TTL': 10})\n"
+            "second = create_app({'ADMISSION_MAX_CONCURRENT': 2, 'USER_PAGE_CACHE_ENABLED': False})\n"
+            "settings = []\n"
+            "for app in (first, second):\n"
+            "    with app.app_context():\n"
+            "        settings.append([admission.max_concurrent, user_page_cache.ttl, user_page_cache.enabled,\n"
+            "                         app.jinja_env.fragment_cache is layout_cache._get_current_object()])\n"
+            "print(json.dumps(settings + [first.extensions['timing'] is second.extensions['timing']]))"),
+            [[1, 10, True, True], [2, 60, False, True], False])
+
+    def test_module_app_is_built_on_first_use(self):
+        """Test that `from app import app` still works, without building an app on import."""
+
+        self.assertEqual(self.run_python(
+            "import json\n"
+            "import app as module\n"
+            "built_on_import = 'app' in vars(module)\n"
+            "from app import app\n"
+            "print(json.dumps([built_on_import, app is module.app, sorted(app.blueprints)]))"),
+            [False, True, ["api", "views"]])
+
+
+class SchemaTestCase(TestCase):
+    """Tests for the schema built by the migrations."""
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def explain(self, sql, **params):
+        """Return the query plan for sql, with sequential scans discouraged."""
+
+        # the test tables are tiny, so the planner would otherwise always pick a seq scan
+        db.session.execute("SET LOCAL enable_seqscan = off")
+        rows = db.session.execute(f"EXPLAIN {sql}", params)
+        return "\n".join(row[0] for row in rows)
+
+    def test_feedback_listing_uses_username_id_index(self):
+        """Test that the paginated feedback listing is served by ix_feedback_username_id."""
+
+        plan = self.explain(
+            "SELECT * FROM feedback WHERE username = :username AND id > :after ORDER BY id LIMIT 21",
+            username="test_u1", after=0)
+
+        self.assertIn("ix_feedback_username_id", plan)
+        self.assertNotIn("Sort", plan)
+
+    def test_email_lookup_uses_index(self):
+        """Test that looking a user up by email uses ix_users_email."""
+
+        plan = self.explain("SELECT * FROM users WHERE email = :email", email="test_u1@test.com")
+
+        self.assertIn("ix_users_email", plan)
+
+    def test_search_uses_gin_index(self):
+        """Test that full-text matching is served by ix_feedback_search."""
+
+        plan = self.explain(
+            "SELECT id FROM feedback WHERE search @@ websearch_to_tsquery('english', :terms)",
+            terms="slow login")
+
+        self.assertIn("ix_feedback_search", plan)
+
+    def test_foreign_key_validated_after_commit(self):
+        """Test that 0002 commits the new foreign key before validating it, and leaves it validated."""
+
+        db.session.remove()
+        events = []
+
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            events.append(statement)
+
+        def on_commit(conn):
+            events.append("COMMIT")
+
+        with app.app_context():
+            downgrade(revision="0001")
+            event.listen(db.engine, "before_cursor_execute", on_execute)
+            event.listen(db.engine, "commit", on_commit)
+            try:
+                upgrade(revision="0002")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", on_execute)
+                event.remove(db.engine, "commit", on_commit)
+                upgrade()
+
+        add = next(i for i, e in enumerate(events) if "ADD CONSTRAINT feedback_username_fkey" in e)
+        validate = next(i for i, e in enumerate(events) if "VALIDATE CONSTRAINT" in e)
+        self.assertIn("COMMIT", events[add:validate])
+
+        row = db.session.execute(
+            "SELECT convalidated, confdeltype FROM pg_constraint WHERE conname = 'feedback_username_fkey'").one()
+        self.assertEqual(tuple(row), (True, "c"))
+
+
+class FeedbackViewsTestCase(DbTestCase):
     """Tests for Feedback for User."""
     
     def setUp(self):
         """Add sample user."""
 
-        Feedback.query.delete()
-        User.query.delete()
-        db.session.commit()
+        super().setUp()
+
+        user_page_cache.clear()
 
         user_a = User.register(
             username = "test_u1",
@@ -379,6 +995,181 @@ class FeedbackViewsTestCase(TestCase):
             self.assertIn("new content", html)
             self.assertEqual(resp.status_code, 200)
 
+    def test_add_feedback_for_deleted_user(self):
+        """Test that a session left over from a deleted user gets the 404 page, not an error."""
+        
+        with app.test_client() as client:
+            
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = "gone_user"
+            
+            resp = client.post('/users/gone_user/feedback/add', data={"title": "t", "content": "c"})
+            
+            self.assertIn("Oops", resp.get_data(as_text=True))
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(Feedback.query.filter_by(username="gone_user").count(), 0)
+
+    def test_user_page_keyset_pagination(self):
+        """Test that the user page lists feedback a page at a time with next/prev links."""
+        
+        extra = [Feedback(title=f"page_title_{i}", content="c", username=self.username_a) for i in range(4)]
+        db.session.add_all(extra)
+        db.session.commit()
+        ids = [self.feedback_a.id] + [fb.id for fb in extra]
+        
+        with app.test_client() as client:
+            
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = self.username_a
+
+            resp = client.get(f'/users/{self.username_a}?limit=2')
+            html = resp.get_data(as_text=True)
+            
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(self.title_a, html)
+            self.assertIn("page_title_0", html)
+            self.assertNotIn("page_title_1", html)
+            self.assertIn(f"?after={ids[1]}&limit=2", html)
+            self.assertNotIn("?before=", html)
+            
+            resp = client.get(f'/users/{self.username_a}?after={ids[1]}&limit=2')
+            html = resp.get_data(as_text=True)
+            
+            self.assertNotIn("page_title_0", html)
+            self.assertIn("page_title_1", html)
+            self.assertIn("page_title_2", html)
+            self.assertIn(f"?before={ids[2]}&limit=2", html)
+            self.assertIn(f"?after={ids[3]}&limit=2", html)
+            
+            resp = client.get(f'/users/{self.username_a}?before={ids[2]}&limit=2')
+            html = resp.get_data(as_text=True)
+            
+            self.assertIn(self.title_a, html)
+            self.assertIn("page_title_0", html)
+            self.assertNotIn("?before=", html)
+            
+    def test_user_page_all_streamed(self):
+        """Test that ?all=1 streams every feedback item, fetched in batches by one query."""
+        
+        extra = [Feedback(title=f"all_title_{i}", content="c", username=self.username_a) for i in range(150)]
+        db.session.add_all(extra)
+        db.session.commit()
+        titles = [self.title_a] + [fb.title for fb in extra]
+        update = f"/feedback/{self.feedback_a.id}/update"
+        
+        batch = app.config["FEEDBACK_STREAM_BATCH"]
+        app.config["FEEDBACK_STREAM_BATCH"] = 7
+        self.addCleanup(app.config.__setitem__, "FEEDBACK_STREAM_BATCH", batch)
+        
+        with app.test_client() as client:
+            
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = self.username_a
+            
+            self.assertIn("?all=1", client.get(f'/users/{self.username_a}').get_data(as_text=True))
+            
+            with capture_queries() as statements:
+                resp = client.get(f'/users/{self.username_a}?all=1')
+                self.assertTrue(resp.is_streamed)
+                html = resp.get_data(as_text=True)
+            
+            self.assertEqual(resp.status_code, 200)
+            positions = [html.index(f"<h3>{title}</h3>") for title in titles]
+            self.assertEqual(positions, sorted(positions))
+            self.assertNotIn(self.title_b, html)
+            self.assertIn(update, html)
+            self.assertEqual(len([s for s in statements if "FROM feedback" in s]), 1)
+    
+    def test_user_page_all_for_support(self):
+        """Test that support staff may see anyone's whole history, without edit buttons, and others may not."""
+        
+        with app.test_client() as client:
+            
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = self.username_b
+            
+            resp = client.get(f'/users/{self.username_a}?all=1')
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, f"/users/{self.username_b}")
+            
+            app.config["SUPPORT_USERS"] = [self.username_b]
+            self.addCleanup(app.config.__setitem__, "SUPPORT_USERS", [])
+            
+            html = client.get(f'/users/{self.username_a}?all=1').get_data(as_text=True)
+            
+            self.assertIn(self.title_a, html)
+            self.assertNotIn(self.title_b, html)
+            self.assertNotIn("/update", html)
+    
+    def test_user_page_cached(self):
+        """Test that a repeat view of the user page is served from cache without queries."""
+        
+        with app.test_client() as client:
+            
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = self.username_a
+            
+            client.get(f'/users/{self.username_a}')
+            
+            with capture_queries() as statements:
+                resp = client.get(f'/users/{self.username_a}')
+            
+            self.assertIn(self.title_a, resp.get_data(as_text=True))
+            self.assertEqual(statements, [])
+            self.assertGreaterEqual(user_page_cache.stats()["hits"], 1)
+    
+    def test_user_page_cache_invalidated_by_writes(self):
+        """Test that adding, editing and deleting feedback refresh the cached user page."""
+        
+        with app.test_client() as client:
+            
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = self.username_a
+            
+            client.get(f'/users/{self.username_a}')
+            
+            client.post(f'/users/{self.username_a}/feedback/add', json={"title": "cached_add", "content": "c"})
+            html = client.get(f'/users/{self.username_a}').get_data(as_text=True)
+            self.assertIn("cached_add", html)
+            
+            client.post(f'/feedback/{self.feedback_a.id}/update', json={"title": "cached_edit", "content": "c"})
+            html = client.get(f'/users/{self.username_a}').get_data(as_text=True)
+            self.assertIn("cached_edit", html)
+            
+            client.post(f'/feedback/{self.feedback_a.id}/delete')
+            html = client.get(f'/users/{self.username_a}').get_data(as_text=True)
+            self.assertNotIn("cached_edit", html)
+            
+    def assertSelects(self, client, method, url, expected, **kwargs):
+        """Assert that a request runs exactly `expected` SELECT statements."""
+        
+        with capture_queries() as statements:
+            resp = client.open(url, method=method, **kwargs)
+        
+        selects = [st for st in statements if st.startswith("SELECT")]
+        self.assertEqual(len(selects), expected, selects)
+        return resp
+    
+    def test_query_counts_per_route(self):
+        """Test that each route reads the database at most once."""
+        
+        with app.test_client() as client:
+            
+            with client.session_transaction() as change_session:
+                change_session['user_id'] = self.username_a
+            
+            self.assertSelects(client, "GET", "/", 0)
+            self.assertSelects(client, "GET", f"/users/{self.username_a}", 1)
+            self.assertSelects(client, "GET", f"/users/{self.username_a}/feedback/add", 1)
+            self.assertSelects(client, "POST", f"/users/{self.username_a}/feedback/add", 1,
+                               json={"title": "counted", "content": "c"})
+            self.assertSelects(client, "GET", f"/feedback/{self.feedback_a.id}/update", 1)
+            self.assertSelects(client, "POST", f"/feedback/{self.feedback_a.id}/update", 1,
+                               json={"title": "counted_edit", "content": "c"})
+            self.assertSelects(client, "GET", f"/feedback/{self.feedback_b.id}/update", 1)
+            self.assertSelects(client, "POST", f"/feedback/{self.feedback_a.id}/delete", 1)
+            self.assertSelects(client, "POST", f"/users/{self.username_a}/delete", 0)
+            
     def test_feedback_id_update_get_request_for_non_logged_in_user_redirect(self):
         """Test that non-logged-in user always redirects to home."""
         
@@ -543,6 +1334,26 @@ class FeedbackViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn(user_a, html)
         
+    def test_navbar_cached_per_user(self):
+        """Test that the cached navbar shows each client their own name, or the login links."""
+
+        layout_cache.clear()
+
+        for username in (self.username_a, self.username_b, self.username_a):
+            with app.test_client() as client:
+                with client.session_transaction() as change_session:
+                    change_session['user_id'] = username
+
+                html = client.get(f'/users/{username}/feedback/add').get_data(as_text=True)
+
+                self.assertIn(f'<a class="nav-link" href="/users/{username}">{username}</a>', html)
+                self.assertIn("Logout", html)
+
+        html = app.test_client().get('/login').get_data(as_text=True)
+        self.assertNotIn("Logout", html)
+        self.assertIn('href="/register"', html)
+        self.assertGreaterEqual(layout_cache.stats()["hits"], 1)
+        
     def test_that_user_a_deletes_feedback_a(self):
         """Test that User A cannot delete User B's feedback."""
         
@@ -591,4 +1402,550 @@ class FeedbackViewsTestCase(TestCase):
             # ensure the 'logout' button is not in html to confirm that we've been logged out
             self.assertNotIn("logout", html)
             # ensure there are no appearances of username in rendered HTML
-            self.assertNotIn(user_a, html)
\ No newline at end of file
+            self.assertNotIn(user_a, html)
+
+
+class ImportUsersTestCase(DbTestCase):
+    """Tests for the bulk user import."""
+
+    def record(self, username, **fields):
+        return dict({"username": username, "password": "secret", "email": f"{username}@test.com",
+                     "first_name": "first", "last_name": "last"}, **fields)
+
+    def test_import_users(self):
+        """Test that users are created in batches with hashed, working passwords."""
+
+        batches = []
+        counts = import_users([self.record(f"imp{n}") for n in range(5)],
+                              batch_size=2, rounds=4, workers=1, progress=batches.append)
+
+        self.assertEqual(counts, {"read": 5, "inserted": 5, "existing": 0, "invalid": 0})
+        self.assertEqual([batch["read"] for batch in batches], [2, 4, 5])
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(rounds_of(User.query.get("imp3").password), 4)
+        self.assertTrue(hasher.check_password_hash(User.query.get("imp3").password, "secret"))
+
+    def test_import_skips_existing_and_invalid(self):
+        """Test that taken usernames, duplicates and bad records are skipped."""
+
+        import_users([self.record("imp0", first_name="original")], rounds=4, workers=1)
+
+        counts = import_users([
+            self.record("imp0"),
+            self.record("imp1"),
+            self.record("imp1", first_name="duplicate"),
+            self.record("imp2", email=""),
+            self.record("a_username_over_20_chars"),
+        ], rounds=4, workers=1)
+
+        self.assertEqual(counts, {"read": 5, "inserted": 1, "existing": 2, "invalid": 2})
+        self.assertEqual(User.query.get("imp0").first_name, "original")
+        self.assertEqual(User.query.get("imp1").first_name, "first")
+
+    def test_import_skips_malformed_lines(self):
+        """Test that NDJSON lines that aren't JSON objects are counted as invalid, not fatal."""
+
+        lines = [json.dumps(self.record("imp0")) + "\n", '{"username": "imp1", \n', "[1, 2]\n", "42\n",
+                 json.dumps(self.record("imp2")) + "\n"]
+
+        counts = import_users(read_records(lines, "ndjson"), rounds=4, workers=1)
+
+        self.assertEqual(counts, {"read": 5, "inserted": 2, "existing": 0, "invalid": 3})
+        self.assertEqual(User.query.count(), 2)
+
+    def test_read_records(self):
+        """Test reading CSV with a header and NDJSON, ignoring blank lines."""
+
+        csv_lines = ["username,password,email,first_name,last_name\n", "a,b,c,d,e\n"]
+        ndjson_lines = ['{"username": "a"}\n', "\n", '{"username": "b"}\n']
+
+        self.assertEqual(list(read_records(csv_lines, "csv")), [
+            {"username": "a", "password": "b", "email": "c", "first_name": "d", "last_name": "e"}])
+        self.assertEqual([record["username"] for record in read_records(ndjson_lines, "ndjson")],
+                         ["a", "b"])
+
+
+class ExportTestCase(DbTestCase):
+    """Tests for the streaming export."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.add_users("test_u1", "test_u2")
+        db.session.execute(Feedback.__table__.insert(), [
+            {"title": f"title {n}", "content": f"content, {n}", "username": "test_u1" if n % 3 else "test_u2"}
+            for n in range(30)])
+        db.session.commit()
+
+    def tearDown(self):
+        exporter.CHUNK_SIZE = 64 * 1024
+
+    def test_export_ndjson_in_chunks(self):
+        """Test that every row comes out, in several chunks when they outgrow CHUNK_SIZE."""
+
+        exporter.CHUNK_SIZE = 200
+        chunks = list(exporter.export("feedback", batch_size=7))
+        rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(rows[0]["title"], "title 0")
+        self.assertEqual(sorted(rows[0]), ["content", "id", "title", "username"])
+
+    def test_export_users_leaves_out_passwords(self):
+        """Test that the users export has no password column."""
+
+        rows = [json.loads(line) for line in b"".join(exporter.export("users")).decode().splitlines()]
+
+        self.assertEqual([row["username"] for row in rows], ["test_u1", "test_u2"])
+        self.assertNotIn("password", rows[0])
+
+    def test_export_csv_gzip_for_one_user(self):
+        """Test gzipped CSV of one user's feedback."""
+
+        data = gzip.decompress(b"".join(exporter.export("feedback", "csv", username="test_u2", compress=True)))
+        rows = list(csv.reader(data.decode().splitlines()))
+
+        self.assertEqual(rows[0], ["id", "title", "content", "username"])
+        self.assertEqual(len(rows), 11)
+        self.assertEqual({row[3] for row in rows[1:]}, {"test_u2"})
+        self.assertEqual(rows[1][2], "content, 0")
+
+    def test_export_view(self):
+        """Test that a user can download their own feedback."""
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session["user_id"] = "test_u1"
+
+            resp = client.get("/users/test_u1/export?format=csv&gzip=1")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.mimetype, "application/gzip")
+            self.assertIn("test_u1-feedback.csv.gz", resp.headers["Content-Disposition"])
+            self.assertEqual(len(gzip.decompress(resp.data).decode().splitlines()), 21)
+
+    def test_export_view_other_user(self):
+        """Test that exporting someone else's feedback redirects to your own, or home."""
+
+        with app.test_client() as client:
+            self.assertEqual(client.get("/users/test_u1/export").location, "/")
+
+            with client.session_transaction() as change_session:
+                change_session["user_id"] = "test_u2"
+
+            resp = client.get("/users/test_u1/export")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, "/users/test_u2/export")
+
+
+class SearchTestCase(DbTestCase):
+    """Tests for full-text search of feedback."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.add_users("test_u1", "test_u2")
+        db.session.add_all([
+            Feedback(title="Login is slow", content="It takes ages", username="test_u1"),
+            Feedback(title="Dark mode", content="Please add it, the login page hurts at night", username="test_u1"),
+            Feedback(title="Slow logins", content="Same for me", username="test_u2"),
+            Feedback(title="Colours", content="Too bright", username="test_u1"),
+        ])
+        db.session.commit()
+
+        app.config["SUPPORT_USERS"] = []
+
+    def test_search_ranks_title_matches_first(self):
+        """Test that matches are stemmed, scoped to the user and ranked by title weight."""
+
+        results = Feedback.search("login", username="test_u1")
+
+        self.assertEqual([fb.title for fb in results.items], ["Login is slow", "Dark mode"])
+        self.assertIsNone(results.next_page)
+
+    def test_search_everyone(self):
+        """Test searching all users' feedback, web search syntax included."""
+
+        self.assertEqual({fb.username for fb in Feedback.search("slow").items}, {"test_u1", "test_u2"})
+        self.assertEqual([fb.title for fb in Feedback.search('slow -"it takes"').items], ["Slow logins"])
+        self.assertEqual(Feedback.search("   ").items, [])
+
+    def test_search_pages(self):
+        """Test paging through results."""
+
+        first = Feedback.search("login", limit=2)
+        second = Feedback.search("login", page=2, limit=2)
+
+        self.assertEqual((first.prev_page, first.next_page), (None, 2))
+        self.assertEqual((second.prev_page, second.next_page), (1, None))
+        self.assertEqual(len(first.items + second.items), 3)
+        self.assertFalse({fb.id for fb in first.items} & {fb.id for fb in second.items})
+
+    def test_search_caps_on_the_best_matches(self):
+        """Test that max_matches keeps the best matches, even when they were found last."""
+
+        db.session.add_all([Feedback(title=f"Idea {n}", content="one passing mention of login", username="test_u2")
+                            for n in range(5)])
+        db.session.add(Feedback(title="Login login login", content="login fails", username="test_u2"))
+        db.session.commit()
+
+        results = Feedback.search("login", limit=3, max_matches=3)
+
+        self.assertEqual(results.items[0].title, "Login login login")
+        self.assertIsNone(results.next_page)
+
+    def test_search_sees_updates(self):
+        """Test that edited feedback is found by its new text."""
+
+        feedback = Feedback.query.filter_by(title="Colours").one()
+        feedback.content = "Contrast is too low"
+        db.session.commit()
+
+        self.assertEqual([fb.title for fb in Feedback.search("contrast").items], ["Colours"])
+        self.assertEqual(Feedback.search("bright").items, [])
+
+    def test_search_view(self):
+        """Test that a user searches only their own feedback."""
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session["user_id"] = "test_u1"
+
+            html = client.get("/users/test_u1/feedback/search?q=slow").get_data(as_text=True)
+
+            self.assertIn("Login is slow", html)
+            self.assertNotIn("Slow logins", html)
+
+            resp = client.get("/users/test_u2/feedback/search?q=slow")
+            self.assertEqual(resp.location, "/users/test_u1/feedback/search")
+
+    def test_search_all_view(self):
+        """Test that only support users can search everyone's feedback."""
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session["user_id"] = "test_u1"
+
+            self.assertEqual(client.get("/feedback/search?q=slow").status_code, 302)
+
+            app.config["SUPPORT_USERS"] = ["test_u1"]
+            html = client.get("/feedback/search?q=slow").get_data(as_text=True)
+
+            self.assertIn("Login is slow", html)
+            self.assertIn("Slow logins", html)
+            self.assertIn("by test_u2", html)
+
+
+class ApiTestCase(DbTestCase):
+    """Tests for the JSON feedback API."""
+
+    def setUp(self):
+        super().setUp()
+
+        user_page_cache.clear()
+
+        self.add_users("test_u1", "test_u2")
+        items = [Feedback(title=f"title {n}", content=f"content {n}", username="test_u1") for n in range(3)]
+        other = Feedback(title="other", content="other", username="test_u2")
+        db.session.add_all(items + [other])
+        db.session.commit()
+
+        self.ids = [feedback.id for feedback in items]
+        self.other_id = other.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as change_session:
+            change_session["user_id"] = "test_u1"
+
+    def test_list_with_etag(self):
+        """Test that a list comes with an ETag and an unchanged list answers 304."""
+
+        resp = self.client.get("/api/users/test_u1/feedback?limit=2")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([item["id"] for item in resp.json["items"]], self.ids[:2])
+        self.assertEqual(resp.json["next_after"], self.ids[1])
+        self.assertEqual(resp.json["items"][0]["version"], 1)
+
+        with capture_queries() as statements:
+            again = self.client.get("/api/users/test_u1/feedback?limit=2",
+                                    headers={"If-None-Match": resp.headers["ETag"]})
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b"")
+        # just the ids and versions; no feedback text is loaded
+        self.assertEqual(len([sql for sql in statements if sql.startswith("SELECT")]), 1)
+
+    def test_etag_changes_on_update(self):
+        """Test that editing an item in the page, even through the HTML form, changes the ETag."""
+
+        etag = self.client.get("/api/users/test_u1/feedback").headers["ETag"]
+
+        self.client.post(f"/feedback/{self.ids[0]}/update", data={"title": "new", "content": "new"})
+        resp = self.client.get("/api/users/test_u1/feedback", headers={"If-None-Match": etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["items"][0]["version"], 2)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_ownership(self):
+        """Test the same ownership rules as the HTML views, as status codes."""
+
+        self.assertEqual(self.client.get("/api/users/test_u2/feedback").status_code, 403)
+        self.assertEqual(self.client.get(f"/api/feedback/{self.other_id}").status_code, 403)
+        self.assertEqual(self.client.delete(f"/api/feedback/{self.other_id}").status_code, 403)
+        self.assertEqual(self.client.get("/api/feedback/0").status_code, 404)
+        self.assertEqual(app.test_client().get("/api/users/test_u1/feedback").status_code, 401)
+
+    def test_create_batch(self):
+        """Test creating several items in one request."""
+
+        user_page_cache.set("test_u1", (None, None, 20), "cached")
+
+        resp = self.client.post("/api/users/test_u1/feedback", json=[
+            {"title": "a", "content": "first"}, {"title": "b", "content": "second"}])
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual([item["title"] for item in resp.json["items"]], ["a", "b"])
+        self.assertEqual(Feedback.query.filter_by(username="test_u1").count(), 5)
+        self.assertIsNone(user_page_cache.get("test_u1", (None, None, 20)))
+
+        single = self.client.post("/api/users/test_u1/feedback", json={"title": "c", "content": "third"})
+        self.assertEqual(single.status_code, 201)
+        self.assertEqual(single.json["version"], 1)
+
+    def test_create_for_deleted_user(self):
+        """Test that a session left over from a deleted user gets a JSON 404, not an error."""
+
+        with self.client.session_transaction() as change_session:
+            change_session["user_id"] = "gone_user"
+
+        resp = self.client.post("/api/users/gone_user/feedback", json={"title": "t", "content": "c"})
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("gone_user", resp.json["error"])
+        self.assertEqual(Feedback.query.filter_by(username="gone_user").count(), 0)
+
+    def test_create_invalid(self):
+        """Test that the form's validation applies and nothing is created on errors."""
+
+        resp = self.client.post("/api/users/test_u1/feedback", json=[
+            {"title": "ok", "content": "fine"}, {"title": "x" * 101, "content": 5}])
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("title", resp.json["fields"])
+        self.assertIn("content", resp.json["fields"])
+        self.assertEqual(Feedback.query.filter_by(username="test_u1").count(), 3)
+
+        form_post = self.client.post("/api/users/test_u1/feedback", data={"title": "a", "content": "b"})
+        self.assertEqual(form_post.status_code, 415)
+
+    def test_update_with_if_match(self):
+        """Test that PATCH applies partial changes and refuses a stale If-Match."""
+
+        etag = self.client.get(f"/api/feedback/{self.ids[0]}").headers["ETag"]
+
+        resp = self.client.patch(f"/api/feedback/{self.ids[0]}", json={"title": "changed"},
+                                 headers={"If-Match": etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual((resp.json["title"], resp.json["content"]), ("changed", "content 0"))
+        self.assertEqual(resp.json["version"], 2)
+
+        stale = self.client.patch(f"/api/feedback/{self.ids[0]}", json={"title": "again"},
+                                  headers={"If-Match": etag})
+        self.assertEqual(stale.status_code, 412)
+        self.assertEqual(Feedback.query.get(self.ids[0]).title, "changed")
+
+    def test_delete(self):
+        """Test deleting one item."""
+
+        resp = self.client.delete(f"/api/feedback/{self.ids[0]}")
+
+        self.assertEqual(resp.status_code, 204)
+        self.assertIsNone(Feedback.query.get(self.ids[0]))
+
+    def test_delete_batch(self):
+        """Test deleting several items, and that another user's item stops the whole batch."""
+
+        refused = self.client.post("/api/feedback/delete", json={"ids": [self.ids[0], self.other_id]})
+
+        self.assertEqual(refused.status_code, 403)
+        self.assertEqual(Feedback.query.count(), 4)
+
+        resp = self.client.post("/api/feedback/delete", json={"ids": self.ids[:2] + [0]})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, {"deleted": self.ids[:2], "not_found": [0]})
+        self.assertEqual([feedback.id for feedback in Feedback.query.filter_by(username="test_u1")],
+                         self.ids[2:])
+
+
+class ServerSessionViewsTestCase(TestCase):
+    """Tests for the app on server-side sessions kept in the sessions table."""
+
+    def setUp(self):
+        user_page_cache.clear()
+
+        StoredSession.query.delete()
+        Feedback.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        db.session.add(User(username="test_u1", password="not-a-hash", email="test_u1@test.com",
+                            first_name="first", last_name="last"))
+        db.session.commit()
+
+        self.cookie_sessions, self.store = app.session_interface, server_sessions.store
+        server_sessions.store = SqlSessionStore()
+        app.session_interface = server_sessions
+
+    def tearDown(self):
+        server_sessions.clear_cache()
+        app.session_interface, server_sessions.store = self.cookie_sessions, self.store
+
+        # the store commits on its own connections, so this can't run in a DbTestCase
+        StoredSession.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_login_issues_a_new_session_id(self):
+        """Test that logging in replaces the session id the browser had before (no fixation)."""
+
+        User.register(username="test_u2", password="test_secret", email="test_u2@test.com",
+                      first_name="first", last_name="last")
+        db.session.commit()
+        login_throttle.reset()
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session["csrf_token"] = "planted"
+            before = next(cookie.value for cookie in client.cookie_jar if cookie.name == "session")
+
+            resp = client.post("/login", data={"username": "test_u2", "password": "test_secret"})
+            after = next(cookie.value for cookie in client.cookie_jar if cookie.name == "session")
+
+            self.assertEqual(resp.location, "/users/test_u2")
+            self.assertNotEqual(after, before)
+            self.assertIsNone(db.session.get(StoredSession, before))
+
+    def test_delete_user_revokes_other_sessions(self):
+        """Test that deleting a user ends their sessions on other devices."""
+
+        phone, laptop = app.test_client(), app.test_client()
+        for client in (phone, laptop):
+            with client.session_transaction() as change_session:
+                change_session["user_id"] = "test_u1"
+
+        self.assertEqual(StoredSession.query.filter_by(username="test_u1").count(), 2)
+        self.assertEqual(laptop.get("/").location, "/users/test_u1")
+
+        phone.post("/users/test_u1/delete")
+
+        self.assertEqual(StoredSession.query.count(), 0)
+        self.assertEqual(laptop.get("/").location, "/register")
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Tests for sending reads to a replica, with a second local database standing in for one."""
+
+    REPLICA_DB = f"{TEST_DB}_replica"
+
+    def setUp(self):
+        user_page_cache.clear()
+
+        app.config["SQLALCHEMY_BINDS"] = {"replica": f"postgresql:///{self.REPLICA_DB}"}
+        self.replica = db.get_engine(app, bind="replica")
+        try:
+            create_database(self.REPLICA_DB)
+            db.Model.metadata.create_all(self.replica, tables=[User.__table__, Feedback.__table__])
+        except DBAPIError:
+            app.config["SQLALCHEMY_BINDS"] = None
+            self.skipTest(f"needs a {self.REPLICA_DB} database")
+
+        Feedback.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        # the same user on both, with different feedback, to tell which one answered
+        user = {"username": "test_u1", "password": hasher.generate_password_hash("secret"),
+                "email": "test_u1@test.com", "first_name": "first", "last_name": "last"}
+        with self.replica.begin() as conn:
+            conn.execute(Feedback.__table__.delete())
+            conn.execute(User.__table__.delete())
+            conn.execute(insert(User.__table__), user)
+            conn.execute(insert(Feedback.__table__), {"title": "on the replica", "content": "r",
+                                                     "username": "test_u1"})
+        db.session.add(User(**user))
+        db.session.add(Feedback(title="on the primary", content="p", username="test_u1"))
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as change_session:
+            change_session["user_id"] = "test_u1"
+
+    def tearDown(self):
+        db.session.remove()
+        app.config["SQLALCHEMY_BINDS"] = None
+
+        # the replica engine reads other connections' commits, so this can't run in a DbTestCase
+        Feedback.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_get_reads_from_replica(self):
+        """Test that a GET view reads from the replica."""
+
+        html = self.client.get("/users/test_u1").get_data(as_text=True)
+
+        self.assertIn("on the replica", html)
+        self.assertNotIn("on the primary", html)
+
+    def test_read_your_writes_after_post(self):
+        """Test that a feedback POST writes to the primary and pins the client to it."""
+
+        self.client.post("/users/test_u1/feedback/add", data={"title": "new one", "content": "n"})
+
+        with self.replica.connect() as conn:
+            self.assertEqual(conn.execute(select(Feedback.title)).scalars().all(), ["on the replica"])
+        html = self.client.get("/users/test_u1").get_data(as_text=True)
+        self.assertIn("new one", html)
+        self.assertIn("on the primary", html)
+
+        # once the sticky period is over, reads go back to the replica
+        with self.client.session_transaction() as change_session:
+            change_session[STICKY_KEY] = 0
+        user_page_cache.clear()
+        self.assertIn("on the replica", self.client.get("/users/test_u1").get_data(as_text=True))
+
+    def test_login_reads_from_replica(self):
+        """Test that login, a POST marked @replica_reads, looks the user up on the replica."""
+
+        with self.replica.begin() as conn:
+            conn.execute(insert(User.__table__), {
+                "username": "replica_only", "password": hasher.generate_password_hash("secret"),
+                "email": "r@test.com", "first_name": "r", "last_name": "r"})
+
+        resp = app.test_client().post("/login", data={"username": "replica_only", "password": "secret"})
+
+        self.assertEqual(resp.location, "/users/replica_only")
+
+    def test_bind_selection(self):
+        """Test that reads go to the replica until the session writes, and writes never do."""
+
+        with app.test_request_context("/"):
+            g._db_use_replica = True
+            session = db.session()
+            users = User.__table__
+
+            self.assertIs(session.get_bind(clause=select(users)), self.replica)
+            self.assertIs(session.get_bind(clause=insert(users)), db.engine)
+            self.assertIs(session.get_bind(clause=select(users)), db.engine)
+            self.assertTrue(g._db_wrote)
+
+        with app.test_request_context("/", method="POST"):
+            app.preprocess_request()
+            self.assertIs(db.session().get_bind(clause=select(User.__table__)), db.engine)
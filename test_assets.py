@@ -0,0 +1,203 @@
+import gzip
+import io
+import json
+import os
+import struct
+import tempfile
+import zlib
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask, render_template_string
+
+import assets
+
+
+def make_png(width, height, pixels, extra=()):
+    """Return an 8-bit RGB PNG of pixels (rows of bytes), stored uncompressed and unfiltered."""
+
+    raw = b"".join(b"\0" + row for row in pixels)
+    chunks = [(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)), *extra,
+              (b"IDAT", zlib.compress(raw, 0)), (b"IEND", b"")]
+    return assets.PNG_SIGNATURE + b"".join(assets._png_chunk(kind, body) for kind, body in chunks)
+
+
+def png_pixels(data):
+    chunks = list(assets._png_chunks(data))
+    width = struct.unpack(">I", chunks[0][1][:4])[0]
+    raw = zlib.decompress(b"".join(body for kind, body in chunks if kind == b"IDAT"))
+    return [bytes(row) for row in assets._unfilter(raw, width * 3, 3)]
+
+
+class StaticFolderTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.static = directory.name
+
+        self.write("css/style.css", b".logo { background: url('../images/logo.png?v=2'); }\n" * 50)
+        self.write("images/logo.png", make_png(2, 2, [b"\xff\0\0" * 2, b"\0\0\xff" * 2]))
+
+        self.app = Flask(__name__, static_folder=self.static, static_url_path="/static")
+        assets.Assets(self.app)
+
+    def write(self, name, content):
+        path = os.path.join(self.static, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(os.path.join(self.static, name), "rb") as f:
+            return f.read()
+
+
+class BuildTestCase(StaticFolderTestCase):
+    """Tests for `flask build-assets`."""
+
+    def test_build(self):
+        """Test that files are copied under hashed names, with CSS pointing at them."""
+
+        for name in assets.VENDOR:
+            self.write(name, b"/* vendored */")
+
+        result = self.app.test_cli_runner().invoke(args=["build-assets"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        manifest = json.loads(self.read("dist/manifest.json"))
+        self.assertEqual(set(manifest), {"css/style.css", "images/logo.png", *assets.VENDOR})
+        self.assertRegex(manifest["css/style.css"], r"^css/style\.[0-9a-f]{12}\.css$")
+        self.assertRegex(manifest["images/logo.png"], r"^images/logo\.[0-9a-f]{12}\.png$")
+
+        css = self.read(f"dist/{manifest['css/style.css']}")
+        self.assertIn(f"url(../{manifest['images/logo.png']}?v=2)".encode(), css)
+        self.assertEqual(gzip.decompress(self.read(f"dist/{manifest['css/style.css']}.gz")), css)
+        self.assertFalse(os.path.exists(os.path.join(self.static, "dist", manifest["images/logo.png"] + ".gz")))
+
+    def test_build_needs_vendored_files(self):
+        """Test that the build stops, naming what is missing, until vendor-assets has run."""
+
+        name = "vendor/jquery/jquery.slim.min.js"
+        for other in assets.VENDOR:
+            if other != name:
+                self.write(other, b"/* vendored */")
+
+        result = self.app.test_cli_runner().invoke(args=["build-assets"])
+
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn(name, result.output)
+        self.assertIn("flask vendor-assets", result.output)
+        self.assertFalse(os.path.exists(os.path.join(self.static, "dist")))
+
+    def test_hash_follows_content(self):
+        """Test that changing a file changes its name, and the names of CSS that refers to it."""
+
+        before = assets.build(self.static)
+        self.write("images/logo.png", make_png(1, 1, [b"\0\0\0"]))
+        after = assets.build(self.static)
+
+        self.assertNotEqual(before["images/logo.png"], after["images/logo.png"])
+        self.assertNotEqual(before["css/style.css"], after["css/style.css"])
+        self.assertFalse(os.path.exists(os.path.join(self.static, "dist", before["images/logo.png"])))
+
+
+class AssetUrlTestCase(StaticFolderTestCase):
+    """Tests for asset_url() and serving built files."""
+
+    def render(self, name):
+        with self.app.test_request_context():
+            return render_template_string("{{ asset_url(name) }}", name=name)
+
+    def test_falls_back_before_a_build(self):
+        """Test that unbuilt assets link the plain static file, or the CDN for vendored files."""
+
+        name = "vendor/jquery/jquery.slim.min.js"
+
+        self.assertEqual(self.render("css/style.css"), "/static/css/style.css")
+        self.assertEqual(self.render(name), assets.VENDOR[name])
+
+        self.app.config["ASSETS_CDN_FALLBACK"] = False
+        self.assertEqual(self.render(name), f"/static/{name}")
+
+    def test_built_assets_served_immutable(self):
+        """Test that built assets link hashed URLs, served with a long immutable Cache-Control."""
+
+        manifest = assets.build(self.static)
+
+        url = self.render("css/style.css")
+        self.assertEqual(url, f"/static/dist/{manifest['css/style.css']}")
+
+        client = self.app.test_client()
+        plain = client.get(url)
+        self.assertEqual(plain.status_code, 200)
+        self.assertIsNone(plain.content_encoding)
+        self.assertEqual(plain.mimetype, "text/css")
+        self.assertTrue(plain.cache_control.immutable)
+        self.assertEqual(plain.cache_control.max_age, 365 * 24 * 60 * 60)
+        self.assertIn("Accept-Encoding", plain.vary)
+
+        compressed = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(compressed.content_encoding, "gzip")
+        self.assertEqual(compressed.mimetype, "text/css")
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertTrue(compressed.cache_control.immutable)
+        plain.close()
+        compressed.close()
+
+        self.assertEqual(client.get("/static/dist/css/missing.css").status_code, 404)
+
+
+class OptimizePngTestCase(TestCase):
+    """Tests for the lossless PNG optimizer."""
+
+    def test_smaller_with_the_same_pixels(self):
+        """Test that metadata goes and the image data is recompressed, leaving the pixels as they were."""
+
+        pixels = [bytes((x * y) & 0xFF for x in range(48)) for y in range(16)]
+        original = make_png(16, 16, pixels, extra=[(b"tEXt", b"Comment\0made by hand"),
+                                                   (b"gAMA", struct.pack(">I", 45455))])
+
+        optimized = assets.optimize_png(original)
+
+        self.assertLess(len(optimized), len(original))
+        self.assertEqual(png_pixels(optimized), pixels)
+        kinds = [kind for kind, _ in assets._png_chunks(optimized)]
+        self.assertEqual(kinds, [b"IHDR", b"gAMA", b"IDAT", b"IEND"])
+
+    def test_leaves_other_files(self):
+        """Test that anything that isn't a PNG, or is animated, is returned as it was."""
+
+        animated = make_png(1, 1, [b"\0\0\0"], extra=[(b"acTL", struct.pack(">II", 1, 0))])
+
+        self.assertEqual(assets.optimize_png(b"GIF89a"), b"GIF89a")
+        self.assertEqual(assets.optimize_png(animated), animated)
+
+
+class VendorTestCase(TestCase):
+    """Tests for `flask vendor-assets`."""
+
+    def test_vendor_fetches_css_references(self):
+        """Test that vendored CSS brings the fonts it refers to, and existing files are kept."""
+
+        files = {url: b"/* js */" for url in assets.VENDOR.values()}
+        css_url = assets.VENDOR["vendor/font-awesome/css/all.min.css"]
+        files[css_url] = b"@font-face{src:url(../webfonts/fa.woff2?v=5) format('woff2')}"
+        font_url = css_url.rsplit("/css/", 1)[0] + "/webfonts/fa.woff2"
+        files[font_url] = b"font"
+        opened = []
+
+        def urlopen(url, timeout):
+            opened.append(url)
+            return io.BytesIO(files[url])
+
+        with tempfile.TemporaryDirectory() as static, patch("urllib.request.urlopen", urlopen):
+            fetched = assets.vendor(static)
+
+            self.assertIn("vendor/font-awesome/webfonts/fa.woff2", fetched)
+            self.assertEqual(len(fetched), len(assets.VENDOR) + 1)
+            with open(os.path.join(static, "vendor/font-awesome/webfonts/fa.woff2"), "rb") as f:
+                self.assertEqual(f.read(), b"font")
+
+            self.assertEqual(assets.vendor(static), [])
+            self.assertEqual(len(opened), len(assets.VENDOR) + 1)
@@ -0,0 +1,69 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from cache import FragmentCache
+
+
+class FragmentCacheTestCase(TestCase):
+    """Tests for the rendered fragment cache."""
+
+    def test_get_set_counts(self):
+        """Test that hits and misses are counted."""
+
+        cache = FragmentCache()
+
+        self.assertIsNone(cache.get("alice", 1))
+        cache.set("alice", 1, "<p>page 1</p>")
+        self.assertEqual(cache.get("alice", 1), "<p>page 1</p>")
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_invalidate_drops_every_variant(self):
+        """Test that invalidating an owner drops all of their fragments only."""
+
+        cache = FragmentCache()
+        cache.set("alice", 1, "a1")
+        cache.set("alice", 2, "a2")
+        cache.set("bob", 1, "b1")
+
+        cache.invalidate("alice")
+
+        self.assertIsNone(cache.get("alice", 1))
+        self.assertIsNone(cache.get("alice", 2))
+        self.assertEqual(cache.get("bob", 1), "b1")
+
+    def test_ttl(self):
+        """Test that fragments expire after the TTL."""
+
+        cache = FragmentCache(ttl=10)
+
+        with patch("cache.time.monotonic", return_value=100):
+            cache.set("alice", 1, "a1")
+        with patch("cache.time.monotonic", return_value=105):
+            self.assertEqual(cache.get("alice", 1), "a1")
+        with patch("cache.time.monotonic", return_value=111):
+            self.assertIsNone(cache.get("alice", 1))
+
+    def test_lru_eviction(self):
+        """Test that the least recently used owner is evicted past maxsize."""
+
+        cache = FragmentCache(maxsize=2)
+        cache.set("alice", 1, "a1")
+        cache.set("bob", 1, "b1")
+        cache.get("alice", 1)
+        cache.set("carol", 1, "c1")
+
+        self.assertEqual(cache.get("alice", 1), "a1")
+        self.assertIsNone(cache.get("bob", 1))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_disabled(self):
+        """Test that a disabled cache stores nothing."""
+
+        cache = FragmentCache()
+        cache.enabled = False
+        cache.set("alice", 1, "a1")
+
+        self.assertIsNone(cache.get("alice", 1))
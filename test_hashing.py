@@ -0,0 +1,104 @@
+import threading
+from unittest import TestCase
+
+import bcrypt
+
+from hashing import HashingExecutor, HashingQueueFull, calibrate_rounds, hash_many, rounds_of
+
+
+class HashingExecutorTestCase(TestCase):
+    """Tests for the bcrypt worker pool."""
+
+    def setUp(self):
+        """Make a small, fast pool."""
+
+        self.hasher = HashingExecutor()
+        self.hasher.rounds = 4
+        self.hasher.workers = 1
+        self.hasher.queue_size = 0
+        self.hasher.queue_timeout = 0.05
+
+    def tearDown(self):
+        """Stop the pool's worker threads."""
+
+        self.hasher.shutdown()
+
+    def test_hash_and_check(self):
+        """Test that a generated hash verifies only the right password."""
+
+        pw_hash = self.hasher.generate_password_hash("secret")
+
+        self.assertTrue(pw_hash.startswith("$2b$04$"))
+        self.assertTrue(self.hasher.check_password_hash(pw_hash, "secret"))
+        self.assertFalse(self.hasher.check_password_hash(pw_hash, "wrong"))
+
+    def test_stats(self):
+        """Test that each call is counted and timed."""
+
+        pw_hash = self.hasher.generate_password_hash("secret")
+        self.hasher.check_password_hash(pw_hash, "secret")
+        self.hasher.check_password_hash(pw_hash, "wrong")
+
+        stats = self.hasher.stats()
+        self.assertEqual(stats["generate"]["calls"], 1)
+        self.assertEqual(stats["check"]["calls"], 2)
+        self.assertGreater(stats["check"]["avg_ms"], 0)
+
+    def test_queue_full(self):
+        """Test that jobs are rejected once every slot is taken."""
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        worker = threading.Thread(target=self.hasher.submit, args=("block", block))
+        worker.start()
+        started.wait()
+
+        try:
+            with self.assertRaises(HashingQueueFull):
+                self.hasher.generate_password_hash("secret")
+        finally:
+            release.set()
+            worker.join()
+
+        self.assertGreaterEqual(self.hasher.stats()["generate"]["rejected"], 1)
+
+
+class CalibrationTestCase(TestCase):
+    """Tests for picking the bcrypt cost from a latency budget."""
+
+    def test_calibrate_rounds_bounds(self):
+        """Test that calibration stays within the configured range."""
+
+        self.assertEqual(calibrate_rounds(0, min_rounds=4, max_rounds=6, samples=1), 4)
+        self.assertEqual(calibrate_rounds(10000, min_rounds=4, max_rounds=6, samples=1), 6)
+
+    def test_needs_rehash(self):
+        """Test that only hashes below the current cost need upgrading."""
+
+        hasher = HashingExecutor()
+        hasher.rounds = 5
+
+        self.assertEqual(rounds_of("$2b$04$" + "x" * 53), 4)
+        self.assertTrue(hasher.needs_rehash("$2b$04$" + "x" * 53))
+        self.assertFalse(hasher.needs_rehash("$2b$05$" + "x" * 53))
+        self.assertFalse(hasher.needs_rehash("$2b$06$" + "x" * 53))
+
+
+class HashManyTestCase(TestCase):
+    """Tests for hashing batches of passwords in worker processes."""
+
+    def test_hash_many(self):
+        """Test that hashes come back in order and at the requested cost."""
+
+        passwords = [f"password{n}" for n in range(5)]
+        hashes = hash_many(passwords, 4, workers=2, chunksize=2)
+
+        self.assertEqual(len(hashes), 5)
+        for password, pw_hash in zip(passwords, hashes):
+            self.assertEqual(rounds_of(pw_hash), 4)
+            self.assertTrue(bcrypt.checkpw(password.encode("utf8"), pw_hash.encode("utf8")))
@@ -0,0 +1,83 @@
+import threading
+from unittest import TestCase
+
+from metrics import Registry
+
+
+class RegistryTestCase(TestCase):
+    """Tests for the metrics registry and its text format."""
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_across_threads(self):
+        """Test that increments from many threads all add up."""
+
+        counter = self.registry.counter("jobs_total", "Jobs.", ("kind",))
+
+        def work():
+            for _ in range(1000):
+                counter.labels("a").inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn('jobs_total{kind="a"} 8000', self.registry.render())
+
+    def test_histogram_buckets(self):
+        """Test that histogram buckets are cumulative with sum and count."""
+
+        histogram = self.registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+
+        text = self.registry.render()
+
+        self.assertIn("# TYPE latency_seconds histogram", text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("latency_seconds_sum 6.05", text)
+        self.assertIn("latency_seconds_count 4", text)
+
+    def test_gauge_and_function(self):
+        """Test gauges and function-backed metrics."""
+
+        gauge = self.registry.gauge("in_flight", "In flight.")
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.registry.function("answer", "Answer.", "gauge", lambda: {(): 42})
+
+        text = self.registry.render()
+
+        self.assertIn("in_flight 1", text)
+        self.assertIn("answer 42", text)
+
+    def test_label_escaping(self):
+        """Test that label values are escaped."""
+
+        self.registry.counter("odd_total", "Odd.", ("path",)).labels('a"b\\c').inc()
+
+        self.assertIn('odd_total{path="a\\"b\\\\c"} 1', self.registry.render())
+
+    def test_finished_threads_retired(self):
+        """Test that finished threads' values are folded into the total and their lists dropped."""
+
+        counter = self.registry.counter("jobs_total", "Jobs.")
+        counter.inc()
+
+        for _ in range(20):
+            threads = [threading.Thread(target=counter.inc, args=(2,)) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        shards = counter._shards(())
+        # only this thread's list is left
+        self.assertEqual(len(shards._live), 1)
+        self.assertIn("jobs_total 401", self.registry.render())
@@ -0,0 +1,207 @@
+from unittest import TestCase
+
+from flask import Flask, session, flash, get_flashed_messages
+
+from sessions import ServerSessionInterface, MemorySessionStore
+
+
+class CountingStore(MemorySessionStore):
+    """A memory store that counts calls, standing in for a shared backend."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = {"load": 0, "save": 0, "touch": 0}
+        self.touched = []
+
+    def load(self, sid):
+        self.calls["load"] += 1
+        return super().load(sid)
+
+    def save(self, sid, data, expires, username):
+        self.calls["save"] += 1
+        super().save(sid, data, expires, username)
+
+    def touch(self, expiries):
+        self.calls["touch"] += 1
+        self.touched.append(dict(expiries))
+        super().touch(expiries)
+
+
+def make_app(interface):
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test"
+    app.session_interface = interface
+
+    @app.route("/login/<username>")
+    def login(username):
+        session["user_id"] = username
+        flash("welcome", "success")
+        return "ok"
+
+    @app.route("/visit")
+    def visit():
+        # e.g. the CSRF token a login form keeps in the session
+        session["csrf_token"] = "token"
+        return "ok"
+
+    @app.route("/signout")
+    def signout():
+        # logs out but keeps the rest, as the app's logout keeps its flash
+        session.pop("user_id")
+        return "ok"
+
+    @app.route("/whoami")
+    def whoami():
+        return session.get("user_id", "nobody")
+
+    @app.route("/flashes")
+    def flashes():
+        return repr(get_flashed_messages(with_categories=True))
+
+    @app.route("/logout")
+    def logout():
+        session.clear()
+        return "ok"
+
+    return app
+
+
+class ServerSessionTestCase(TestCase):
+    """Tests for server-side sessions and their local cache."""
+
+    def setUp(self):
+        self.store = CountingStore()
+        self.sessions = ServerSessionInterface(store=self.store)
+        self.app = make_app(self.sessions)
+
+    def test_cookie_holds_only_the_id(self):
+        """Test that data stays on the server and the cookie is an opaque id."""
+
+        with self.app.test_client() as client:
+            resp = client.get("/login/tony")
+            cookie = resp.headers["Set-Cookie"]
+
+            self.assertNotIn("tony", cookie)
+            self.assertEqual(client.get("/whoami").data, b"tony")
+            self.assertEqual(self.store.calls["save"], 1)
+
+    def test_reads_are_served_from_the_cache(self):
+        """Test that unchanged sessions cost no store calls within local_ttl."""
+
+        with self.app.test_client() as client:
+            client.get("/login/tony")
+            for _ in range(20):
+                self.assertEqual(client.get("/whoami").data, b"tony")
+
+        self.assertEqual(self.store.calls, {"load": 0, "save": 1, "touch": 0})
+
+    def test_recheck_after_local_ttl(self):
+        """Test that a session deleted elsewhere ends once the local entry is stale."""
+
+        with self.app.test_client() as client:
+            client.get("/login/tony")
+
+            # another process revokes the session
+            self.store.delete_user("tony")
+            self.assertEqual(client.get("/whoami").data, b"tony")
+
+            self.sessions.local_ttl = 0
+            self.assertEqual(client.get("/whoami").data, b"nobody")
+
+    def test_revoke_user(self):
+        """Test that revoke_user ends every session of a user at once."""
+
+        clients = [self.app.test_client() for _ in range(3)]
+        for client, username in zip(clients, ("tony", "tony", "nessa")):
+            client.get(f"/login/{username}")
+
+        self.sessions.revoke_user("tony")
+
+        self.assertEqual([client.get("/whoami").data for client in clients],
+                         [b"nobody", b"nobody", b"nessa"])
+
+    def test_refreshes_are_batched(self):
+        """Test that expiry refreshes are written in batches of flush_size."""
+
+        clients = [self.app.test_client() for _ in range(3)]
+        for n, client in enumerate(clients):
+            client.get(f"/login/user{n}")
+
+        self.sessions.refresh_interval = 0
+        self.sessions.flush_size = 3
+        self.sessions.flush_interval = 3600
+
+        clients[0].get("/whoami")
+        clients[1].get("/whoami")
+        self.assertEqual(self.store.calls["touch"], 0)
+
+        clients[2].get("/whoami")
+        self.assertEqual(self.store.calls["touch"], 1)
+        self.assertEqual(len(self.store.touched[0]), 3)
+
+    def test_no_refresh_within_interval(self):
+        """Test that a session used again soon isn't refreshed at all."""
+
+        with self.app.test_client() as client:
+            client.get("/login/tony")
+            for _ in range(5):
+                client.get("/whoami")
+
+        self.sessions.flush(force=True)
+        self.assertEqual(self.store.calls["touch"], 0)
+
+    def test_logout_deletes(self):
+        """Test that an emptied session is removed from the store."""
+
+        with self.app.test_client() as client:
+            client.get("/login/tony")
+            client.get("/logout")
+
+            self.assertEqual(len(self.store._sessions), 0)
+            self.assertEqual(client.get("/whoami").data, b"nobody")
+
+    def session_id(self, client):
+        return next((cookie.value for cookie in client.cookie_jar if cookie.name == "session"), None)
+
+    def test_new_id_on_login_and_logout(self):
+        """Test that the session id changes with the user, and the old id stops working."""
+
+        with self.app.test_client() as client:
+            client.get("/visit")
+            anonymous = self.session_id(client)
+
+            client.get("/login/tony")
+            logged_in = self.session_id(client)
+
+            self.assertNotEqual(logged_in, anonymous)
+            self.assertNotIn(anonymous, self.store._sessions)
+            self.assertEqual(client.get("/whoami").data, b"tony")
+
+            # the data outlives logging out (the flash), but not the id
+            client.get("/signout")
+            self.assertNotIn(self.session_id(client), (anonymous, logged_in))
+            self.assertEqual(client.get("/whoami").data, b"nobody")
+            self.assertEqual(len(self.store._sessions), 1)
+
+        # someone who planted the anonymous id gets nothing
+        with self.app.test_client() as attacker:
+            attacker.set_cookie("localhost", "session", anonymous)
+            self.assertEqual(attacker.get("/whoami").data, b"nobody")
+
+    def test_flashes_round_trip(self):
+        """Test that flashed (category, message) tuples survive serialization."""
+
+        with self.app.test_client() as client:
+            client.get("/login/tony")
+            self.sessions.clear_cache()
+
+            self.assertEqual(client.get("/flashes").data, b"[('success', 'welcome')]")
+
+    def test_anonymous_visits_store_nothing(self):
+        """Test that requests without session data create no sessions."""
+
+        with self.app.test_client() as client:
+            resp = client.get("/whoami")
+
+        self.assertNotIn("Set-Cookie", resp.headers)
+        self.assertEqual(self.store.calls["save"], 0)
@@ -0,0 +1,98 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+from jinja2 import DictLoader, Environment
+
+from cache import FragmentCache
+import templating
+
+
+class FragmentCacheExtensionTestCase(TestCase):
+    """Tests for the {% cache %} template tag."""
+
+    def setUp(self):
+        self.renders = 0
+        self.env = Environment(loader=DictLoader({
+            "page.html": '{% cache "nav", user %}<nav>{{ count() }} {{ user }}</nav>{% endcache %}{{ body }}',
+        }), extensions=[templating.FragmentCacheExtension], autoescape=True)
+        self.env.globals["count"] = self.count
+        self.env.fragment_cache = FragmentCache()
+
+    def count(self):
+        self.renders += 1
+        return self.renders
+
+    def render(self, **context):
+        return self.env.get_template("page.html").render(**context)
+
+    def test_body_rendered_once_per_owner(self):
+        """Test that the tag's body is rendered once per owner while the rest still renders."""
+
+        self.assertEqual(self.render(user="alice", body="a"), "<nav>1 alice</nav>a")
+        self.assertEqual(self.render(user="alice", body="b"), "<nav>1 alice</nav>b")
+        self.assertEqual(self.render(user=None, body="c"), "<nav>2 None</nav>c")
+        self.assertEqual(self.renders, 2)
+
+    def test_fragments_stay_escaped(self):
+        """Test that a cached fragment is still escaped, and not escaped twice."""
+
+        self.render(user="<b>", body="")
+
+        self.assertEqual(self.render(user="<b>", body="<i>"), "<nav>1 &lt;b&gt;</nav>&lt;i&gt;")
+
+    def test_without_a_cache(self):
+        """Test that the tag renders every time when no cache is set."""
+
+        self.env.fragment_cache = None
+        self.render(user="alice", body="")
+        self.render(user="alice", body="")
+
+        self.assertEqual(self.renders, 2)
+
+
+class WarmTemplatesTestCase(TestCase):
+    """Tests for the template bytecode cache and `flask warm-templates`."""
+
+    def test_warm_templates(self):
+        """Test that warming writes one bytecode file per template, which a new app then loads."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            app = Flask(__name__)
+            app.config["TEMPLATE_BYTECODE_DIR"] = directory
+            templating.init_app(app)
+
+            result = app.test_cli_runner().invoke(args=["warm-templates"])
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            names = app.jinja_env.list_templates()
+            self.assertEqual(len(os.listdir(directory)), len(names))
+
+            # a fresh process finds them instead of compiling again
+            restarted = Flask(__name__)
+            restarted.config["TEMPLATE_BYTECODE_DIR"] = directory
+            templating.init_app(restarted)
+            loads = []
+            load_bytecode = restarted.jinja_env.bytecode_cache.load_bytecode
+
+            def counting_load(bucket):
+                load_bytecode(bucket)
+                loads.append(bucket.code is not None)
+
+            restarted.jinja_env.bytecode_cache.load_bytecode = counting_load
+            restarted.jinja_env.get_template("login.html")
+
+            self.assertTrue(loads)
+            self.assertTrue(all(loads))
+
+    def test_warm_templates_needs_a_directory(self):
+        """Test that warming without TEMPLATE_BYTECODE_DIR fails."""
+
+        app = Flask(__name__)
+        templating.init_app(app)
+
+        result = app.test_cli_runner().invoke(args=["warm-templates"])
+
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("TEMPLATE_BYTECODE_DIR", result.output)
@@ -0,0 +1,135 @@
+from unittest import TestCase, skipIf
+
+from throttle import LoginThrottle, MemoryBucketStore, RedisBucketStore, Throttled
+
+try:
+    # fakeredis runs EVAL scripts with lupa's Lua interpreter
+    import fakeredis
+    import lupa
+except ImportError:
+    fakeredis = None
+
+
+class MemoryBucketStoreTestCase(TestCase):
+    """Tests for the in-process token buckets."""
+
+    def test_burst_then_refill(self):
+        """Test that a bucket allows burst takes, then refills over time."""
+
+        store = MemoryBucketStore()
+
+        for _ in range(3):
+            self.assertTrue(store.take("k", 1.0, 3, now=100.0)[0])
+
+        allowed, wait = store.take("k", 1.0, 3, now=100.0)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 1.0)
+
+        self.assertTrue(store.take("k", 1.0, 3, now=101.0)[0])
+
+    def test_lru_eviction_bounds_size(self):
+        """Test that the store never holds more than max_keys buckets."""
+
+        store = MemoryBucketStore(max_keys=10)
+
+        for i in range(1000):
+            store.take(f"user:{i}", 1.0, 1, now=0.0)
+
+        self.assertEqual(len(store), 10)
+        # the most recent key survived, the oldest did not
+        self.assertFalse(store.take("user:999", 1.0, 1, now=0.0)[0])
+        self.assertTrue(store.take("user:0", 1.0, 1, now=0.0)[0])
+
+
+@skipIf(fakeredis is None, "needs fakeredis[lua]")
+class RedisBucketStoreTestCase(TestCase):
+    """Tests for the Lua token-bucket script, run against fakeredis."""
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis()
+        self.store = RedisBucketStore(self.client)
+
+    def test_burst_then_refill(self):
+        """Test that a bucket allows burst takes, denies the next with the wait, then refills."""
+
+        for _ in range(3):
+            self.assertEqual(self.store.take("k", 1.0, 3, now=100.0), (True, 0.0))
+
+        allowed, wait = self.store.take("k", 1.0, 3, now=100.0)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 1.0)
+
+        allowed, wait = self.store.take("k", 1.0, 3, now=100.5)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 0.5)
+
+        self.assertTrue(self.store.take("k", 1.0, 3, now=101.0)[0])
+        # refills stop at burst
+        for _ in range(3):
+            self.assertTrue(self.store.take("k", 1.0, 3, now=1000.0)[0])
+        self.assertFalse(self.store.take("k", 1.0, 3, now=1000.0)[0])
+
+    def test_matches_memory_store(self):
+        """Test that the script gives the same answers as MemoryBucketStore."""
+
+        memory = MemoryBucketStore()
+        times = [0.0, 0.0, 0.1, 0.2, 3.0, 3.0, 3.0, 3.1, 7.5, 7.5, 7.6, 30.0, 30.0]
+
+        for now in times:
+            for key in ("user:alice", "ip:10.0.0.1"):
+                expected = memory.take(key, 0.5, 2, now)
+                allowed, wait = self.store.take(key, 0.5, 2, now)
+                self.assertEqual(allowed, expected[0])
+                self.assertAlmostEqual(wait, expected[1])
+
+    def test_expiry_and_clear(self):
+        """Test that a bucket expires once it would be full again, and clear drops them all."""
+
+        self.store.take("k", 0.5, 2, now=0.0)
+        self.store.take("other", 0.5, 2, now=0.0)
+        self.client.set("unrelated", 1)
+
+        self.assertTrue(3000 < self.client.pttl("throttle:k") <= 4000)
+
+        self.store.clear()
+
+        self.assertEqual(self.client.keys("throttle:*"), [])
+        self.assertEqual(self.client.get("unrelated"), b"1")
+
+
+class LoginThrottleTestCase(TestCase):
+    """Tests for the per-username and per-IP login limits."""
+
+    def setUp(self):
+        self.throttle = LoginThrottle()
+        self.throttle.user_rate = 0.001
+        self.throttle.user_burst = 2
+        self.throttle.ip_rate = 0.001
+        self.throttle.ip_burst = 3
+
+    def test_username_limit(self):
+        """Test that one username is throttled regardless of address."""
+
+        self.throttle.check("alice", "10.0.0.1")
+        self.throttle.check("alice", "10.0.0.2")
+
+        with self.assertRaises(Throttled) as cm:
+            self.throttle.check("alice", "10.0.0.3")
+        self.assertGreaterEqual(cm.exception.retry_after, 1)
+
+    def test_ip_limit(self):
+        """Test that one address is throttled across usernames."""
+
+        for name in ("a", "b", "c"):
+            self.throttle.check(name, "10.0.0.1")
+
+        with self.assertRaises(Throttled):
+            self.throttle.check("d", "10.0.0.1")
+
+    def test_disabled(self):
+        """Test that a disabled throttle lets everything through."""
+
+        self.throttle.enabled = False
+
+        for _ in range(10):
+            self.throttle.check("alice", "10.0.0.1")
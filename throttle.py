@@ -0,0 +1,166 @@
+"""Token-bucket throttling for login attempts.
+
+A failed login still pays for a full bcrypt verification, so repeated bad
+attempts against one account, or from one address, burn CPU. LoginThrottle
+keeps a token bucket per username and per client IP and turns requests away
+before any database lookup or hashing once a bucket is empty.
+
+Buckets live in a bucket store. MemoryBucketStore keeps them in-process and
+evicts the least recently used ones past max_keys, so memory stays flat no
+matter how many distinct keys show up. RedisBucketStore shares buckets across
+processes through any client with a redis-py style eval(); it is used when
+LOGIN_THROTTLE_REDIS_URL is set.
+
+Each app has its own LoginThrottle in app.extensions["login_throttle"];
+`login_throttle` is the current app's.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+
+class Throttled(Exception):
+    """Raised when a bucket is empty; retry_after is in whole seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"throttled, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class MemoryBucketStore:
+    """Process-local token buckets with LRU eviction."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """
+        Take one token from key's bucket, refilling at rate tokens per second
+        up to burst. Return (allowed, seconds until a token is available).
+        """
+
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+
+            if tokens >= 1:
+                allowed, wait = True, 0.0
+                tokens -= 1
+            else:
+                allowed, wait = False, (1 - tokens) / rate
+
+            # reinserting moves the key to the most recently used end
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# KEYS[1] = bucket key; ARGV = rate, burst, now
+_TAKE_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local stamp = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - stamp) * rate)
+local allowed, wait = 0, (1 - tokens) / rate
+if tokens >= 1 then
+    allowed, wait, tokens = 1, 0, tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring(wait)}
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared between processes through a Redis server."""
+
+    def __init__(self, client, prefix="throttle:"):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key, rate, burst, now):
+        allowed, wait = self.client.eval(_TAKE_SCRIPT, 1, self.prefix + key, rate, burst, now)
+        return bool(allowed), float(wait)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class LoginThrottle:
+    """Per-username and per-IP login rate limits."""
+
+    def __init__(self, app=None, store=None):
+        self.enabled = True
+        # each username gets 5 attempts, then one more every 12 seconds
+        self.user_rate = 5 / 60
+        self.user_burst = 5
+        # each address gets 20 attempts, then one more per second
+        self.ip_rate = 1.0
+        self.ip_burst = 20
+        self.store = store or MemoryBucketStore()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read limits from app.config."""
+
+        self.enabled = app.config.setdefault("LOGIN_THROTTLE_ENABLED", self.enabled)
+        self.user_rate = app.config.setdefault("LOGIN_THROTTLE_USER_RATE", self.user_rate)
+        self.user_burst = app.config.setdefault("LOGIN_THROTTLE_USER_BURST", self.user_burst)
+        self.ip_rate = app.config.setdefault("LOGIN_THROTTLE_IP_RATE", self.ip_rate)
+        self.ip_burst = app.config.setdefault("LOGIN_THROTTLE_IP_BURST", self.ip_burst)
+
+        max_keys = app.config.setdefault("LOGIN_THROTTLE_MAX_KEYS", 100000)
+        redis_url = app.config.setdefault("LOGIN_THROTTLE_REDIS_URL", None)
+
+        if redis_url:
+            # redis is only needed when buckets are shared between processes
+            import redis
+            self.store = RedisBucketStore(redis.Redis.from_url(redis_url))
+        elif isinstance(self.store, MemoryBucketStore):
+            self.store.max_keys = max_keys
+
+        app.extensions["login_throttle"] = self
+
+    def check(self, username, ip):
+        """Spend one attempt for username and ip, or raise Throttled."""
+
+        if not self.enabled:
+            return
+
+        now = time.time()
+
+        # check the address first so a throttled client can't drain a user's bucket
+        for key, rate, burst in ((f"ip:{ip}", self.ip_rate, self.ip_burst),
+                                 (f"user:{username}", self.user_rate, self.user_burst)):
+            allowed, wait = self.store.take(key, rate, burst, now)
+            if not allowed:
+                raise Throttled(max(1, math.ceil(wait)))
+
+    def reset(self):
+        """Forget every bucket."""
+
+        self.store.clear()
+
+
+# the current app's throttle
+login_throttle = LocalProxy(lambda: current_app.extensions["login_throttle"])
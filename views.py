@@ -0,0 +1,402 @@
+"""The app's HTML views: registration, login, user pages and feedback."""
+
+from flask import Blueprint, current_app, render_template, flash, redirect, session, request, abort, g, Response, stream_with_context
+from markupsafe import Markup
+from sqlalchemy.orm import joinedload
+from models import db, User, Feedback
+from hashing import HashingQueueFull
+from admission import limit, Overloaded
+from throttle import login_throttle, Throttled
+from cache import user_page_cache, layout_cache
+from sessions import server_sessions
+import metrics
+import exporter
+import routing
+import templating
+
+from forms import AddUserForm, LoginUserForm, AddFeedbackForm, EditFeedbackForm
+
+views = Blueprint("views", __name__)
+
+@views.app_errorhandler(404)
+def not_found(e):
+    return render_template("404.html"), 404
+
+@views.app_errorhandler(HashingQueueFull)
+def hashing_busy(e):
+    """Tell clients to back off while the hashing pool is saturated."""
+    return render_template("503.html"), 503, {"Retry-After": "1"}
+
+@views.app_errorhandler(Overloaded)
+def login_overloaded(e):
+    """Shed hashing requests once the admission queue is full."""
+    return render_template("503.html"), 503, {"Retry-After": str(e.retry_after)}
+
+def get_current_user():
+    """Return the logged-in User, or None; loaded at most once per request."""
+    
+    if "current_user" not in g:
+        username = session.get("user_id")
+        g.current_user = User.query.get(username) if username else None
+    
+    return g.current_user
+
+@views.route("/metrics")
+def show_metrics():
+    """Serve metrics in the Prometheus text format, if METRICS_ENABLED is set."""
+    
+    if not current_app.config["METRICS_ENABLED"]:
+        abort(404)
+    
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@views.route("/")
+def show_index():
+    """Redirect to /register."""
+    
+    if session.get("user_id"):
+        # if user is logged in, redirect to user page
+        return redirect(f'/users/{session["user_id"]}')
+    
+    return redirect("/register")
+
+@views.route("/register", methods=["GET", "POST"])
+@limit
+def handle_register():
+    """Handle GET and POST requests to /register."""
+    
+    form = AddUserForm()
+
+    if form.validate_on_submit():
+        username = form.username.data
+        password = form.password.data
+        email = form.email.data
+        first_name = form.first_name.data
+        last_name = form.last_name.data
+
+        user = User.register(username=username, password=password, email=email, first_name=first_name, last_name=last_name)
+        db.session.add(user)
+        db.session.commit()
+
+        session["user_id"] = user.username
+        return redirect(f"/users/{user.username}")
+    
+    else:
+        return render_template("register.html", form=form)
+    
+@views.route("/login", methods=["GET", "POST"])
+@limit
+@routing.replica_reads
+def handle_login():
+    """Handle GET and POST requests to /login."""
+    
+    form = LoginUserForm()
+
+    if form.validate_on_submit():
+        username = form.username.data
+        password = form.password.data
+
+        # turn away repeated attempts before they cost a query or a hash
+        try:
+            login_throttle.check(username, request.remote_addr)
+        except Throttled as e:
+            flash("Too many login attempts. Please wait and try again.", "error")
+            return render_template("login.html", form=form), 429, {"Retry-After": str(e.retry_after)}
+
+        user = User.authenticate(username=username, password=password)
+
+        if user:
+            session["user_id"] = user.username
+            return redirect(f"/users/{username}")
+        
+        else:
+            flash("Wrong username or password.", "error")
+            form.username.errors = ["Bad name/password"]
+        
+    return render_template("login.html", form=form)
+
+    
+@views.route("/users/<username>")
+def show_user_details(username):
+    """Return the text “You made it!”"""
+    
+    # ?all=1 streams every feedback item to the user, or to support staff
+    viewer = session.get("user_id")
+    if request.args.get("all", type=int) == 1 and viewer and (
+            viewer == username or viewer in current_app.config["SUPPORT_USERS"]):
+        
+        user = User.query.get_or_404(username)
+        
+        # rows come off a server-side cursor a batch at a time, and are sent as they render
+        feedback = exporter.query_rows("feedback", username=username,
+                                       batch_size=current_app.config["FEEDBACK_STREAM_BATCH"])
+        page = templating.stream_template("user_feedback.html", user=user, feedback=feedback)
+        return Response(stream_with_context(page), mimetype="text/html")
+    
+    # Show user details if session id matches user url
+    if session.get("user_id") == username:
+        
+        # keyset pagination: ?after=<id> for the next page, ?before=<id> for the previous one
+        limit = request.args.get("limit", current_app.config["FEEDBACK_PAGE_SIZE"], type=int)
+        limit = max(1, min(limit, current_app.config["FEEDBACK_PAGE_MAX"]))
+        after = request.args.get("after", type=int)
+        before = request.args.get("before", type=int)
+        
+        # the details fragment is cached until one of the write views invalidates it
+        details = user_page_cache.get(username, (after, before, limit))
+        
+        if details is None:
+            user, page = User.with_feedback_page(username, after=after, before=before, limit=limit)
+            g.current_user = user
+            details = Markup(render_template("_user_details.html", user=user, page=page, limit=limit))
+            
+            if user:
+                user_page_cache.set(username, (after, before, limit), details)
+        
+        return render_template("user.html", username=username, details=details)
+    
+    # else redirect them to their own user details if they are a different user
+    elif session.get("user_id"):
+        user = session["user_id"]
+        return redirect(f"/users/{user}")
+    
+    # else redirect to home if they are not logged in
+    else:
+        return redirect("/")
+
+@views.route("/users/<username>/delete", methods=["GET", "POST"])
+def delete_user(username):
+    """
+    Remove user, remove all feedback, and clear user info from session.
+    Redirect to /.
+    """
+    
+    if request.method == 'POST' and session.get("user_id") == username:
+            
+        # delete from db in one statement; the foreign key cascades to their feedback
+        deleted = User.query.filter_by(username=username).delete()
+        if not deleted:
+            abort(404)
+        db.session.commit()
+        user_page_cache.invalidate(username)
+        layout_cache.invalidate(username)
+        
+        # end the user's other sessions too, when sessions are kept server-side
+        server_sessions.revoke_user(username)
+        
+        # clear session
+        session.pop("user_id")
+
+        # return to redirect
+        return redirect("/")
+
+    else:
+        flash("Cannot delete other users.", "error")
+        return redirect(f"/users/{session['user_id']}")
+    
+    
+@views.route("/users/<username>/export")
+def export_user_feedback(username):
+    """
+    Stream a user's feedback as NDJSON or CSV (?format=csv), gzipped with ?gzip=1.
+    Only the user themselves may export it.
+    """
+    
+    if session.get("user_id") == username:
+        
+        format = request.args.get("format", "ndjson")
+        if format not in exporter.FORMATS:
+            abort(400)
+        compress = request.args.get("gzip", type=int) == 1
+        
+        filename = f"{username}-feedback.{format}" + (".gz" if compress else "")
+        mimetype = "application/gzip" if compress else exporter.FORMATS[format]
+        
+        # rows are read and sent as the client downloads them, never all at once
+        chunks = exporter.export("feedback", format, username=username, compress=compress)
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={"Content-Disposition": f"attachment; filename={filename}"})
+    
+    # else redirect them to their own export if they are a different user
+    elif session.get("user_id"):
+        user = session["user_id"]
+        return redirect(f"/users/{user}/export")
+    
+    # else redirect to home if they are not logged in
+    return redirect("/")
+    
+    
+# ----------------------------------------------------------------
+# Feedback views
+# ----------------------------------------------------------------
+@views.route("/users/<username>/feedback/add", methods=["GET", "POST"])
+def handle_feedback_add(username):
+    """
+    Handle GET and POST requests for adding feedback.
+    Display a form to add feedback Make sure that only the user who is logged in can see this form
+    """
+    
+    # Show feedback form if session id matches user url
+    if session.get("user_id") == username:
+        
+        # a session can outlive its user; their feedback would break the foreign key
+        user = get_current_user() or abort(404)
+        form = AddFeedbackForm()
+        
+        if form.validate_on_submit():
+            title = form.title.data
+            content = form.content.data
+            
+            # create instance of Feedback object
+            feedback = Feedback(title=title, content=content, username=username)
+            
+            # add feedback to database
+            db.session.add(feedback)
+            db.session.commit()
+            user_page_cache.invalidate(username)
+            
+            # return user back to username page
+            return redirect(f"/users/{username}")
+        
+        else:
+            return render_template("/feedback/add.html", form=form, user=user)
+
+    # else redirect them to their own user feedback form if they are a different user
+    elif session.get("user_id"):
+        user = session["user_id"]
+        return redirect(f"/users/{user}/feedback/add")
+    
+    # else redirect to home if they are not logged in
+    return redirect("/")
+            
+def render_search(username=None):
+    """Run the search in ?q= (page ?page=) and render the results."""
+    
+    terms = request.args.get("q", "")
+    page = max(1, request.args.get("page", 1, type=int))
+    
+    results = Feedback.search(terms, username=username, page=page,
+                              limit=current_app.config["FEEDBACK_PAGE_SIZE"],
+                              max_matches=current_app.config["SEARCH_MAX_MATCHES"])
+    
+    return render_template("/feedback/search.html", terms=terms, username=username,
+                           results=results, action=request.path)
+
+@views.route("/users/<username>/feedback/search")
+def search_user_feedback(username):
+    """Search a user's own feedback."""
+    
+    if session.get("user_id") == username:
+        return render_search(username)
+    
+    # else redirect them to search their own feedback if they are a different user
+    elif session.get("user_id"):
+        user = session["user_id"]
+        return redirect(f"/users/{user}/feedback/search")
+    
+    # else redirect to home if they are not logged in
+    return redirect("/")
+
+@views.route("/feedback/search")
+def search_all_feedback():
+    """Search everyone's feedback; only for users listed in SUPPORT_USERS."""
+    
+    if session.get("user_id") in current_app.config["SUPPORT_USERS"]:
+        return render_search()
+    
+    elif session.get("user_id"):
+        user = session["user_id"]
+        return redirect(f"/users/{user}/feedback/search")
+    
+    return redirect("/")
+            
+@views.route("/feedback/<int:id>/update", methods=["GET", "POST"])
+def handle_feedback_update(id):
+    """
+    Handle GET and POST requests for adding feedback.
+    Display a form to edit feedback — 
+    Update a specific piece of feedback and redirect to /users/
+    **Make sure that only the user who has written that feedback can see this form.
+    """
+    if session.get('user_id') is None:
+        return redirect('/')
+    
+    # request feedback item along with the user who wrote it
+    feedback = Feedback.query.options(joinedload(Feedback.user)).get(id)
+    
+    if feedback is None:
+        # if feedback item does not exist
+        flash(f"Feedback item {id} does not exist", "error")
+        return redirect('/')
+    
+    user = feedback.user
+    username = feedback.username
+            
+    # if the current user matches the feedback item's username
+    if session.get("user_id") == username:
+        form = EditFeedbackForm(obj=feedback)
+    
+        if form.validate_on_submit():
+            feedback.title = form.title.data
+            feedback.content = form.content.data
+            
+            # update feedback to database
+            db.session.commit()
+            user_page_cache.invalidate(username)
+            
+            # return user back to username page
+            flash("changes saved!", "success")
+            return redirect(f"/users/{username}")
+        
+        else:
+            return render_template("/feedback/edit.html", form=form, user=user, feedback=feedback)
+        
+    # else if current user does not match feedback item's username, redirect to user's page
+    elif session.get("user_id"):
+        flash(f"Feedback item {id} belongs to another user. Please select a feedback item from the list below.", "error")
+        return redirect(f"/users/{session['user_id']}")
+    
+    # else if not logged in, return to home
+    return redirect("/")
+
+@views.route("/feedback/<int:id>/delete", methods=["GET", "POST"])
+def delete_feedback(id):
+    """
+    Delete a specific piece of feedback and redirect to /users/ — 
+    Make sure that only the user who has written that feedback can delete it
+    """
+    
+    # request feedback item
+    feedback = Feedback.query.get(id)
+    
+    if feedback is None:
+        # if feedback item does not exist
+        flash(f"Feedback item {id} does not exist", "error")
+        return redirect('/')
+    
+    username = feedback.username
+    
+    if session.get("user_id") == username:
+        
+        db.session.delete(feedback)
+        db.session.commit()
+        user_page_cache.invalidate(username)
+        
+        flash(f'Feedback item {id} deleted.', "success")
+        return redirect(f'/users/{username}')
+    
+    elif session.get("user_id"):
+        flash(f'Feedback item {id} belongs to another user. Please select a feedback item below.', "error")
+        return redirect(f'/users/{session["user_id"]}')
+
+    else:
+        return redirect('/')
+    
+@views.route("/logout")
+def handle_logout():
+    """Log the user and remove them from the session."""
+    
+    if session.get("user_id"):
+        session.pop("user_id")
+    
+    return redirect("/")
\ No newline at end of file